@@ -0,0 +1,126 @@
+import json
+import os
+import random
+from typing import List, Tuple
+
+from easylang_de.genus import DETERMINERS
+
+# Synthetic German vocabulary, so that the benchmarks don't need the real
+# transcriptions and dictionary, which can't be shared
+NOUNS = [
+    ("hund", "m"),
+    ("tisch", "m"),
+    ("zug", "m"),
+    ("bahnhof", "m"),
+    ("kaffee", "m"),
+    ("lehrer", "m"),
+    ("katze", "f"),
+    ("stadt", "f"),
+    ("lampe", "f"),
+    ("aufgabe", "f"),
+    ("stellung", "f"),
+    ("tür", "f"),
+    ("haus", "n"),
+    ("auto", "n"),
+    ("buch", "n"),
+    ("wort", "n"),
+    ("kind", "n"),
+    ("fenster", "n"),
+    ("see", "m"),
+    ("see", "f"),
+]
+PREFIXES = ["schreib", "haus", "auto", "kinder", "stadt", "bahn", "küchen", "winter"]
+ADJECTIVES = ["große", "kleinen", "neues", "alten", "schöner", "deutsche"]
+VERBS = ["sieht", "kauft", "sucht", "findet", "hat", "mag"]
+CASES = ["Nom", "Acc", "Dat", "Gen"]
+NUMBERS = ["Sing", "Plur"]
+GENDERS = {"m": "Masc", "f": "Fem", "n": "Neut"}
+
+
+def dictionary_entries(n: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    Returns n (noun, genus) entries: the base nouns plus generated compounds,
+    which take the genus of their last part
+    """
+    rng = random.Random(seed)
+    entries = list(NOUNS)
+    while len(entries) < n:
+        parts = rng.sample(PREFIXES, rng.randint(1, 3))
+        head, genus = rng.choice(NOUNS)
+        entries.append(("".join(parts) + head + str(len(entries)), genus))
+    return entries[:n]
+
+
+def write_dictionary(path: str, n: int, seed: int = 0):
+    with open(path, "w") as f:
+        f.write("noun,genus\n")
+        for noun, genus in dictionary_entries(n, seed):
+            f.write(f"{noun},{genus}\n")
+
+
+def transcript_text(sentences: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    ret = []
+    for _ in range(sentences):
+        subject = rng.choice(NOUNS)[0].capitalize()
+        obj = rng.choice(NOUNS)[0].capitalize()
+        ret.append(
+            f"{rng.choice(['Der', 'Die', 'Das'])} {subject} {rng.choice(VERBS)} "
+            f"{rng.choice(['den', 'die', 'das', 'einen', 'eine'])} "
+            f"{rng.choice(ADJECTIVES)} {obj}."
+        )
+    return " ".join(ret)
+
+
+def token(text: str, pos: str, morph: dict, lemma: str = None) -> dict:
+    return {
+        "text": text,
+        "pos": pos,
+        "dep": "nk",
+        "morph": morph,
+        "lemma": lemma or text,
+        "tag": "NN" if pos == "NOUN" else "ART",
+    }
+
+
+def noun_spans(n: int, rng: random.Random) -> List[List[dict]]:
+    spans = []
+    for _ in range(n):
+        noun, genus = rng.choice(NOUNS)
+        morph = {
+            "Case": rng.choice(CASES),
+            "Gender": GENDERS[genus],
+            "Number": rng.choice(NUMBERS),
+        }
+        # Some nouns don't have a case, like in the real corpus
+        if rng.random() < 0.01:
+            del morph["Case"]
+        span = [token(rng.choice(DETERMINERS), "DET", {"PronType": "Art"})]
+        if rng.random() < 0.3:
+            span.append(token(rng.choice(ADJECTIVES), "ADJ", {}))
+        span.append(token(noun.capitalize(), "NOUN", morph, noun.capitalize()))
+        spans.append(span)
+    return spans
+
+
+def noun_document(i: int, spans: int, rng: random.Random) -> dict:
+    video_id = f"video{i:07d}"
+    return {
+        "video_id": video_id,
+        "video_title": f"Synthetic video {i} ｜ Easy German {i}",
+        "video_link": f"https://www.youtube.com/watch?v={video_id}",
+        "nouns": noun_spans(spans, rng),
+    }
+
+
+def write_noun_corpus(directory: str, files: int, spans: int = 100, seed: int = 0):
+    """
+    Writes files synthetic noun files in the layout of nouns/*.json
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(files):
+        document = noun_document(i, spans, rng)
+        name = f"{document['video_title']} [{document['video_id']}].json"
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump(document, f, indent=2)
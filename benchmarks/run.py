@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+from benchmarks import fixtures
+
+# Metrics ending with these suffixes are better when higher, the others
+# (durations in seconds) are better when lower
+HIGHER_IS_BETTER = ("_per_sec",)
+
+SPACY_MODELS = ["de_dep_news_trf", "de_core_news_lg", "de_core_news_sm"]
+
+
+def timed(function: Callable, repeat: int = 3) -> float:
+    """
+    Returns the fastest of repeat runs of function, in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_genus(n: int) -> Dict[str, float]:
+    from easylang_de.genus import (
+        DETERMINER_CODES,
+        DETERMINERS,
+        KASUS_CODES,
+        NUMERUS_CODES,
+        RESOLVERS,
+        Genus,
+        Kasus,
+        Numerus,
+        check_possible_genera_batch,
+        genera_mask,
+    )
+
+    rng = random.Random(0)
+    checks = [
+        (
+            rng.choice(DETERMINERS),
+            rng.choice(list(Kasus)),
+            rng.choice(list(Numerus)),
+            rng.sample(list(Genus), rng.randint(1, 2)),
+        )
+        for _ in range(n)
+    ]
+
+    def check():
+        for det, kasus, numerus, genera in checks:
+            RESOLVERS[det].check_possible_genera(kasus, numerus, genera)
+
+    codes = (
+        [DETERMINER_CODES[det] for det, _, _, _ in checks],
+        [KASUS_CODES[kasus] for _, kasus, _, _ in checks],
+        [NUMERUS_CODES[numerus] for _, _, numerus, _ in checks],
+        [genera_mask(genera) for _, _, _, genera in checks],
+    )
+
+    return {
+        "checks_per_sec": n / timed(check),
+        "batch_checks_per_sec": n / timed(lambda: check_possible_genera_batch(*codes)),
+    }
+
+
+def bench_dictionary(n: int, lookups: int) -> Dict[str, float]:
+    from easylang_de.dictionary import GenderDictionary, build, read_csv
+
+    fixtures.write_dictionary("bench_nomen_genus.csv", n)
+    nouns = [noun for noun, _ in fixtures.dictionary_entries(n)]
+    rng = random.Random(0)
+    queries = [rng.choice(nouns) for _ in range(lookups)]
+    compounds = [rng.choice(fixtures.PREFIXES) + q for q in queries]
+
+    build_seconds = timed(
+        lambda: build("bench_nomen_genus.csv", "bench_nomen_genus.bin")
+    )
+
+    def load():
+        # Includes the first lookup, so that anything deferred to it is timed
+        dictionary = GenderDictionary("bench_nomen_genus.bin")
+        dictionary.get(queries[0])
+        return dictionary
+
+    load_seconds = timed(load)
+    dictionary = load()
+
+    return {
+        "csv_parse_seconds": timed(lambda: read_csv("bench_nomen_genus.csv")),
+        "build_seconds": build_seconds,
+        "load_seconds": load_seconds,
+        "lookups_per_sec": lookups
+        / timed(lambda: [dictionary.get(q) for q in queries]),
+        "compound_lookups_per_sec": lookups
+        / timed(lambda: [dictionary.get_compound(c) for c in compounds]),
+    }
+
+
+def bench_extract(sentences: int) -> Dict[str, float]:
+    try:
+        import spacy.util
+    except ImportError:
+        return {}
+
+    from easylang_de.extract_nouns import extract_nouns_headless, load_model
+
+    text = fixtures.transcript_text(sentences)
+    ret = {}
+    for model in SPACY_MODELS:
+        # Only benchmark installed models, load_model would download the others
+        if not spacy.util.is_package(model):
+            continue
+        tokens = len(load_model(model).make_doc(text))
+        seconds = timed(lambda: extract_nouns_headless(text, model=model), repeat=1)
+        ret[f"{model}_tokens_per_sec"] = tokens / seconds
+
+    return ret
+
+
+def bench_noun_files(files: int, spans: int) -> Dict[str, float]:
+    rng = random.Random(0)
+    documents = [fixtures.noun_document(i, spans, rng) for i in range(files)]
+    os.makedirs("bench_noun_files", exist_ok=True)
+    paths = [os.path.join("bench_noun_files", f"{i}.json") for i in range(files)]
+
+    def write():
+        for document, path in zip(documents, paths):
+            with open(path, "w") as f:
+                json.dump(document, f, indent=2)
+
+    def read():
+        for path in paths:
+            with open(path) as f:
+                json.load(f)
+
+    write_seconds = timed(write)
+    size = sum(os.path.getsize(path) for path in paths)
+
+    return {
+        "write_seconds": write_seconds,
+        "read_seconds": timed(read),
+        "write_mb_per_sec": size / 2**20 / write_seconds,
+        "bytes_per_file": size / files,
+    }
+
+
+def bench_error_rate(files: int, spans: int, n_process: int) -> Dict[str, float]:
+    # calculate_error_rate loads the dictionary from the working directory
+    fixtures.write_dictionary("nomen_genus.csv", 5000)
+    fixtures.write_noun_corpus("bench_nouns", files, spans)
+
+    from easylang_de.calculate_error_rate import evaluate
+
+    ret = {
+        "evaluate_seconds": timed(lambda: evaluate("bench_nouns"), repeat=1),
+    }
+    if n_process > 1:
+        ret[f"evaluate_{n_process}_processes_seconds"] = timed(
+            lambda: evaluate("bench_nouns", n_process), repeat=1
+        )
+    ret["spans_per_sec"] = files * spans / ret["evaluate_seconds"]
+
+    return ret
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns the metrics that got worse than baseline by more than threshold,
+    as (stage, metric, baseline value, value)
+    """
+    regressions = []
+    for stage, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            old = baseline["results"].get(stage, {}).get(metric)
+            if not old or metric == "bytes_per_file":
+                continue
+            if metric.endswith(HIGHER_IS_BETTER):
+                worse = value < old * (1 - threshold)
+            else:
+                worse = value > old * (1 + threshold)
+            if worse:
+                regressions.append((stage, metric, old, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark every stage of the pipeline on synthetic fixtures"
+    )
+    parser.add_argument("--output", type=str, help="Save the results to this JSON file")
+    parser.add_argument("--baseline", type=str, help="Results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown against the baseline that counts as a regression",
+    )
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument("--spans", type=int, default=100)
+    parser.add_argument("--n-process", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        default=["genus", "dictionary", "extract", "noun_files", "error_rate"],
+    )
+    args = parser.parse_args()
+
+    stages = {
+        "genus": lambda: bench_genus(100_000),
+        "dictionary": lambda: bench_dictionary(50_000, 20_000),
+        "extract": lambda: bench_extract(200),
+        "noun_files": lambda: bench_noun_files(200, args.spans),
+        "error_rate": lambda: bench_error_rate(args.files, args.spans, args.n_process),
+    }
+
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": {},
+    }
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        for stage in args.stages:
+            print(f"Running {stage}...", file=sys.stderr)
+            results["results"][stage] = stages[stage]()
+        os.chdir(cwd)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for stage, metric, old, value in regressions:
+            print(f"Regression in {stage}.{metric}: {old:.4g} -> {value:.4g}")
+        if regressions:
+            sys.exit(1)
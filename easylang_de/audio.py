@@ -0,0 +1,279 @@
+import argparse
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from tqdm import tqdm
+
+# Silences quieter than this, and at least this long, are used as cut points
+SILENCE_NOISE_DB = -30
+SILENCE_MIN_DURATION = 0.5
+
+# Fraction of the upload limit a chunk should fill, to leave room for the
+# variation of the bitrate
+CHUNK_FILL = 0.9
+
+SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+
+
+def probe_duration(path: str) -> float:
+    """
+    Returns the duration of a media file in seconds, using ffprobe
+    """
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(output.stdout)
+
+
+def detect_silences(
+    path: str,
+    noise_db: float = SILENCE_NOISE_DB,
+    min_duration: float = SILENCE_MIN_DURATION,
+) -> List[Tuple[float, float]]:
+    """
+    Returns the (start, end) times in seconds of the silences in an audio file
+    """
+    output = subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-nostats",
+            "-i",
+            path,
+            "-af",
+            f"silencedetect=noise={noise_db}dB:d={min_duration}",
+            "-f",
+            "null",
+            "-",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    starts = [float(s) for s in SILENCE_START.findall(output.stderr)]
+    ends = [float(s) for s in SILENCE_END.findall(output.stderr)]
+
+    return list(zip(starts, ends))
+
+
+def plan_chunks(
+    duration: float,
+    size: int,
+    max_size: int,
+    silences: List[Tuple[float, float]],
+) -> List[Tuple[float, float]]:
+    """
+    Splits [0, duration] into (start, end) chunks that each stay below max_size
+    bytes, assuming a constant bitrate. Chunks are cut in the middle of the
+    latest silence before the size limit, or at the limit if there is none.
+    """
+    max_length = duration * max_size * CHUNK_FILL / size
+    cut_points = [(start + end) / 2 for start, end in silences]
+
+    chunks = []
+    start = 0.0
+    while duration - start > max_length:
+        limit = start + max_length
+        candidates = [cut for cut in cut_points if start < cut <= limit]
+        end = candidates[-1] if candidates else limit
+        chunks.append((start, end))
+        start = end
+    chunks.append((start, duration))
+
+    return chunks
+
+
+def cut_chunk(path: str, start: float, end: float, output: str):
+    """
+    Copies [start, end] of an audio file to output, without re-encoding
+    """
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-ss",
+            str(start),
+            "-t",
+            str(end - start),
+            "-i",
+            path,
+            "-c",
+            "copy",
+            output,
+        ],
+        check=True,
+    )
+
+
+def split_audio(path: str, max_size: int, output_dir: str) -> List[Tuple[str, float]]:
+    """
+    Splits an audio file at silences into chunks below max_size bytes in
+    output_dir. Returns the chunk files with their offsets in seconds.
+    The plan assumes a constant bitrate, so a cut chunk that is still too
+    large, e.g. of a VBR file, is planned again from its own size and split.
+    """
+    duration = probe_duration(path)
+    silences = detect_silences(path)
+    chunks = plan_chunks(duration, os.path.getsize(path), max_size, silences)
+    # Planned again from the end, so that the chunks are cut in order
+    chunks.reverse()
+
+    ret = []
+    extension = os.path.splitext(path)[1]
+    while chunks:
+        start, end = chunks.pop()
+        output = os.path.join(output_dir, f"chunk_{len(ret):03d}{extension}")
+        cut_chunk(path, start, end, output)
+
+        size = os.path.getsize(output)
+        if size > max_size:
+            # plan_chunks works from 0, so the silences are shifted to the chunk
+            parts = plan_chunks(
+                end - start,
+                size,
+                max_size,
+                [(s - start, e - start) for s, e in silences if start < s < end],
+            )
+            chunks.extend(
+                (start + part_start, start + part_end)
+                for part_start, part_end in reversed(parts)
+            )
+            continue
+
+        ret.append((output, start))
+
+    return ret
+
+
+# Compressed speech versions of the audio files are cached next to them, named
+# after the settings they were made with
+SPEECH_SUFFIX = ".speech"
+SPEECH_SAMPLE_RATE = 16000
+SPEECH_BITRATE = "24k"
+
+# Removes the trailing silence by removing the leading silence of the reversed
+# audio. Leading silence is kept so that timestamps stay aligned with the video.
+TRIM_FILTER = "areverse,silenceremove=start_periods=1:start_threshold=-50dB,areverse"
+
+
+def speech_file(
+    path: str,
+    sample_rate: int = SPEECH_SAMPLE_RATE,
+    bitrate: str = SPEECH_BITRATE,
+    trim: bool = False,
+) -> str:
+    """
+    Returns the compressed file of an audio file, e.g. name.speech.16000.24k.ogg
+    """
+    settings = f"{SPEECH_SUFFIX}.{sample_rate}.{bitrate}"
+    if trim:
+        settings += ".trim"
+    return os.path.splitext(path)[0] + settings + ".ogg"
+
+
+def compress(
+    path: str,
+    sample_rate: int = SPEECH_SAMPLE_RATE,
+    bitrate: str = SPEECH_BITRATE,
+    trim: bool = False,
+) -> str:
+    """
+    Transcodes an audio file to mono, low sample rate, low bitrate Opus, which
+    is enough for speech recognition, optionally trimming the trailing silence.
+    The result is cached next to the original, in a file named after the
+    settings, and reused while it is newer. Returns the compressed file.
+    """
+    output = speech_file(path, sample_rate, bitrate, trim)
+    if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(path):
+        return output
+
+    # Write to a temporary file first, so that an interrupted run doesn't
+    # leave a truncated file in the cache
+    tmp_output = os.path.join(
+        os.path.dirname(output), "." + os.path.basename(output) + ".tmp"
+    )
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path]
+    command += ["-vn", "-ac", "1", "-ar", str(sample_rate)]
+    command += ["-c:a", "libopus", "-b:a", bitrate, "-application", "voip"]
+    if trim:
+        command += ["-af", TRIM_FILTER]
+    command += ["-f", "ogg", tmp_output]
+
+    try:
+        subprocess.run(command, check=True)
+    except BaseException:
+        # ffmpeg may have written part of it before failing
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise
+    os.replace(tmp_output, output)
+
+    return output
+
+
+def compress_all(
+    paths: List[str], workers: int = os.cpu_count(), **kwargs
+) -> Tuple[int, int]:
+    """
+    Compresses the audio files in a pool of workers, each running ffmpeg.
+    Returns the total size in bytes before and after.
+    """
+    with ThreadPoolExecutor(workers) as executor:
+        outputs = list(
+            tqdm(
+                executor.map(lambda path: compress(path, **kwargs), paths),
+                total=len(paths),
+            )
+        )
+
+    before = sum(os.path.getsize(path) for path in paths)
+    after = sum(os.path.getsize(output) for output in outputs)
+    return before, after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compress the audio files for transcription"
+    )
+    parser.add_argument("--data-dir", type=str, default="data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--sample-rate", type=int, default=SPEECH_SAMPLE_RATE)
+    parser.add_argument("--bitrate", type=str, default=SPEECH_BITRATE)
+    parser.add_argument("--trim", action="store_true", help="Trim the trailing silence")
+    args = parser.parse_args()
+
+    mp3_files = sorted(
+        os.path.join(args.data_dir, f)
+        for f in os.listdir(args.data_dir)
+        if f.endswith(".mp3")
+    )
+    before, after = compress_all(
+        mp3_files,
+        args.workers,
+        sample_rate=args.sample_rate,
+        bitrate=args.bitrate,
+        trim=args.trim,
+    )
+
+    print(f"Original size:   {before / 2**20:.1f} MB")
+    print(f"Compressed size: {after / 2**20:.1f} MB")
+    print(f"Saved:           {(before - after) / 2**20:.1f} MB")
@@ -1,45 +1,478 @@
+import argparse
 import json
 import os
+import sys
+from bisect import bisect_right
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
-from extract_nouns import extract_nouns
 from tqdm import tqdm
 
+from easylang_de.cache import file_sha256, load_json, write_json_atomic
+from easylang_de.extract_nouns import (
+    EXTRACTOR_VERSION,
+    LEAN_TOKEN_FIELDS,
+    TOKEN_FIELDS,
+    MODEL,
+    extract_noun_spans,
+    extract_nouns_headless,
+    find_noun_spans,
+    headless_disable,
+    load_model,
+    model_version,
+    serialize_token,
+)
+from easylang_de.index import INDEX_FILE, add_document, connect, file_key
+from easylang_de.instrument import metrics, profile
+
+if TYPE_CHECKING:
+    from spacy.tokens import Doc
+
 DATA_DIR = "transcriptions"
 OUTPUT_DIR = "nouns"
 
-# Get all json files in the current directory
-json_files = [f for f in os.listdir(DATA_DIR) if f.endswith(".json")]
+BATCH_SIZE = 4
+N_PROCESS = 1
 
-json_files = sorted(json_files)
+# Records for every noun file the inputs it was computed from. It doesn't end
+# with .json so that it isn't picked up as a noun file.
+MANIFEST_FILE = ".manifest"
+# The manifest is saved after this many written files, and once at the end
+MANIFEST_FLUSH_FILES = 50
 
-# Create the output directory if it doesn't exist
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+# Maximum number of characters of consecutive transcription segments that are
+# processed as one document in segment mode
+SEGMENT_CHARS = 2000
 
-for file in tqdm(json_files):
+
+def video_info(file: str) -> dict:
+    """
+    Parses the video id, title and link from a transcription file name
+    """
     video_name = file.replace(".json", "")
     # Video name is in the format:
     # "10 Austrian Words that Germans don't understand ｜ Easy German 222 [sOXjxZY4FUg]"
-    # Create json target file name in output directory
-    json_file = os.path.join(OUTPUT_DIR, file)
-
-    # If the json file already exists, skip it
-    if os.path.exists(json_file):
-        continue
-
     # Split the last space and get the video id
     video_id = video_name.split(" ")[-1].replace("[", "").replace("]", "")
     video_title = " ".join(video_name.split(" ")[:-1])
     video_link = f"https://www.youtube.com/watch?v={video_id}"
 
-    data = json.load(open(os.path.join(DATA_DIR, file), "r"))
-    text = data["text"]
-    doc_spacy, options, nouns = extract_nouns(text)
-
-    output = {
+    return {
         "video_id": video_id,
         "video_title": video_title,
         "video_link": video_link,
-        "nouns": nouns,
     }
-    json.dump(output, open(json_file, "w"), indent=2)
+
+
+def cache_key(
+    file: str,
+    data_dir: str,
+    fields: Sequence[str],
+    model: str = MODEL,
+    segment_chars: Optional[int] = None,
+) -> dict:
+    """
+    Returns everything the nouns file of a transcription depends on
+    """
+    key = {
+        "transcription_sha256": file_sha256(os.path.join(data_dir, file)),
+        "model": model,
+        "model_version": model_version(model),
+        "extractor_version": EXTRACTOR_VERSION,
+        "fields": list(fields),
+    }
+    if segment_chars is not None:
+        key["segment_chars"] = segment_chars
+
+    return key
+
+
+def load_manifest(output_dir: str = OUTPUT_DIR) -> Dict[str, dict]:
+    return load_json(os.path.join(output_dir, MANIFEST_FILE), {})
+
+
+def save_manifest(manifest: Dict[str, dict], output_dir: str = OUTPUT_DIR):
+    write_json_atomic(os.path.join(output_dir, MANIFEST_FILE), manifest)
+
+
+def unrecorded_files(output_dir: str = OUTPUT_DIR) -> List[str]:
+    """
+    Returns the nouns files that have no manifest entry, e.g. the ones
+    written before there was a manifest
+    """
+    manifest = load_manifest(output_dir)
+    return sorted(
+        f
+        for f in os.listdir(output_dir)
+        if f.endswith(".json") and not f.startswith(".") and f not in manifest
+    )
+
+
+def check_unrecorded(output_dir: str = OUTPUT_DIR):
+    """
+    Exits if there are nouns files without a manifest entry. They would be
+    extracted again and rewritten, which has to be asked for.
+    """
+    unrecorded = unrecorded_files(output_dir)
+    if unrecorded:
+        raise SystemExit(
+            f"{len(unrecorded)} nouns files in {output_dir} aren't in the manifest, "
+            "e.g. because they were written before it existed. Pass "
+            "--adopt-existing to keep them as they are, or --rebuild-existing to "
+            "extract them again."
+        )
+
+
+def pending_files(
+    data_dir: str = DATA_DIR,
+    output_dir: str = OUTPUT_DIR,
+    fields: Sequence[str] = LEAN_TOKEN_FIELDS,
+    adopt_existing: bool = False,
+    model: str = MODEL,
+    segment_chars: Optional[int] = None,
+) -> Tuple[List[str], Dict[str, dict], int]:
+    """
+    Returns the transcription files whose nouns file is missing or was
+    computed from different inputs, the cache keys of all transcription files
+    and the number of cache hits. With adopt_existing, nouns files without a
+    manifest entry are assumed to be up to date.
+    """
+    # Get all json files in the data directory
+    json_files = sorted(
+        f for f in os.listdir(data_dir) if f.endswith(".json") and not f.startswith(".")
+    )
+    manifest = load_manifest(output_dir)
+
+    keys = {}
+    pending = []
+    for file in json_files:
+        keys[file] = cache_key(file, data_dir, fields, model, segment_chars)
+        exists = os.path.exists(os.path.join(output_dir, file))
+
+        if exists and adopt_existing and file not in manifest:
+            manifest[file] = keys[file]
+
+        if not exists or manifest.get(file) != keys[file]:
+            pending.append(file)
+
+    if adopt_existing:
+        save_manifest(manifest, output_dir)
+
+    return pending, keys, len(json_files) - len(pending)
+
+
+def read_transcription(file: str, data_dir: str) -> dict:
+    path = os.path.join(data_dir, file)
+    with metrics.stage("read"):
+        with open(path, "r") as f:
+            data = json.load(f)
+    metrics.count("read.bytes", os.path.getsize(path))
+    return data
+
+
+def read_texts(files: Iterable[str], data_dir: str) -> Iterator[Tuple[str, str]]:
+    for file in files:
+        yield read_transcription(file, data_dir)["text"], file
+
+
+def timed_pipe(docs: Iterable[Tuple["Doc", object]]) -> Iterator[Tuple["Doc", object]]:
+    """
+    Yields the documents from nlp_spacy.pipe, adding the time waiting for each
+    to the "pipeline" stage. Reading the inputs happens within that time too.
+    """
+    docs = iter(docs)
+    while True:
+        with metrics.stage("pipeline"):
+            item = next(docs, None)
+        if item is None:
+            return
+        metrics.count("pipeline.docs")
+        metrics.count("pipeline.tokens", len(item[0]))
+        yield item
+
+
+def iter_extract_nouns(
+    files: Iterable[str],
+    data_dir: str = DATA_DIR,
+    batch_size: int = BATCH_SIZE,
+    n_process: int = N_PROCESS,
+    fields: Sequence[str] = LEAN_TOKEN_FIELDS,
+    model: str = MODEL,
+) -> Iterator[Tuple[str, List]]:
+    """
+    Runs the transcriptions through nlp_spacy.pipe in batches, optionally over
+    several processes, and yields (file, nouns) for each file as soon as it is
+    done
+    """
+    nlp_spacy = load_model(model)
+    docs = nlp_spacy.pipe(
+        read_texts(files, data_dir),
+        as_tuples=True,
+        batch_size=batch_size,
+        n_process=n_process,
+        disable=headless_disable(nlp_spacy),
+    )
+    for doc_spacy, file in timed_pipe(docs):
+        with metrics.stage("extract"):
+            nouns = extract_noun_spans(doc_spacy, fields)
+        metrics.count("extract.spans", len(nouns))
+        yield file, nouns
+
+
+def iter_chunks(
+    data: dict, segment_chars: int = SEGMENT_CHARS
+) -> Iterator[Tuple[str, List[Tuple[int, dict]]]]:
+    """
+    Groups the consecutive segments of a transcription into chunks of at most
+    segment_chars characters (unless a single segment is longer). Yields the
+    text of each chunk with the character offset of each of its segments in
+    the text and the segment's index and timestamps.
+    """
+    segments = data.get("segments") or []
+    if not segments:
+        yield data["text"], [(0, {"segment": None, "start": None, "end": None})]
+        return
+
+    text = ""
+    offsets = []
+    for i, segment in enumerate(segments):
+        segment_text = segment["text"].strip()
+        if offsets and len(text) + 1 + len(segment_text) > segment_chars:
+            yield text, offsets
+            text = ""
+            offsets = []
+
+        if offsets:
+            text += " "
+        offsets.append(
+            (
+                len(text),
+                {"segment": i, "start": segment["start"], "end": segment["end"]},
+            )
+        )
+        text += segment_text
+
+    yield text, offsets
+
+
+def read_chunks(
+    files: Iterable[str], data_dir: str, segment_chars: int
+) -> Iterator[Tuple[str, tuple]]:
+    for file in files:
+        data = read_transcription(file, data_dir)
+        chunks = list(iter_chunks(data, segment_chars))
+        for i, (text, offsets) in enumerate(chunks):
+            yield text, (file, offsets, i == len(chunks) - 1)
+
+
+def iter_extract_segment_nouns(
+    files: Iterable[str],
+    data_dir: str = DATA_DIR,
+    batch_size: int = BATCH_SIZE,
+    n_process: int = N_PROCESS,
+    fields: Sequence[str] = LEAN_TOKEN_FIELDS,
+    model: str = MODEL,
+    segment_chars: int = SEGMENT_CHARS,
+) -> Iterator[Tuple[str, List, List[dict]]]:
+    """
+    Same as iter_extract_nouns, but runs chunks of transcription segments
+    through the pipeline instead of whole transcriptions, which bounds the
+    memory per document. Also yields for every noun the index and timestamps
+    of the segment it was said in.
+    """
+    nlp_spacy = load_model(model)
+    docs = nlp_spacy.pipe(
+        read_chunks(files, data_dir, segment_chars),
+        as_tuples=True,
+        batch_size=batch_size,
+        n_process=n_process,
+        disable=headless_disable(nlp_spacy),
+    )
+
+    nouns = []
+    noun_segments = []
+    for doc_spacy, (file, offsets, last) in timed_pipe(docs):
+        starts = [offset for offset, _ in offsets]
+        with metrics.stage("extract"):
+            spans = find_noun_spans(doc_spacy)
+            for start, end in spans:
+                nouns.append(
+                    [serialize_token(doc_spacy[i], fields) for i in range(start, end)]
+                )
+                # The segment the noun itself is in
+                segment = bisect_right(starts, doc_spacy[end - 1].idx) - 1
+                noun_segments.append(offsets[segment][1])
+        metrics.count("extract.spans", len(spans))
+
+        if last:
+            yield file, nouns, noun_segments
+            nouns = []
+            noun_segments = []
+
+
+def write_nouns(
+    file: str,
+    nouns: List,
+    output_dir: str = OUTPUT_DIR,
+    noun_segments: Optional[List[dict]] = None,
+) -> dict:
+    output = video_info(file)
+    output["nouns"] = nouns
+    if noun_segments is not None:
+        output["noun_segments"] = noun_segments
+
+    path = os.path.join(output_dir, file)
+    with metrics.stage("write"):
+        write_json_atomic(path, output, indent=2)
+    metrics.count("write.bytes", os.path.getsize(path))
+
+    return output
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Extract the nouns of all transcriptions into JSON files"
+    )
+    parser.add_argument("--data-dir", type=str, default=DATA_DIR)
+    parser.add_argument("--output-dir", type=str, default=OUTPUT_DIR)
+    parser.add_argument("--model", type=str, default=MODEL)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help="Number of transcriptions per batch sent through the pipeline",
+    )
+    parser.add_argument(
+        "--n-process",
+        type=int,
+        default=N_PROCESS,
+        help="Number of processes, each with its own copy of the model",
+    )
+    parser.add_argument(
+        "--all-fields",
+        action="store_true",
+        help="Save all token fields instead of only the ones the evaluation reads",
+    )
+    parser.add_argument(
+        "--adopt-existing",
+        action="store_true",
+        help="Record existing nouns files that aren't in the manifest as up to date",
+    )
+    parser.add_argument(
+        "--rebuild-existing",
+        action="store_true",
+        help="Extract existing nouns files that aren't in the manifest again",
+    )
+    parser.add_argument(
+        "--segments",
+        action="store_true",
+        help="Process chunks of transcription segments and save their timestamps",
+    )
+    parser.add_argument(
+        "--segment-chars",
+        type=int,
+        default=SEGMENT_CHARS,
+        help="Maximum number of characters per chunk of segments",
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default=INDEX_FILE,
+        help="Index of the noun spans to add the written files to",
+    )
+    parser.add_argument(
+        "--no-index", action="store_true", help="Don't update the index"
+    )
+    parser.add_argument(
+        "--metrics", type=str, help="Save the timings and counters to this JSON file"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Only profile the extraction of the first pending file with cProfile "
+        "and save the profile to this file",
+    )
+    args = parser.parse_args()
+
+    # Create the output directory if it doesn't exist
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    fields = TOKEN_FIELDS if args.all_fields else LEAN_TOKEN_FIELDS
+
+    segment_chars = args.segment_chars if args.segments else None
+
+    if not args.adopt_existing and not args.rebuild_existing:
+        check_unrecorded(args.output_dir)
+
+    json_files, keys, hits = pending_files(
+        args.data_dir,
+        args.output_dir,
+        fields,
+        args.adopt_existing,
+        args.model,
+        segment_chars,
+    )
+    print(f"Cache hits: {hits}, misses: {len(json_files)}")
+    metrics.count("cache.hits", hits)
+    metrics.count("cache.misses", len(json_files))
+
+    if args.profile:
+        if not json_files:
+            raise SystemExit("No pending transcription to profile")
+        text = read_transcription(json_files[0], args.data_dir)["text"]
+        load_model(args.model)
+        profile(extract_nouns_headless, text, fields, args.model, output=args.profile)
+        sys.exit(0)
+
+    if args.segments:
+        results = iter_extract_segment_nouns(
+            json_files,
+            data_dir=args.data_dir,
+            batch_size=args.batch_size,
+            n_process=args.n_process,
+            fields=fields,
+            model=args.model,
+            segment_chars=segment_chars,
+        )
+    else:
+        results = (
+            (file, nouns, None)
+            for file, nouns in iter_extract_nouns(
+                json_files,
+                data_dir=args.data_dir,
+                batch_size=args.batch_size,
+                n_process=args.n_process,
+                fields=fields,
+                model=args.model,
+            )
+        )
+    index = None if args.no_index else connect(args.index)
+    manifest = load_manifest(args.output_dir)
+    try:
+        for i, (file, nouns, noun_segments) in enumerate(
+            tqdm(results, total=len(json_files)), 1
+        ):
+            output = write_nouns(file, nouns, args.output_dir, noun_segments)
+            if index is not None:
+                with metrics.stage("index"):
+                    key = file_key(os.path.join(args.output_dir, file))
+                    add_document(index, file, output, key)
+
+            manifest[file] = keys[file]
+            if i % MANIFEST_FLUSH_FILES == 0:
+                save_manifest(manifest, args.output_dir)
+    finally:
+        # Also records the files written before an error or an interruption
+        save_manifest(manifest, args.output_dir)
+
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import tempfile
+import textwrap
+from contextlib import contextmanager
+from typing import IO, Any, Iterator
+
+# The umask of the process, to give the atomically written files the mode
+# they would have been created with
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_sha256(path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_json(path: str, default: Any = None) -> Any:
+    """
+    Loads a JSON file, or returns default if it doesn't exist
+    """
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = "w") -> Iterator[IO]:
+    """
+    Opens a temporary file next to path and renames it to path once the block
+    is done, so that an interrupted run never leaves a truncated file behind
+    and readers never see a partial one
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(path: str, data: Any, indent: int = None):
+    """
+    Writes JSON to a temporary file next to path and then renames it, see
+    atomic_open
+    """
+    with atomic_open(path) as f:
+        json.dump(data, f, indent=indent)
+
+
+def jsonl_to_json(jsonl_path: str, json_path: str, indent: int = None):
+    """
+    Converts a JSON lines file to a JSON list with the same formatting as
+    json.dump, one line at a time so that the list is never in memory
+    """
+    with open(jsonl_path) as f, open(json_path, "w") as ofile:
+        separator = "[" if indent is None else "[\n"
+        for line in f:
+            item = json.dumps(json.loads(line), indent=indent)
+            if indent is not None:
+                item = textwrap.indent(item, " " * indent)
+            ofile.write(separator + item)
+            separator = ", " if indent is None else ",\n"
+
+        if separator[0] == "[":
+            ofile.write("[]")
+        else:
+            ofile.write("]" if indent is None else "\n]")
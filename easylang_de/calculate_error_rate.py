@@ -1,12 +1,27 @@
-from copy import deepcopy
+import argparse
 import json
 import os
-from easylang_de.dictionary import CORRECT_GENDERS
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Sequence
 
-from easylang_de.genus import RESOLVERS, Genus, Kasus, Numerus
+from easylang_de.cache import jsonl_to_json
+from easylang_de.corpus import CompactCorpus, is_compact, list_noun_files
+from easylang_de.dictionary import CORRECT_GENDERS
+from easylang_de.genus import RESOLVERS, Genus, GenusResolver, Kasus, Numerus
+from easylang_de.instrument import metrics, profile
 
+if TYPE_CHECKING:
+    from easylang_de.fuzzy import FuzzyMatch
 
 NOUNS_DIR = "nouns"
+STATS_DIR = "stats"
+
+# Most noun files a worker process evaluates per task
+MAX_CHUNK_SIZE = 16
 
 MORPH_KASUS = {
     "Acc": Kasus.ACC,
@@ -24,130 +39,693 @@ MORPH_GENUS = {
     "Neut": Genus.N,
 }
 
-GENUS_CORRECT = open("stats/genus_correct.txt", "w")
-GENUS_INCORRECT = open("stats/genus_incorrect.txt", "w")
 
+class MissingCase(KeyError):
+    """
+    Raised for a noun that spaCy didn't assign a case or number to
+    """
 
-# Get all JSON files under NOUNS_DIR
-json_files = []
-for root, dirs, files in os.walk(NOUNS_DIR):
-    for file in files:
-        if file.endswith(".json"):
-            json_files.append(os.path.join(root, file))
 
-signifiers = []
+@dataclass
+class SpanResult:
+    text: str
+    correct_genders: List[Genus]
+    morph: dict
+    is_correct: bool
+    # Time in the video the noun was said at, in seconds, if the nouns were
+    # extracted with their segments
+    start: Optional[float] = None
+    # Whether each evaluated strategy considers the span correct
+    results: Dict[str, bool] = field(default_factory=dict)
+    # The dictionary noun the genders come from, if the noun was only found
+    # by the fuzzy lookup
+    match: Optional["FuzzyMatch"] = None
 
-# Process each JSON file
-correct_texts = []
-incorrect_texts = []
-missing_cases = []
-incorrect_each_file = []
-for file in json_files:
-    data = json.load(open(file))
-    spans = data["nouns"]
-    current_incorrect = deepcopy(data)
-    current_incorrect.pop("nouns")
-    current_incorrect["incorrect"] = []
+    def __str__(self):
+        return f"{self.text}, {self.correct_genders}, {self.morph}"
 
-    for span in spans:
-        # for word in noun:
-        #     if word["pos"] == "DET":
-        #         signifiers.append(word["text"].lower())
 
-        # det = span[0]
-        noun = span[-1]
-        possible_dets = span[:-1]
+@dataclass
+class FileResult:
+    """
+    Result of evaluating the nouns of one file. info holds the video fields of
+    the file, i.e. everything except the nouns.
+    """
 
-        possible_dets_ = [det["text"].lower() for det in possible_dets]
+    file: str
+    info: dict
+    spans: List[SpanResult] = field(default_factory=list)
+    missing_cases: int = 0
 
-        if "lemma" in noun:
-            noun_ = noun["lemma"].lower()
-        else:
-            noun_ = noun["text"].lower()
+    @property
+    def incorrect(self) -> List[str]:
+        return [str(span) for span in self.spans if not span.is_correct]
 
-        # if not noun_ in CORRECT_GENDERS or not det_ in RESOLVERS:
-        #     continue
-        correct_genders = CORRECT_GENDERS.get(noun_)
-        resolver = None
+    @property
+    def incorrect_links(self) -> List[Optional[str]]:
+        """
+        Links to the time in the video of each incorrect span, if known
+        """
+        return [
+            None if span.start is None else video_time_link(self.info, span.start)
+            for span in self.spans
+            if not span.is_correct
+        ]
 
-        for det_ in possible_dets_:
-            if det_ in RESOLVERS:
-                resolver = RESOLVERS.get(det_)
-                break
 
-        # If it can't be found in the dictionary or doesn't contain a
-        # gender signifier, skip it
-        if correct_genders is None or resolver is None:
-            continue
+@dataclass
+class EvaluationResult:
+    """
+    Counts merged over all evaluated files. Only counts are kept, so that
+    merging any number of files takes the same memory.
+    """
+
+    correct: int = 0
+    incorrect: int = 0
+    missing_cases: int = 0
+    # Spans whose noun was only found by the fuzzy lookup
+    fuzzy_matches: int = 0
+    # Counts of every evaluated strategy, and of the spans on which it
+    # disagrees with the first one
+    strategy_correct: Dict[str, int] = field(default_factory=dict)
+    strategy_incorrect: Dict[str, int] = field(default_factory=dict)
+    strategy_disagreements: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, result: FileResult):
+        incorrect = sum(not span.is_correct for span in result.spans)
+        self.correct += len(result.spans) - incorrect
+        self.incorrect += incorrect
+        self.missing_cases += result.missing_cases
+
+        for span in result.spans:
+            self.fuzzy_matches += span.match is not None
+            for name, is_correct in span.results.items():
+                counts = (
+                    self.strategy_correct if is_correct else self.strategy_incorrect
+                )
+                counts[name] = counts.get(name, 0) + 1
+                disagreements = self.strategy_disagreements.get(name, 0)
+                self.strategy_disagreements[name] = disagreements + (
+                    is_correct != span.is_correct
+                )
+
+    @property
+    def total(self) -> int:
+        return self.correct + self.incorrect
+
+    @property
+    def error_rate(self) -> float:
+        return self.incorrect / self.total
+
+    def strategy_error_rate(self, name: str) -> float:
+        incorrect = self.strategy_incorrect.get(name, 0)
+        return incorrect / (self.strategy_correct.get(name, 0) + incorrect)
+
+
+def incorrect_record(result: FileResult) -> Optional[dict]:
+    """
+    Returns the record of a file for incorrect_each_file: its video fields and
+    incorrect spans, with links to their times if known. None if all of its
+    spans are correct.
+    """
+    incorrect = result.incorrect
+    if not incorrect:
+        return None
+
+    record = {**result.info, "incorrect": incorrect}
+    links = result.incorrect_links
+    if any(link is not None for link in links):
+        record["incorrect_links"] = links
+    return record
+
+
+def spacy_case(
+    resolver: GenusResolver,
+    kasus: Kasus,
+    numerus: Numerus,
+    genus: Optional[Genus],
+    correct_genders: List[Genus],
+) -> bool:
+    """
+    Trusts the case and number spaCy assigned to the noun
+    """
+    return resolver.check_possible_genera(kasus, numerus, correct_genders)
+
+
+def relaxed(
+    resolver: GenusResolver,
+    kasus: Kasus,
+    numerus: Numerus,
+    genus: Optional[Genus],
+    correct_genders: List[Genus],
+) -> bool:
+    """
+    spaCy sometimes returns the wrong case, so anything other than the
+    nominative is accepted if the determiner fits the noun in any case
+    """
+    if kasus == Kasus.NOM:
+        return resolver.check_possible_genera(kasus, numerus, correct_genders)
+    return any(
+        resolver.check_possible_genera(k, numerus, correct_genders) for k in Kasus
+    )
+
+
+def spacy_gender(
+    resolver: GenusResolver,
+    kasus: Kasus,
+    numerus: Numerus,
+    genus: Optional[Genus],
+    correct_genders: List[Genus],
+) -> bool:
+    """
+    Compares the gender spaCy assigned to the noun with the dictionary,
+    ignoring the determiner. Nouns without a gender are incorrect.
+    """
+    return genus in correct_genders
+
+
+# Policies for checking a span, called with the resolver of its determiner,
+# the case, number and gender spaCy assigned to the noun and the genders of
+# the noun in the dictionary
+STRATEGIES = {
+    "spacy_case": spacy_case,
+    "relaxed": relaxed,
+    "spacy_gender": spacy_gender,
+}
+DEFAULT_STRATEGY = "spacy_case"
+
+
+def video_time_link(info: dict, start: float) -> str:
+    return f"{info['video_link']}&t={int(start)}s"
+
+
+def evaluate_span(
+    span: List[dict],
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> Optional[SpanResult]:
+    """
+    Checks the genus of one noun span with each of the strategies, the first
+    one deciding is_correct. Returns None if the span can't be checked, and
+    raises MissingCase if spaCy didn't assign a case or number.
+    With compounds, nouns that aren't in the dictionary get the genus of their
+    longest known head noun. With fuzzy, singular nouns that still aren't
+    found get the genus of the closest dictionary noun if the match has at
+    least that confidence, e.g. for nouns the transcription misspelled.
+    """
+    noun = span[-1]
+    return evaluate_words(
+        [token["text"] for token in span],
+        noun.get("lemma"),
+        noun.get("morph", {}),
+        compounds,
+        strategies,
+        fuzzy,
+    )
+
+
+def evaluate_words(
+    words: List[str],
+    lemma: Optional[str],
+    morph: dict,
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> Optional[SpanResult]:
+    """
+    Same as evaluate_span, but with the span given as the texts of its tokens
+    and the lemma and morphology of the noun, so that it can be checked
+    without building the token dicts
+    """
+    possible_dets_ = [det.lower() for det in words[:-1]]
+
+    if lemma is not None:
+        noun_ = lemma.lower()
+    else:
+        noun_ = words[-1].lower()
+
+    resolver = None
+
+    for det_ in possible_dets_:
+        if det_ in RESOLVERS:
+            resolver = RESOLVERS.get(det_)
+            break
+
+    # If it doesn't contain a gender signifier, skip it before trying the
+    # slower lookups
+    if resolver is None:
+        return None
+
+    # if not noun_ in CORRECT_GENDERS or not det_ in RESOLVERS:
+    #     continue
+    correct_genders = CORRECT_GENDERS.get(noun_)
+    if correct_genders is None and compounds:
+        compound = CORRECT_GENDERS.get_compound(noun_)
+        if compound is not None:
+            correct_genders = compound[1]
+    # Only the last resort, an unknown compound is often within a few edits of
+    # an unrelated noun. Plurals are left out, they are rightly missing from
+    # the dictionary and would be matched to some other singular.
+    match = None
+    if correct_genders is None and fuzzy is not None and morph.get("Number") != "Plur":
+        from easylang_de.fuzzy import FUZZY_GENDERS
+
+        match = FUZZY_GENDERS.get(noun_, fuzzy)
+        if match is not None:
+            correct_genders = match.genera
+
+    # If it can't be found in the dictionary, skip it
+    if correct_genders is None:
+        return None
+
+    if "Case" not in morph or "Number" not in morph:
+        raise MissingCase(noun_)
+
+    kasus_spacy = MORPH_KASUS.get(morph["Case"])
+    numerus_spacy = MORPH_NUMERUS.get(morph["Number"])
+    genus_spacy = MORPH_GENUS.get(morph.get("Gender"))
+
+    results = {
+        name: STRATEGIES[name](
+            resolver, kasus_spacy, numerus_spacy, genus_spacy, correct_genders
+        )
+        for name in strategies
+    }
+
+    text = " ".join(words)
+
+    return SpanResult(
+        text,
+        correct_genders,
+        morph,
+        results[strategies[0]],
+        results=results,
+        match=match,
+    )
+
 
+def evaluate_nouns(
+    nouns: Iterable[tuple],
+    file: str = "",
+    info: Optional[dict] = None,
+    noun_segments: Optional[List[dict]] = None,
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> FileResult:
+    """
+    Evaluates the nouns of a document, given as the arguments of evaluate_words
+    for each span
+    """
+    result = FileResult(file, info if info is not None else {})
+
+    for i, (words, lemma, morph) in enumerate(nouns):
         try:
-            kasus_spacy = MORPH_KASUS.get(noun["morph"]["Case"])
-            numerus_spacy = MORPH_NUMERUS.get(noun["morph"]["Number"])
-            # genus_spacy = MORPH_GENUS.get(noun["morph"]["Gender"])
-        except KeyError:
-            missing_cases.append(noun)
+            span_result = evaluate_words(
+                words, lemma, morph, compounds, strategies, fuzzy
+            )
+        except MissingCase:
+            result.missing_cases += 1
             continue
 
-        #####################################
-        # This is where I check for errors  #
-        #####################################
+        if span_result is not None:
+            if noun_segments is not None:
+                span_result.start = noun_segments[i]["start"]
+            result.spans.append(span_result)
+
+    return result
+
+
+def evaluate_document(
+    data: dict,
+    file: str = "",
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> FileResult:
+    """
+    Evaluates the nouns of a document in the format of the noun JSON files
+    """
+    info = {
+        key: value
+        for key, value in data.items()
+        if key not in ["nouns", "noun_segments"]
+    }
+    nouns = (
+        (
+            [token["text"] for token in span],
+            span[-1].get("lemma"),
+            span[-1].get("morph", {}),
+        )
+        for span in data["nouns"]
+    )
+    return evaluate_nouns(
+        nouns,
+        file,
+        info,
+        data.get("noun_segments"),
+        compounds,
+        strategies,
+        fuzzy,
+    )
+
+
+def evaluate_file(
+    file: str,
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> FileResult:
+    """
+    Evaluates the nouns of one JSON noun file
+    """
+    with open(file) as f:
+        data = json.load(f)
+
+    return evaluate_document(data, file, compounds, strategies, fuzzy)
+
+
+def evaluate_files(
+    files: List[str],
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> List[FileResult]:
+    return [evaluate_file(file, compounds, strategies, fuzzy) for file in files]
+
 
-        # If we were to trust the case returned by Spacy, we would only need to
-        # just the following line is enough:
-        is_correct = resolver.check_possible_genera(
-            kasus_spacy, numerus_spacy, correct_genders
+@lru_cache(maxsize=None)
+def open_corpus(path: str) -> CompactCorpus:
+    # Opened once per process, not for every chunk of documents
+    return CompactCorpus(path)
+
+
+def evaluate_compact(
+    path: str,
+    documents: List[int],
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> List[FileResult]:
+    """
+    Evaluates the given documents of a corpus in the compact format
+    """
+    corpus = open_corpus(path)
+    return [
+        evaluate_compact_document(corpus, document, compounds, strategies, fuzzy)
+        for document in documents
+    ]
+
+
+def evaluate_compact_document(
+    corpus: CompactCorpus,
+    document: int,
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> FileResult:
+    """
+    Evaluates one document of a corpus in the compact format, reading the
+    columns it needs for all of its spans at once instead of the token dicts
+    """
+    info = dict(corpus.documents[document])
+    file = info.pop("file")
+    noun_segments = info.pop("noun_segments", None)
+
+    bounds = corpus.span_bounds(document)
+    rows = slice(bounds[0], bounds[-1])
+    texts = corpus.values("text", rows).tolist()
+    lemmas = corpus.values("lemma", rows).tolist()
+    morphs = corpus.values("morph", rows).tolist()
+
+    first = bounds[0]
+    nouns = (
+        (
+            texts[start - first : end - first],
+            lemmas[end - first - 1],
+            morphs[end - first - 1] or {},
         )
+        for start, end in zip(bounds[:-1], bounds[1:])
+    )
+    return evaluate_nouns(
+        nouns, file, info, noun_segments, compounds, strategies, fuzzy
+    )
+
+
+def list_documents(nouns_dir: str = NOUNS_DIR) -> list:
+    """
+    Returns what iter_evaluate evaluates one by one: the JSON noun files under
+    nouns_dir, or the document indices if it is a compact corpus
+    """
+    if is_compact(nouns_dir):
+        return list(range(len(open_corpus(nouns_dir))))
+    return list_noun_files(nouns_dir)
+
+
+def iter_evaluate(
+    nouns_dir: str = NOUNS_DIR,
+    n_process: int = 1,
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> Iterator[FileResult]:
+    """
+    Evaluates all noun files under nouns_dir, or all documents of a corpus in
+    the compact format, fanned out over n_process processes, and yields the
+    results in file order
+    """
+    documents = list_documents(nouns_dir)
+    if is_compact(nouns_dir):
+        evaluate_chunk = partial(evaluate_compact, nouns_dir)
+    else:
+        evaluate_chunk = evaluate_files
+    evaluate_chunk = partial(
+        evaluate_chunk, compounds=compounds, strategies=strategies, fuzzy=fuzzy
+    )
+
+    if n_process == 1:
+        for document in documents:
+            yield from evaluate_chunk([document])
+        return
 
-        # However, I saw from trial and error that Spacy sometimes returns the
-        # wrong case. So I made the check less strict when Spacy detects anything
-        # other than nominative case:
-        #
-        # if kasus_spacy == Kasus.NOM:
-        #     is_correct = resolver.check_possible_genera(
-        #         kasus_spacy, numerus_spacy, correct_genders
-        #     )
-        # else:
-        #     is_correct1 = resolver.check_possible_genera(
-        #         Kasus.NOM, numerus_spacy, correct_genders
-        #     )
-        #     is_correct2 = resolver.check_possible_genera(
-        #         Kasus.ACC, numerus_spacy, correct_genders
-        #     )
-        #     is_correct3 = resolver.check_possible_genera(
-        #         Kasus.DAT, numerus_spacy, correct_genders
-        #     )
-        #     is_correct4 = resolver.check_possible_genera(
-        #         Kasus.GEN, numerus_spacy, correct_genders
-        #     )
-        #     is_correct = is_correct1 or is_correct2 or is_correct3 or is_correct4
-        #
-        # is_correct = genus_spacy in correct_genders
-
-        text = " ".join([i["text"] for i in span])
-        print(f"{text}, {correct_genders}, {noun['morph']}, {is_correct}")
-
-        if is_correct:
-            GENUS_CORRECT.write(f"{text}\n")
-            correct_texts.append(text)
+    chunksize = max(1, min(MAX_CHUNK_SIZE, len(documents) // (n_process * 8)))
+    with ProcessPoolExecutor(n_process) as executor:
+        # Only a few chunks are submitted ahead of the consumer, so that the
+        # results don't pile up in memory when it is slower than the workers
+        pending = deque()
+        for i in range(0, len(documents), chunksize):
+            pending.append(
+                executor.submit(evaluate_chunk, documents[i : i + chunksize])
+            )
+            if len(pending) > 2 * n_process:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def merge(results: Iterable[FileResult]) -> EvaluationResult:
+    ret = EvaluationResult()
+    for result in results:
+        ret.add(result)
+    return ret
+
+
+def evaluate(
+    nouns_dir: str = NOUNS_DIR,
+    n_process: int = 1,
+    compounds: bool = False,
+    strategies: Sequence[str] = (DEFAULT_STRATEGY,),
+    fuzzy: Optional[float] = None,
+) -> EvaluationResult:
+    """
+    Evaluates all noun files under nouns_dir and merges the counts
+    """
+    return merge(iter_evaluate(nouns_dir, n_process, compounds, strategies, fuzzy))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calculate the genus error rate of the extracted nouns"
+    )
+    parser.add_argument("--nouns-dir", type=str, default=NOUNS_DIR)
+    parser.add_argument("--stats-dir", type=str, default=STATS_DIR)
+    parser.add_argument(
+        "--n-process",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes evaluating the noun files",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="Don't print a line for every noun"
+    )
+    parser.add_argument("--progress", action="store_true", help="Show a progress bar")
+    parser.add_argument(
+        "--compounds",
+        action="store_true",
+        help="Check nouns missing from the dictionary by their compound head noun",
+    )
+    parser.add_argument(
+        "--fuzzy",
+        action="store_true",
+        help="Check nouns missing from the dictionary by the closest dictionary "
+        "noun, e.g. when the transcription misspelled them",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        help="Confidence a fuzzy match needs to be used (default: "
+        "fuzzy.DEFAULT_MIN_CONFIDENCE)",
+    )
+    parser.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=list(STRATEGIES),
+        default=[DEFAULT_STRATEGY],
+        help="Policies to check the spans with in the same pass. The first one "
+        "decides the correct and incorrect outputs, the others are compared to it.",
+    )
+    parser.add_argument(
+        "--metrics", type=str, help="Save the timings and counters to this JSON file"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Only profile the evaluation of the first noun file with cProfile "
+        "and save the profile to this file",
+    )
+    args = parser.parse_args()
+
+    fuzzy = None
+    if args.fuzzy:
+        from easylang_de.fuzzy import DEFAULT_MIN_CONFIDENCE, preload
+
+        fuzzy = args.min_confidence
+        if fuzzy is None:
+            fuzzy = DEFAULT_MIN_CONFIDENCE
+        # Builds the deletion index once, before the workers need it
+        preload()
+
+    if args.profile:
+        documents = list_documents(args.nouns_dir)
+        if not documents:
+            raise SystemExit(f"No noun files to profile in {args.nouns_dir}")
+        if is_compact(args.nouns_dir):
+            evaluate_first = partial(evaluate_compact, args.nouns_dir, documents[:1])
         else:
-            insert = f"{text}, {correct_genders}, {noun['morph']}"
-            GENUS_INCORRECT.write(f"{insert}\n")
-            incorrect_texts.append(text)
+            evaluate_first = partial(evaluate_file, documents[0])
+        profile(
+            evaluate_first,
+            args.compounds,
+            args.strategies,
+            fuzzy,
+            output=args.profile,
+        )
+        sys.exit(0)
+
+    results = iter_evaluate(
+        args.nouns_dir, args.n_process, args.compounds, args.strategies, fuzzy
+    )
+    if args.progress:
+        from tqdm import tqdm
+
+        results = tqdm(results, total=len(list_documents(args.nouns_dir)))
+
+    genus_correct = open(os.path.join(args.stats_dir, "genus_correct.txt"), "w")
+    genus_incorrect = open(os.path.join(args.stats_dir, "genus_incorrect.txt"), "w")
+    # One line per file, written as soon as the file is evaluated, so that an
+    # interrupted run leaves the records of the files evaluated so far
+    incorrect_jsonl_path = os.path.join(args.stats_dir, "incorrect_each_file.jsonl")
+    incorrect_jsonl = open(incorrect_jsonl_path, "w", buffering=1)
+    # The spans each strategy judges differently than the first one
+    disagreement_files = {
+        name: open(os.path.join(args.stats_dir, f"disagreements_{name}.txt"), "w")
+        for name in args.strategies[1:]
+    }
+    # The nouns only found by the fuzzy lookup, to check its matches
+    fuzzy_matches = (
+        open(os.path.join(args.stats_dir, "fuzzy_matches.txt"), "w")
+        if args.fuzzy
+        else None
+    )
+
+    evaluation = EvaluationResult()
+    results = iter(results)
+    while True:
+        # The files are evaluated in the worker processes, this is the time
+        # spent waiting for their results
+        with metrics.stage("evaluate"):
+            result = next(results, None)
+        if result is None:
+            break
+        metrics.count("evaluate.files")
+        metrics.count("evaluate.spans", len(result.spans))
+
+        with metrics.stage("write"):
+            for span in result.spans:
+                if not args.quiet:
+                    print(f"{span}, {span.is_correct}")
+
+                if span.is_correct:
+                    genus_correct.write(f"{span.text}\n")
+                else:
+                    genus_incorrect.write(f"{span}\n")
+
+                for name, ofile in disagreement_files.items():
+                    if span.results[name] != span.is_correct:
+                        ofile.write(f"{span}\n")
+
+                if fuzzy_matches is not None and span.match is not None:
+                    fuzzy_matches.write(
+                        f"{span.text} -> {span.match.noun}, "
+                        f"distance {span.match.distance}, "
+                        f"confidence {span.match.confidence:.2f}\n"
+                    )
+
+            record = incorrect_record(result)
+            if record is not None:
+                incorrect_jsonl.write(json.dumps(record) + "\n")
+
+        evaluation.add(result)
+
+    metrics.count("evaluate.correct", evaluation.correct)
+    metrics.count("evaluate.incorrect", evaluation.incorrect)
+    metrics.count("evaluate.missing_cases", evaluation.missing_cases)
+    metrics.count("evaluate.fuzzy_matches", evaluation.fuzzy_matches)
 
-            # if file not in incorrect_per_file:
-            current_incorrect["incorrect"].append(insert)
+    genus_correct.close()
+    genus_incorrect.close()
+    incorrect_jsonl.close()
+    for ofile in disagreement_files.values():
+        ofile.close()
+    if fuzzy_matches is not None:
+        fuzzy_matches.close()
 
-    if len(current_incorrect["incorrect"]) > 0:
-        incorrect_each_file.append(current_incorrect)
+    print(f"Number of nouns: {evaluation.total}")
+    print(f"Number of correct genus assignment: {evaluation.correct}")
+    print(f"Number of definitely incorrect genus assignment: {evaluation.incorrect}")
+    print(f"Error rate: {evaluation.error_rate} ({evaluation.error_rate*100}%))")
+    print(f"Missing cases: {evaluation.missing_cases}")
+    if args.fuzzy:
+        print(f"Recovered by fuzzy lookup: {evaluation.fuzzy_matches}")
 
-total = len(correct_texts) + len(incorrect_texts)
-error_rate = len(incorrect_texts) / total
+    # The JSON version of the records, for the existing readers of the stats
+    jsonl_to_json(
+        incorrect_jsonl_path,
+        os.path.join(args.stats_dir, "incorrect_each_file.json"),
+        indent=4,
+    )
 
-print(f"Number of nouns: {total}")
-print(f"Number of correct genus assignment: {len(correct_texts)}")
-print(f"Number of definitely incorrect genus assignment: {len(incorrect_texts)}")
-print(f"Error rate: {error_rate} ({error_rate*100}%))")
-print(f"Missing cases: {len(missing_cases)}")
+    if len(args.strategies) > 1:
+        print()
+        print(f"{'Strategy':<16}{'Correct':>10}{'Incorrect':>10}{'Error rate':>12}")
+        for name in args.strategies:
+            print(
+                f"{name:<16}{evaluation.strategy_correct.get(name, 0):>10}"
+                f"{evaluation.strategy_incorrect.get(name, 0):>10}"
+                f"{evaluation.strategy_error_rate(name):>12.2%}"
+                f"  ({evaluation.strategy_disagreements[name]} disagreements)"
+            )
 
-ofile = open("stats/incorrect_each_file.json", "w")
-json.dump(incorrect_each_file, ofile, indent=4)
+    if args.metrics:
+        metrics.write(args.metrics)
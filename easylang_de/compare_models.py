@@ -0,0 +1,216 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from easylang_de.batch_extract_nouns import BATCH_SIZE, DATA_DIR
+
+# Models to compare, the first one being the reference the others are
+# compared to
+COMPARED_MODELS = ["de_dep_news_trf", "de_core_news_lg", "de_core_news_sm"]
+
+SAMPLE_SIZE = 20
+
+# Noun spans of a document by their (start, end) character offsets, so that
+# spans of models with different tokenizations can still be matched
+DocumentSpans = Dict[Tuple[int, int], List[dict]]
+
+
+def sample_texts(data_dir: str = DATA_DIR, n: int = SAMPLE_SIZE, seed: int = 0):
+    """
+    Returns the names and texts of a random sample of n transcriptions
+    """
+    files = sorted(
+        f for f in os.listdir(data_dir) if f.endswith(".json") and not f.startswith(".")
+    )
+    files = sorted(random.Random(seed).sample(files, min(n, len(files))))
+
+    texts = []
+    for file in files:
+        with open(os.path.join(data_dir, file)) as f:
+            texts.append(json.load(f)["text"])
+
+    return files, texts
+
+
+def run_model(name: str, texts: List[str], batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Extracts the noun spans of the texts with one model and measures its
+    throughput. Meant to run in a process of its own, so that the peak memory
+    of the process is the one of this model.
+    """
+    from easylang_de.extract_nouns import (
+        LEAN_TOKEN_FIELDS,
+        find_noun_spans,
+        headless_disable,
+        load_model,
+        model_version,
+        serialize_token,
+    )
+
+    start = time.perf_counter()
+    nlp_spacy = load_model(name)
+    load_seconds = time.perf_counter() - start
+
+    tokens = 0
+    documents: List[DocumentSpans] = []
+    start = time.perf_counter()
+    docs = nlp_spacy.pipe(
+        texts, batch_size=batch_size, disable=headless_disable(nlp_spacy)
+    )
+    for doc_spacy in docs:
+        tokens += len(doc_spacy)
+        spans = {}
+        for first, end in find_noun_spans(doc_spacy):
+            last = doc_spacy[end - 1]
+            spans[(doc_spacy[first].idx, last.idx + len(last))] = [
+                serialize_token(doc_spacy[i], LEAN_TOKEN_FIELDS)
+                for i in range(first, end)
+            ]
+        documents.append(spans)
+    seconds = time.perf_counter() - start
+
+    return {
+        "model": name,
+        "version": model_version(name),
+        "load_seconds": load_seconds,
+        "seconds": seconds,
+        "docs_per_sec": len(texts) / seconds,
+        "tokens_per_sec": tokens / seconds,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "documents": documents,
+    }
+
+
+def agreement(documents: List[DocumentSpans], reference: List[DocumentSpans]) -> dict:
+    """
+    Compares the noun spans of a model with the ones of the reference model:
+    precision and recall of the exact spans, and how often the noun got the
+    same Case and Number among the spans both found
+    """
+    found = expected = matched = same_case = same_number = 0
+    for spans, reference_spans in zip(documents, reference):
+        found += len(spans)
+        expected += len(reference_spans)
+        for offsets, span in spans.items():
+            if offsets not in reference_spans:
+                continue
+            matched += 1
+            morph = span[-1]["morph"]
+            reference_morph = reference_spans[offsets][-1]["morph"]
+            same_case += morph.get("Case") == reference_morph.get("Case")
+            same_number += morph.get("Number") == reference_morph.get("Number")
+
+    return {
+        "span_precision": matched / found if found else 0.0,
+        "span_recall": matched / expected if expected else 0.0,
+        "case_agreement": same_case / matched if matched else 0.0,
+        "number_agreement": same_number / matched if matched else 0.0,
+    }
+
+
+def error_rate(documents: List[DocumentSpans]) -> float:
+    """
+    Genus error rate of the noun spans, as calculate_error_rate computes it
+    """
+    # Loads the dictionary, so only imported when needed
+    from easylang_de.calculate_error_rate import EvaluationResult, evaluate_document
+
+    evaluation = EvaluationResult()
+    for spans in documents:
+        evaluation.add(evaluate_document({"nouns": list(spans.values())}))
+
+    return evaluation.error_rate if evaluation.total else 0.0
+
+
+def compare(
+    models: List[str], texts: List[str], batch_size: int = BATCH_SIZE
+) -> List[dict]:
+    """
+    Runs the texts through every model, one process per model, and returns
+    their measurements, compared to the first model
+    """
+    # A fresh process per model, forked processes would inherit the memory
+    # of the previous models
+    context = multiprocessing.get_context("spawn")
+
+    results = []
+    for name in models:
+        print(f"Running {name}...")
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results.append(executor.submit(run_model, name, texts, batch_size).result())
+
+    reference = results[0]
+    for result in results:
+        result["error_rate"] = error_rate(result["documents"])
+        result.update(agreement(result["documents"], reference["documents"]))
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the throughput and accuracy of the Spacy models "
+        "on a sample of transcriptions"
+    )
+    parser.add_argument("--data-dir", type=str, default=DATA_DIR)
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=COMPARED_MODELS,
+        help="Models to compare, the first one is the reference",
+    )
+    parser.add_argument("--sample", type=int, default=SAMPLE_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--output", type=str, help="Save the report to this JSON file")
+    args = parser.parse_args()
+
+    import spacy.util
+
+    # Only compare installed models, load_model would download the others
+    models = [name for name in args.models if spacy.util.is_package(name)]
+    for name in args.models:
+        if name not in models:
+            print(f"Skipping {name}, it isn't installed")
+    if not models:
+        raise SystemExit("None of the models is installed")
+    if models[0] != args.models[0]:
+        print(f"Comparing to {models[0]} instead of {args.models[0]}")
+
+    files, texts = sample_texts(args.data_dir, args.sample, args.seed)
+    results = compare(models, texts, args.batch_size)
+
+    print()
+    print(
+        f"{'Model':<20}{'Docs/s':>8}{'Tokens/s':>10}{'Memory MB':>11}"
+        f"{'Precision':>11}{'Recall':>8}{'Case':>7}{'Number':>8}{'Errors':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['model']:<20}{result['docs_per_sec']:>8.2f}"
+            f"{result['tokens_per_sec']:>10.0f}{result['peak_memory_mb']:>11.0f}"
+            f"{result.get('span_precision', 0):>11.1%}"
+            f"{result.get('span_recall', 0):>8.1%}"
+            f"{result.get('case_agreement', 0):>7.1%}"
+            f"{result.get('number_agreement', 0):>8.1%}"
+            f"{result['error_rate']:>8.1%}"
+        )
+
+    if args.output:
+        report = {
+            "files": files,
+            "reference": models[0],
+            "models": [
+                {key: value for key, value in result.items() if key != "documents"}
+                for result in results
+            ],
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+NOUNS_DIR = "nouns"
+COMPACT_DIR = "nouns_compact"
+
+# Token fields that are stored as a column of ids into the string table
+STRING_COLUMNS = (
+    "text",
+    "pos",
+    "dep",
+    "lemma",
+    "shape",
+    "tag",
+    "lang",
+    "prefix",
+    "suffix",
+    "morph",
+)
+
+# Morphological features that get their own column, for fast filtering
+MORPH_COLUMNS = ("Case", "Number", "Gender")
+
+STRINGS_FILE = "strings.json"
+DOCUMENTS_FILE = "documents.json"
+
+# Id used in the columns when a token doesn't have the field
+MISSING = -1
+
+
+def morph_to_str(morph: Dict[str, str]) -> str:
+    return "|".join(f"{key}={value}" for key, value in morph.items())
+
+
+def str_to_morph(morph: str) -> Dict[str, str]:
+    if not morph:
+        return {}
+    return dict(feature.split("=", 1) for feature in morph.split("|"))
+
+
+class StringTable:
+    """
+    Interns strings so that every distinct string is stored only once
+    """
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def add(self, string: Optional[str]) -> int:
+        if string is None:
+            return MISSING
+        if string not in self.ids:
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.ids[string]
+
+
+def list_noun_files(nouns_dir: str = NOUNS_DIR) -> List[str]:
+    """
+    Returns all JSON files under nouns_dir, sorted, except the ones of corpora
+    in the compact format
+    """
+    json_files = []
+    for root, dirs, files in os.walk(nouns_dir):
+        if is_compact(root):
+            continue
+        for file in files:
+            if file.endswith(".json") and not file.startswith("."):
+                json_files.append(os.path.join(root, file))
+
+    return sorted(json_files)
+
+
+def is_compact(path: str) -> bool:
+    return os.path.exists(os.path.join(path, STRINGS_FILE))
+
+
+def convert(nouns_dir: str = NOUNS_DIR, output_dir: str = COMPACT_DIR):
+    """
+    Converts the JSON noun files under nouns_dir to the compact format in
+    output_dir
+    """
+    strings = StringTable()
+    columns = {name: [] for name in STRING_COLUMNS + MORPH_COLUMNS}
+    span_offsets = [0]
+    document_offsets = [0]
+    documents = []
+
+    for file in tqdm(list_noun_files(nouns_dir)):
+        with open(file) as f:
+            data = json.load(f)
+
+        spans = data.pop("nouns")
+        data["file"] = os.path.relpath(file, nouns_dir)
+        documents.append(data)
+
+        for span in spans:
+            for token in span:
+                for name in STRING_COLUMNS:
+                    value = token.get(name)
+                    if name == "morph" and value is not None:
+                        value = morph_to_str(value)
+                    columns[name].append(strings.add(value))
+                morph = token.get("morph", {})
+                for name in MORPH_COLUMNS:
+                    columns[name].append(strings.add(morph.get(name)))
+            span_offsets.append(span_offsets[-1] + len(span))
+        document_offsets.append(len(span_offsets) - 1)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    for name, column in columns.items():
+        np.save(os.path.join(output_dir, f"{name}.npy"), np.array(column, np.int32))
+    np.save(
+        os.path.join(output_dir, "span_offsets.npy"), np.array(span_offsets, np.int64)
+    )
+    np.save(
+        os.path.join(output_dir, "document_offsets.npy"),
+        np.array(document_offsets, np.int64),
+    )
+    with open(os.path.join(output_dir, STRINGS_FILE), "w") as f:
+        json.dump(strings.strings, f, ensure_ascii=False)
+    with open(os.path.join(output_dir, DOCUMENTS_FILE), "w") as f:
+        json.dump(documents, f, ensure_ascii=False)
+
+
+class CompactCorpus:
+    """
+    Noun corpus in the compact format. The columns are memory-mapped, so
+    loading is cheap and tokens are only read when they are accessed.
+    """
+
+    def __init__(self, path: str = COMPACT_DIR, mmap: bool = True):
+        mmap_mode = "r" if mmap else None
+
+        with open(os.path.join(path, STRINGS_FILE)) as f:
+            self.strings: List[str] = json.load(f)
+        self.ids = {string: i for i, string in enumerate(self.strings)}
+        with open(os.path.join(path, DOCUMENTS_FILE)) as f:
+            self.documents: List[dict] = json.load(f)
+
+        self.columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in STRING_COLUMNS + MORPH_COLUMNS
+        }
+        self.span_offsets = np.load(
+            os.path.join(path, "span_offsets.npy"), mmap_mode=mmap_mode
+        )
+        self.document_offsets = np.load(
+            os.path.join(path, "document_offsets.npy"), mmap_mode=mmap_mode
+        )
+
+        # Values of the string ids of each column, MISSING being the last
+        # item. Morphologies are parsed once here instead of for every token.
+        strings = np.array(self.strings + [None], dtype=object)
+        morphs = np.full(len(strings), None, dtype=object)
+        for string_id in np.unique(self.columns["morph"]).tolist():
+            if string_id != MISSING:
+                morphs[string_id] = str_to_morph(self.strings[string_id])
+        self.tables = {
+            name: morphs if name == "morph" else strings
+            for name in STRING_COLUMNS + MORPH_COLUMNS
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def string_id(self, string: str) -> int:
+        """
+        Returns the id of a string in the string table, or MISSING. Useful to
+        filter the columns directly.
+        """
+        return self.ids.get(string, MISSING)
+
+    def values(self, name: str, rows=slice(None)) -> np.ndarray:
+        """
+        Returns the values of a column for the given rows, a slice or an array
+        of token indices, with None where a token doesn't have the field.
+        Unlike tokens, no dict is built per token: morphologies are dicts
+        shared by every token with the same one, so they must not be changed.
+        """
+        return self.tables[name][self.columns[name][rows]]
+
+    def span_bounds(self, document: int) -> List[int]:
+        """
+        Returns the token offsets of the spans of a document, span i being the
+        tokens bounds[i] to bounds[i + 1]
+        """
+        start = self.document_offsets[document]
+        end = self.document_offsets[document + 1]
+        return self.span_offsets[start : end + 1].tolist()
+
+    def tokens(self, start: int, end: int) -> List[dict]:
+        """
+        Returns the tokens start to end. Each column is read once for the whole
+        range and its ids are turned into strings with a single lookup.
+        """
+        columns = [
+            (name, self.values(name, slice(start, end)).tolist())
+            for name in STRING_COLUMNS
+        ]
+        tokens = [{} for _ in range(end - start)]
+        for name, values in columns:
+            if name == "morph":
+                # Every token gets its own dict, like from the JSON files
+                values = [value if value is None else dict(value) for value in values]
+            for token, value in zip(tokens, values):
+                if value is not None:
+                    token[name] = value
+        return tokens
+
+    def token(self, i: int) -> dict:
+        return self.tokens(i, i + 1)[0]
+
+    def span(self, i: int) -> List[dict]:
+        return self.tokens(int(self.span_offsets[i]), int(self.span_offsets[i + 1]))
+
+    def spans(self, document: int) -> List[List[dict]]:
+        offsets = self.span_bounds(document)
+        tokens = self.tokens(offsets[0], offsets[-1])
+        first = offsets[0]
+        return [
+            tokens[i - first : j - first] for i, j in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def document(self, document: int) -> dict:
+        """
+        Returns the document in the same structure as the JSON noun files
+        """
+        ret = dict(self.documents[document])
+        ret.pop("file")
+        ret["nouns"] = self.spans(document)
+        return ret
+
+    def iter_documents(self) -> Iterator[dict]:
+        for document in range(len(self)):
+            yield self.document(document)
+
+
+def iter_documents(path: str = NOUNS_DIR) -> Iterator[dict]:
+    """
+    Yields the noun documents from either a directory of JSON noun files or a
+    directory in the compact format
+    """
+    if is_compact(path):
+        yield from CompactCorpus(path).iter_documents()
+    else:
+        for file in list_noun_files(path):
+            with open(file) as f:
+                yield json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the JSON noun files to the compact corpus format"
+    )
+    parser.add_argument("nouns_dir", type=str, nargs="?", default=NOUNS_DIR)
+    parser.add_argument("output_dir", type=str, nargs="?", default=COMPACT_DIR)
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Check that the converted corpus reads back the same as the JSON files",
+    )
+    args = parser.parse_args()
+
+    convert(args.nouns_dir, args.output_dir)
+
+    if args.check:
+        corpus = CompactCorpus(args.output_dir)
+        mismatched = []
+        for i, file in enumerate(list_noun_files(args.nouns_dir)):
+            with open(file) as f:
+                if json.load(f) != corpus.document(i):
+                    mismatched.append(file)
+        if mismatched:
+            raise SystemExit(
+                f"{len(mismatched)} of {len(corpus)} documents read back "
+                f"differently, e.g. {mismatched[0]}"
+            )
+        print(f"Checked {len(corpus)} documents")
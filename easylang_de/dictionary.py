@@ -1,21 +1,330 @@
-from easylang_de.genus import Genus
+import argparse
+import mmap
+import os
+import struct
+import zlib
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
 
+from easylang_de.cache import atomic_open
+from easylang_de.genus import GENUS_BITS, Genus, genera_mask
 
-CORRECT_GENDERS = {}
+CSV_FILE = "nomen_genus.csv"
+BINARY_FILE = "nomen_genus.bin"
 
+# The binary dictionary is laid out as:
+#   header: magic, number of nouns n, size of the genera table, number of
+#     hash slots
+#   genera table: the distinct lists of genera of the nouns, as in the CSV,
+#     e.g. b"m,f,fm", padded with spaces to a multiple of 4 bytes
+#   offsets: n + 1 uint32, where noun i is blob[offsets[i]:offsets[i + 1]]
+#   slots: uint32 hash table of noun index + 1, 0 for an empty slot. Noun i
+#     is in the first free slot from crc32(noun) % number of slots.
+#   reversed_order: n uint32, the noun indices sorted by their reversed bytes
+#   reversed_offsets: n + 1 uint32, where the reversed noun reversed_order[j]
+#     is reversed_blob[reversed_offsets[j]:reversed_offsets[j + 1]]
+#   masks: n uint8 genus bitmasks (see genus.GENUS_BITS)
+#   genera: n uint8 indices in the genera table
+#   blob: the lowercase nouns in UTF-8, sorted by their bytes
+#   reversed_blob: the reversed nouns, sorted
+MAGIC = b"NGEN0004"
+HEADER = struct.Struct("<8sIII")
 
-with open("nomen_genus.csv", "r") as f:
-    lines = f.readlines()[1:]
-    for line in lines:
-        noun, genus = line.split(",")
-        genus = Genus(genus.strip())
-        noun = noun.strip().lower()
-        if noun not in CORRECT_GENDERS:
-            CORRECT_GENDERS[noun] = []
+# The hash table is kept at most half full, so that probes stay short
+SLOTS_PER_NOUN = 2
+# Compound heads shorter than this aren't used, they match too many words
+MIN_HEAD_LENGTH = 3
+
+# The genera of every bitmask, in the order of GENUS_BITS
+MASK_GENERA = [
+    [genus for genus, bit in GENUS_BITS.items() if mask & bit] for mask in range(8)
+]
+
+
+def read_csv(csv_file: str = CSV_FILE) -> Dict[str, List[Genus]]:
+    """
+    Reads the nouns and their genera from the CSV dictionary, in the order of
+    their lines
+    """
+    genera = {}
+    with open(csv_file, "r") as f:
+        next(f)
+        for line in f:
+            noun, genus = line.split(",")
+            genus = Genus(genus.strip())
+            noun = noun.strip().lower()
+            genera.setdefault(noun, []).append(genus)
+
+    return genera
+
+
+def build(csv_file: str = CSV_FILE, binary_file: str = BINARY_FILE):
+    """
+    Compiles the CSV dictionary to the binary format. The file is written
+    atomically, as load may rebuild it while other processes read it.
+    """
+    genera = read_csv(csv_file)
+    nouns = sorted(noun.encode("utf-8") for noun in genera)
+    noun_genera = [genera[noun.decode("utf-8")] for noun in nouns]
+
+    offsets = [0]
+    for noun in nouns:
+        offsets.append(offsets[-1] + len(noun))
+
+    slot_count = max(1, SLOTS_PER_NOUN * len(nouns))
+    slots = [0] * slot_count
+    for i, noun in enumerate(nouns):
+        slot = zlib.crc32(noun) % slot_count
+        while slots[slot]:
+            slot = (slot + 1) % slot_count
+        slots[slot] = i + 1
+
+    reversed_order = sorted(range(len(nouns)), key=lambda i: nouns[i][::-1])
+    reversed_nouns = [nouns[i][::-1] for i in reversed_order]
+    reversed_offsets = [0]
+    for noun in reversed_nouns:
+        reversed_offsets.append(reversed_offsets[-1] + len(noun))
+
+    values = ["".join(genus.value for genus in value) for value in noun_genera]
+    table = list(dict.fromkeys(values))
+    if len(table) > 256:
+        raise ValueError("Too many distinct lists of genera")
+    table_ids = {value: i for i, value in enumerate(table)}
+    table_bytes = ",".join(table).encode("ascii")
+    table_bytes += b" " * (-len(table_bytes) % 4)
+
+    with atomic_open(binary_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(nouns), len(table_bytes), slot_count))
+        f.write(table_bytes)
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(struct.pack(f"<{slot_count}I", *slots))
+        f.write(struct.pack(f"<{len(nouns)}I", *reversed_order))
+        f.write(struct.pack(f"<{len(reversed_offsets)}I", *reversed_offsets))
+        f.write(bytes(genera_mask(value) for value in noun_genera))
+        f.write(bytes(table_ids[value] for value in values))
+        f.write(b"".join(nouns))
+        f.write(b"".join(reversed_nouns))
+
+
+def common_prefix_length(a: bytes, b: bytes) -> int:
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+class GenderDictionary:
+    """
+    Memory-mapped binary noun dictionary. get behaves like the dict of lists
+    of genera this module used to build from the CSV. Lookups probe the
+    mapped hash table and reversed index, so opening the dictionary stays
+    cheap and only the pages that are read are loaded.
+    """
+
+    def __init__(self, binary_file: str = BINARY_FILE):
+        with open(binary_file, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count, table_size, self.slot_count = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{binary_file} is not a binary noun dictionary")
+
+        table = self.buffer[HEADER.size : HEADER.size + table_size].rstrip()
+        self.genera_table = [
+            [Genus(genus) for genus in value.decode("ascii")]
+            for value in table.split(b",")
+        ]
+
+        view = memoryview(self.buffer)
+        start = HEADER.size + table_size
+        end = start + 4 * (self.count + 1)
+        self.offsets = view[start:end].cast("I")
+        start, end = end, end + 4 * self.slot_count
+        self.slots = view[start:end].cast("I")
+        start, end = end, end + 4 * self.count
+        self.reversed_order = view[start:end].cast("I")
+        start, end = end, end + 4 * (self.count + 1)
+        self.reversed_offsets = view[start:end].cast("I")
+        start, end = end, end + self.count
+        self.masks = view[start:end]
+        start, end = end, end + self.count
+        self.genera_ids = view[start:end]
+        # The blobs are sliced from the mmap, which returns bytes directly
+        self.blob_start = end
+        self.reversed_blob_start = end + self.offsets[self.count]
+        self.blob = view[self.blob_start : self.reversed_blob_start]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def noun_bytes(self, i: int) -> bytes:
+        start = self.blob_start
+        return self.buffer[start + self.offsets[i] : start + self.offsets[i + 1]]
+
+    def reversed_noun_bytes(self, j: int) -> bytes:
+        """
+        Returns the reversed bytes of noun reversed_order[j]
+        """
+        start = self.reversed_blob_start
+        offsets = self.reversed_offsets
+        return self.buffer[start + offsets[j] : start + offsets[j + 1]]
+
+    @cached_property
+    def nouns(self) -> List[str]:
+        """
+        All the nouns, decoded at once, for the bulk users like the fuzzy
+        index. Lookups don't need them.
+        """
+        blob = bytes(self.blob)
+        offsets = self.offsets.tolist()
+        return [
+            blob[start:end].decode("utf-8")
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+
+    def genera(self, i: int) -> List[Genus]:
+        """
+        Returns the genera of noun i in the order of the CSV
+        """
+        return self.genera_table[self.genera_ids[i]]
+
+    def index(self, noun: str) -> int:
+        """
+        Returns the index of a noun, or -1 if it isn't in the dictionary
+        """
+        key = noun.encode("utf-8")
+        slots = self.slots
+        slot = zlib.crc32(key) % self.slot_count
+        while True:
+            i = slots[slot] - 1
+            if i < 0:
+                return -1
+            if self.noun_bytes(i) == key:
+                return i
+            slot = (slot + 1) % self.slot_count
+
+    def mask(self, noun: str) -> int:
+        """
+        Returns the genus bitmask of a noun, 0 if it isn't in the dictionary
+        """
+        i = self.index(noun)
+        if i < 0:
+            return 0
+        return self.masks[i]
+
+    def __contains__(self, noun: str) -> bool:
+        return self.index(noun) >= 0
+
+    def get(self, noun: str, default=None) -> Optional[List[Genus]]:
+        i = self.index(noun)
+        if i < 0:
+            return default
+        return self.genera(i)
+
+    def reversed_bound(self, key: bytes, lo: int, hi: int) -> int:
+        """
+        Returns the first position in [lo, hi) of the reversed index whose
+        reversed noun isn't less than key, hi if there is none
+        """
+        reversed_noun_bytes = self.reversed_noun_bytes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if reversed_noun_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def longest_head(self, noun: str, min_length: int = MIN_HEAD_LENGTH) -> int:
+        """
+        Returns the index of the longest noun in the dictionary that noun ends
+        with, e.g. the head noun of a compound, or -1 if there is none. The
+        reversed noun is searched in the reversed index. If it isn't there,
+        the longest head is a prefix of both it and the reversed noun sorting
+        just before it, so the search goes on with their common prefix, a few
+        times at most.
+        """
+        key = noun.encode("utf-8")[::-1]
+        hi = self.count
+
+        # min_length is in bytes, like the nouns in the file
+        while len(key) >= min_length:
+            j = self.reversed_bound(key, 0, hi)
+            if j < hi and self.reversed_noun_bytes(j) == key:
+                return self.reversed_order[j]
+            if j == 0:
+                break
+
+            previous = self.reversed_noun_bytes(j - 1)
+            length = common_prefix_length(previous, key)
+            if length == len(previous):
+                if length >= min_length:
+                    return self.reversed_order[j - 1]
+                break
+            key = key[:length]
+            hi = j - 1
+
+        return -1
+
+    def get_compound(
+        self, noun: str, min_length: int = MIN_HEAD_LENGTH
+    ) -> Optional[Tuple[str, List[Genus]]]:
+        """
+        Returns the head noun and the genera of a noun. Nouns that aren't in
+        the dictionary get the genera of their longest known head noun, as
+        German compounds have the gender of their last part.
+        """
+        i = self.longest_head(noun, min_length)
+        if i < 0:
+            return None
+        return self.noun_bytes(i).decode("utf-8"), self.genera(i)
+
+
+def read_magic(binary_file: str) -> bytes:
+    with open(binary_file, "rb") as f:
+        return f.read(len(MAGIC))
+
+
+def load(csv_file: str = CSV_FILE, binary_file: str = BINARY_FILE) -> GenderDictionary:
+    """
+    Loads the binary dictionary, building it first if it is missing, older
+    than the CSV or in an older format
+    """
+    if (
+        not os.path.exists(binary_file)
+        or (
+            os.path.exists(csv_file)
+            and os.path.getmtime(csv_file) > os.path.getmtime(binary_file)
+        )
+        or read_magic(binary_file) != MAGIC
+    ):
+        build(csv_file, binary_file)
+
+    return GenderDictionary(binary_file)
+
+
+def __getattr__(name):
+    # CORRECT_GENDERS is loaded on first access, so importing this module
+    # doesn't touch the disk
+    if name == "CORRECT_GENDERS":
+        globals()["CORRECT_GENDERS"] = load()
+        return globals()["CORRECT_GENDERS"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-        CORRECT_GENDERS[noun].append(genus)
 
 # Get the nouns with multiple genders
-# for key, val in CORRECT_GENDERS.items():
-#     if len(val) > 1:
-#         print(key, val)
\ No newline at end of file
+# for noun, genera in read_csv().items():
+#     if len(genera) > 1:
+#         print(noun, genera)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the CSV noun dictionary to the binary format"
+    )
+    parser.add_argument("csv_file", type=str, nargs="?", default=CSV_FILE)
+    parser.add_argument("binary_file", type=str, nargs="?", default=BINARY_FILE)
+    args = parser.parse_args()
+
+    build(args.csv_file, args.binary_file)
@@ -0,0 +1,209 @@
+import os
+import struct
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from easylang_de.audio import probe_duration
+from easylang_de.cache import load_json, write_json_atomic
+
+# Durations are cached per file, keyed by its size and modification time
+CACHE_FILE = ".durations.json"
+
+# Number of ffprobe processes running at the same time for the files that
+# can't be parsed directly
+FFPROBE_WORKERS = 8
+
+# Bitrates in kbit/s by (MPEG version 1 or 2, layer) and bitrate index
+BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Sample rates by version bits of the header (0: MPEG 2.5, 2: MPEG 2, 3: MPEG 1)
+SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+# How much of the file is searched for the first frame after the ID3v2 tag
+SYNC_SEARCH = 64 * 1024
+
+
+class FrameHeader:
+    """
+    Parsed header of an MPEG audio frame
+    """
+
+    def __init__(self, header: int):
+        version_bits = (header >> 19) & 0x3
+        layer_bits = (header >> 17) & 0x3
+        bitrate_index = (header >> 12) & 0xF
+        sample_rate_index = (header >> 10) & 0x3
+
+        if (
+            header >> 21 != 0x7FF
+            or version_bits == 1
+            or layer_bits == 0
+            or bitrate_index in (0, 15)
+            or sample_rate_index == 3
+        ):
+            raise ValueError("Not a valid frame header")
+
+        self.mpeg1 = version_bits == 3
+        self.layer = 4 - layer_bits
+        self.bitrate = (
+            BITRATES[(1 if self.mpeg1 else 2, self.layer)][bitrate_index] * 1000
+        )
+        self.sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+        self.padding = (header >> 9) & 0x1
+        self.mono = (header >> 6) & 0x3 == 3
+
+        if self.layer == 1:
+            self.samples = 384
+            self.length = (12 * self.bitrate // self.sample_rate + self.padding) * 4
+        elif self.layer == 3 and not self.mpeg1:
+            self.samples = 576
+            self.length = 72 * self.bitrate // self.sample_rate + self.padding
+        else:
+            self.samples = 1152
+            self.length = 144 * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def side_info_size(self) -> int:
+        if self.mpeg1:
+            return 17 if self.mono else 32
+        return 9 if self.mono else 17
+
+
+def id3v2_size(data: bytes) -> int:
+    """
+    Returns the size of the ID3v2 tag at the start of data, 0 if there is none
+    """
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def find_frame(data: bytes, start: int = 0) -> Optional[int]:
+    """
+    Returns the offset of the first frame in data whose successor is also a
+    valid frame, to skip over bytes that only look like a frame sync
+    """
+    i = data.find(b"\xff", start)
+    while 0 <= i <= len(data) - 4:
+        try:
+            header = FrameHeader(struct.unpack_from(">I", data, i)[0])
+            following = i + header.length
+            if following + 4 > len(data) or FrameHeader(
+                struct.unpack_from(">I", data, following)[0]
+            ):
+                return i
+        except ValueError:
+            pass
+        i = data.find(b"\xff", i + 1)
+    return None
+
+
+def mp3_duration(path: str) -> Optional[float]:
+    """
+    Returns the duration of an MP3 file in seconds from its frame headers,
+    using the Xing/Info or VBRI header of VBR files. Returns None if the file
+    can't be parsed.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        tag_size = id3v2_size(f.read(10))
+        f.seek(tag_size)
+        data = f.read(SYNC_SEARCH)
+        f.seek(max(0, size - 128))
+        has_id3v1 = f.read(3) == b"TAG"
+
+    offset = find_frame(data)
+    if offset is None:
+        return None
+    header = FrameHeader(struct.unpack_from(">I", data, offset)[0])
+
+    # Xing/Info header, after the side information of the first frame
+    xing = offset + 4 + header.side_info_size
+    if data[xing : xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", data, xing + 4)[0]
+        if flags & 0x1:
+            frames = struct.unpack_from(">I", data, xing + 8)[0]
+            return frames * header.samples / header.sample_rate
+
+    # VBRI header, always 32 bytes after the frame header
+    vbri = offset + 4 + 32
+    if data[vbri : vbri + 4] == b"VBRI":
+        frames = struct.unpack_from(">I", data, vbri + 14)[0]
+        return frames * header.samples / header.sample_rate
+
+    # Otherwise assume a constant bitrate
+    audio_size = size - tag_size - offset - (128 if has_id3v1 else 0)
+    return audio_size * 8 / header.bitrate
+
+
+def ffprobe_duration(path: str) -> Optional[float]:
+    try:
+        return probe_duration(path)
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+
+
+def get_durations(
+    paths: List[str],
+    cache_file: Optional[str] = None,
+    workers: int = FFPROBE_WORKERS,
+) -> Dict[str, Optional[float]]:
+    """
+    Returns the durations of the given audio files in seconds, or None for
+    files that couldn't be read. MP3 files are parsed directly, the others
+    and the ones that can't be parsed are probed with ffprobe in a pool of
+    workers. The durations are cached in cache_file.
+    """
+    cache = load_json(cache_file, {}) if cache_file else {}
+
+    durations = {}
+    keys = {}
+    probe = []
+    for path in paths:
+        stat = os.stat(path)
+        keys[path] = [stat.st_size, stat.st_mtime]
+        entry = cache.get(path)
+        if entry is not None and entry["key"] == keys[path]:
+            durations[path] = entry["duration"]
+            continue
+
+        duration = None
+        if path.lower().endswith(".mp3"):
+            try:
+                duration = mp3_duration(path)
+            except (OSError, struct.error):
+                pass
+        if duration is None:
+            probe.append(path)
+        else:
+            durations[path] = duration
+
+    if probe:
+        with ThreadPoolExecutor(workers) as executor:
+            durations.update(zip(probe, executor.map(ffprobe_duration, probe)))
+
+    if cache_file:
+        # Failures aren't cached, so that they are retried on the next run
+        cache = {
+            path: {"key": keys[path], "duration": durations[path]}
+            for path in paths
+            if durations[path] is not None
+        }
+        write_json_atomic(cache_file, cache)
+
+    return durations
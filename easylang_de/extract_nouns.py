@@ -1,67 +1,129 @@
 import argparse
+import importlib
 import json
-import sys
-from typing import Dict, List, Tuple
-import spacy
-from colour import Color
-from spacy import displacy
-from spacy.tokens import Span, Token, Doc
+import threading
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from spacy.language import Language
+    from spacy.tokens import Doc, Token
 
 MODEL = "de_dep_news_trf"
 # MODEL = "de_core_news_lg"
 # MODEL = "de_core_news_sm"
 
-try:
-    # Load German models for Spacy and Stanza
-    nlp_spacy = spacy.load(MODEL)
-except OSError:
-    import spacy.cli
+# Bump this whenever a change to the extraction changes its output, so that
+# the cached noun files get recomputed
+EXTRACTOR_VERSION = 1
 
-    print(f"Model {MODEL} not found. Downloading...")
-    spacy.cli.download(MODEL)
-    "Finished downloading model, please rerun this script"
-    sys.exit(0)
+# Spacy models that were already loaded in this process, by name. Importing
+# this module doesn't load any model (nor Spacy itself), they are loaded the
+# first time they are used.
+MODELS: Dict[str, "Language"] = {}
+MODELS_LOCK = threading.Lock()
 
 
-def serialize_token(token: Token):
+def load_model(name: str = MODEL) -> "Language":
     """
-    Serializes relevant information from a token to be saved in a JSON file
+    Returns the Spacy model with the given name, loading it on first use and
+    downloading it if it isn't installed
     """
-    ret = {}
-    ret["text"] = token.text
-    ret["pos"] = token.pos_
-    ret["dep"] = token.dep_
-    ret["morph"] = token.morph.to_dict()
-    ret["lemma"] = token.lemma_
-    ret["shape"] = token.shape_
-    ret["tag"] = token.tag_
-    ret["lang"] = token.lang_
-    ret["prefix"] = token.prefix_
-    ret["suffix"] = token.suffix_
+    with MODELS_LOCK:
+        if name not in MODELS:
+            import spacy
 
-    return ret
+            try:
+                MODELS[name] = spacy.load(name)
+            except OSError:
+                import spacy.cli
+
+                print(f"Model {name} not found. Downloading...")
+                spacy.cli.download(name)
+                # pip installed the package in a subprocess, after the import
+                # system cached the contents of site-packages, so the package
+                # isn't found until that cache is cleared
+                importlib.invalidate_caches()
+                MODELS[name] = spacy.load(name)
 
+        return MODELS[name]
 
-def extract_nouns(text: str) -> Tuple[Doc, Dict, List]:
+
+def preload(*names: str):
     """
-    Extracts nouns from a given text and returns the processed Spacy document,
-    the displacy options, and a list of nouns for later processing.
+    Loads the given models (or the default one) ahead of time, e.g. at the
+    start of a long-lived process
     """
-    nouns = []
+    for name in names or (MODEL,):
+        load_model(name)
 
-    # Process the sentence with both libraries
-    doc_spacy = nlp_spacy(text)
 
-    # Initialize an empty dictionary to store the unique articles
-    # and their corresponding colors
-    article_colors = {}
+def model_version(name: str = MODEL) -> str:
+    """
+    Returns the version of a model, without loading it if it is installed.
+    Otherwise it is downloaded and loaded first, so that the version is the
+    one of the model that will be used rather than None.
+    """
+    import spacy.util
 
-    # Create an empty list to contain the entities we want to highlight
-    entities = []
-    # Print POS tagging and dependency parsing results for debugging
-    for token in doc_spacy:
-        print(token.text, token.pos_, token.dep_)
+    version = spacy.util.get_package_version(name)
+    if version is None:
+        version = load_model(name).meta["version"]
+    return version
+
+
+# All the token fields that are saved for a noun
+TOKEN_FIELDS = (
+    "text",
+    "pos",
+    "dep",
+    "morph",
+    "lemma",
+    "shape",
+    "tag",
+    "lang",
+    "prefix",
+    "suffix",
+)
+
+# The token fields that are actually read when evaluating the nouns
+LEAN_TOKEN_FIELDS = ("text", "pos", "dep", "morph", "lemma", "tag")
+
+# Pipeline components that the noun extraction doesn't need
+HEADLESS_DISABLE = ["ner"]
 
+TOKEN_ATTRIBUTES = {
+    "text": "text",
+    "pos": "pos_",
+    "dep": "dep_",
+    "lemma": "lemma_",
+    "shape": "shape_",
+    "tag": "tag_",
+    "lang": "lang_",
+    "prefix": "prefix_",
+    "suffix": "suffix_",
+}
+
+
+def serialize_token(token: "Token", fields: Sequence[str] = TOKEN_FIELDS):
+    """
+    Serializes relevant information from a token to be saved in a JSON file
+    """
+    ret = {}
+    for field in fields:
+        if field == "morph":
+            ret["morph"] = token.morph.to_dict()
+        else:
+            ret[field] = getattr(token, TOKEN_ATTRIBUTES[field])
+
+    return ret
+
+
+def find_noun_spans(doc_spacy: "Doc") -> List[Tuple[int, int]]:
+    """
+    Returns the (start, end) token indices of the nouns together with their
+    signifiers and adjectives. The spans don't overlap.
+    """
+    spans = []
     entity_indices = set()
 
     # Loop through the tokens in the sentence
@@ -70,7 +132,6 @@ def extract_nouns(text: str) -> Tuple[Doc, Dict, List]:
         # We could also include proper nouns by adding "PROPN" to the list
         # but that would include names of people, places, etc.
         if token.pos_ in ["NOUN"]:
-            case = token.morph
             lefts = list(token.lefts)
             # rights = list(token.rights)
             # print(token.text, token.head, lefts)
@@ -88,23 +149,93 @@ def extract_nouns(text: str) -> Tuple[Doc, Dict, List]:
                 continue
 
             # Add indices leftmost_idx,...,rightmost_idx to the set of entity indices
-            entity_indices |= set(range(leftmost_idx, rightmost_idx))
+            entity_indices.update(range(leftmost_idx, rightmost_idx))
 
-            print(lefts, token, leftmost_idx, token.i)
+            spans.append((leftmost_idx, rightmost_idx))
 
-            tokens = [doc_spacy[i] for i in range(leftmost_idx, rightmost_idx)]
-            nouns.append([serialize_token(token) for token in tokens])
+    return spans
 
-            # Construct a new entity spanning from the article to the noun
-            # Include the case in the label
-            entity = Span(doc_spacy, leftmost_idx, rightmost_idx, label=f"({case})")
-            entities.append(entity)
 
-            # For postprocessing
-            # Assign a color to the article-case combination if it doesn't have one already
-            if entity.label_ not in article_colors:
-                # Generate a random color for the article-case combination
-                article_colors[entity.label_] = Color(pick_for=entity.label_).hex
+def extract_noun_spans(
+    doc_spacy: "Doc", fields: Sequence[str] = LEAN_TOKEN_FIELDS
+) -> List:
+    """
+    Headless version of extract_nouns_from_doc: only returns the serialized
+    nouns, without printing or building the visualization
+    """
+    return [
+        [serialize_token(doc_spacy[i], fields) for i in range(start, end)]
+        for start, end in find_noun_spans(doc_spacy)
+    ]
+
+
+def headless_disable(nlp_spacy: "Language") -> List[str]:
+    return [name for name in HEADLESS_DISABLE if name in nlp_spacy.pipe_names]
+
+
+def extract_nouns_headless(
+    text: str, fields: Sequence[str] = LEAN_TOKEN_FIELDS, model: str = MODEL
+) -> List:
+    """
+    Extracts the serialized nouns from a given text, running the Spacy pipeline
+    without the components the extraction doesn't need
+    """
+    nlp_spacy = load_model(model)
+    doc_spacy = nlp_spacy(text, disable=headless_disable(nlp_spacy))
+
+    return extract_noun_spans(doc_spacy, fields)
+
+
+def extract_nouns(text: str, model: str = MODEL) -> Tuple["Doc", Dict, List]:
+    """
+    Extracts nouns from a given text and returns the processed Spacy document,
+    the displacy options, and a list of nouns for later processing.
+    """
+    # Process the sentence with both libraries
+    doc_spacy = load_model(model)(text)
+
+    return extract_nouns_from_doc(doc_spacy)
+
+
+def extract_nouns_from_doc(doc_spacy: "Doc") -> Tuple["Doc", Dict, List]:
+    """
+    Same as extract_nouns, but for a document that was already processed by
+    the Spacy pipeline, e.g. through nlp_spacy.pipe
+    """
+    from colour import Color
+    from spacy.tokens import Span
+
+    nouns = []
+
+    # Initialize an empty dictionary to store the unique articles
+    # and their corresponding colors
+    article_colors = {}
+
+    # Create an empty list to contain the entities we want to highlight
+    entities = []
+    # Print POS tagging and dependency parsing results for debugging
+    for token in doc_spacy:
+        print(token.text, token.pos_, token.dep_)
+
+    for leftmost_idx, rightmost_idx in find_noun_spans(doc_spacy):
+        token = doc_spacy[rightmost_idx - 1]
+        case = token.morph
+
+        print(list(token.lefts), token, leftmost_idx, token.i)
+
+        tokens = [doc_spacy[i] for i in range(leftmost_idx, rightmost_idx)]
+        nouns.append([serialize_token(token) for token in tokens])
+
+        # Construct a new entity spanning from the article to the noun
+        # Include the case in the label
+        entity = Span(doc_spacy, leftmost_idx, rightmost_idx, label=f"({case})")
+        entities.append(entity)
+
+        # For postprocessing
+        # Assign a color to the article-case combination if it doesn't have one already
+        if entity.label_ not in article_colors:
+            # Generate a random color for the article-case combination
+            article_colors[entity.label_] = Color(pick_for=entity.label_).hex
 
     # Overwrite the doc.ents with our new entities
     doc_spacy.ents = entities
@@ -123,13 +254,16 @@ if __name__ == "__main__":
     parser.add_argument(
         "json_file", type=str, help="JSON file to display the extracted nouns from"
     )
+    parser.add_argument("--model", type=str, default=MODEL)
     args = parser.parse_args()
 
     # Read json file from the first argument
     with open(args.json_file) as f:
         data = json.load(f)
 
-    doc_spacy, options, nouns = extract_nouns(data["text"])
+    doc_spacy, options, nouns = extract_nouns(data["text"], args.model)
 
     # Serve the visualization
+    from spacy import displacy
+
     displacy.serve(doc_spacy, style="ent", options=options)
@@ -0,0 +1,362 @@
+import argparse
+import os
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from easylang_de.cache import atomic_open
+from easylang_de.dictionary import BINARY_FILE, GenderDictionary
+from easylang_de.dictionary import load as load_dictionary
+from easylang_de.genus import Genus
+
+# Deletion index of the binary dictionary, rebuilt when it is older than it
+# Versioned, an index of an older layout must not be read as this one
+INDEX_FILE = "nomen_genus.fuzzy2.npy"
+
+MAX_DISTANCE = 2
+# Only the deletes of the first and last AFFIX_LENGTH characters of every noun
+# are indexed, which keeps the index small. A candidate has to share a delete
+# at both ends, so compounds with the same first or last part rarely are
+# one. Candidates are verified on the whole noun.
+AFFIX_LENGTH = 7
+# Index entries are hash(delete) << 32 | length << 24 | noun index
+LENGTH_SHIFT = 24
+MAX_LENGTH = 0xFF
+NOUN_MASK = (1 << LENGTH_SHIFT) - 1
+# A word is looked up within one edit per CHARS_PER_EDIT characters, so words
+# shorter than that aren't looked up. Shorter words have too many nouns within
+# reach. Run with --evaluate to see how often a noun missing from the
+# dictionary is matched to another one, by length.
+CHARS_PER_EDIT = 5
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+# Number of looked up words whose matches are kept in memory
+LOOKUP_CACHE_SIZE = 65536
+
+
+@dataclass
+class FuzzyMatch:
+    noun: str
+    genera: List[Genus]
+    distance: int
+    # 1 - distance / length of the word, divided by the number of nouns with
+    # different genera that are just as close
+    confidence: float
+
+
+def deletes(word: str, max_distance: int = MAX_DISTANCE) -> Set[str]:
+    """
+    Returns the word and all strings made by deleting up to max_distance of
+    its characters
+    """
+    ret = {word}
+    level = {word}
+    for _ in range(max_distance):
+        level = {w[:i] + w[i + 1 :] for w in level for i in range(len(w))}
+        ret |= level
+    return ret
+
+
+def max_distance_for(word: str) -> int:
+    """
+    Returns the number of edits a word is looked up within, by its length
+    """
+    return len(word) // CHARS_PER_EDIT
+
+
+def delete_hash(word: str, suffix: bool = False) -> int:
+    # The deletes of the suffixes are hashed apart from the ones of the
+    # prefixes, so that both fit in the same index
+    return zlib.crc32(("\0" + word if suffix else word).encode("utf-8"))
+
+
+def affixes(word: str) -> List[Tuple[str, bool]]:
+    return [(word[:AFFIX_LENGTH], False), (word[-AFFIX_LENGTH:], True)]
+
+
+def edit_distance(a: str, b: str, max_distance: int = MAX_DISTANCE) -> int:
+    """
+    Returns the optimal string alignment distance of a and b (edits and
+    adjacent transpositions), or max_distance + 1 if it is greater than that.
+    Only the cells within max_distance of the diagonal are computed.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    # The candidates share both ends with the word, which don't change the
+    # distance and are cut before the quadratic part
+    start = 0
+    length = min(len(a), len(b))
+    while start < length and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < length - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start : len(a) - end]
+    b = b[start : len(b) - end]
+    if not a or not b:
+        return min(max(len(a), len(b)), max_distance + 1)
+
+    too_far = max_distance + 1
+    previous2 = None
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            cost = a[i - 1] != b[j - 1]
+            d = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d = min(d, previous2[j - 2] + 1)
+            current[j] = d
+            if d < row_min:
+                row_min = d
+        if row_min > max_distance:
+            return too_far
+        previous2, previous = previous, current
+
+    return min(previous[-1], too_far)
+
+
+def build(
+    dictionary: GenderDictionary,
+    index_file: str = INDEX_FILE,
+    max_distance: int = MAX_DISTANCE,
+):
+    """
+    Builds the deletion index of a dictionary: a sorted uint64 array of
+    hash(delete) << 32 | noun length << 24 | noun index, for every delete of
+    the prefix and of the suffix of every noun. Written atomically, as load
+    may rebuild it while other processes read it.
+    """
+    if len(dictionary) > NOUN_MASK:
+        raise ValueError("Too many nouns for the deletion index")
+
+    entries = set()
+    for i, noun in enumerate(dictionary.nouns):
+        entry = min(len(noun), MAX_LENGTH) << LENGTH_SHIFT | i
+        for affix, suffix in affixes(noun):
+            for delete in deletes(affix, max_distance):
+                entries.add(delete_hash(delete, suffix) << 32 | entry)
+
+    index = np.fromiter(entries, dtype=np.uint64, count=len(entries))
+    index.sort()
+    with atomic_open(index_file, "wb") as f:
+        np.save(f, index)
+
+
+class FuzzyDictionary:
+    """
+    Looks up nouns that aren't in the dictionary, e.g. misspelled by the
+    transcription, among the dictionary nouns within a few edits of them.
+    Both the query and the nouns are reduced to their deletes, so a lookup
+    only needs the deletes of the query instead of all of its edits.
+    """
+
+    def __init__(
+        self,
+        dictionary: GenderDictionary,
+        index_file: str = INDEX_FILE,
+        max_distance: int = MAX_DISTANCE,
+    ):
+        self.dictionary = dictionary
+        # A plain array over the memory map, slicing a np.memmap is slower
+        self.index = np.load(index_file, mmap_mode="r").view(np.ndarray)
+        self.max_distance = max_distance
+        # The same misspellings come up again and again in a corpus
+        self.lookup = lru_cache(LOOKUP_CACHE_SIZE)(self.lookup)
+
+    def candidates(self, word: str, distance: int) -> List[int]:
+        """
+        Returns the indices of the nouns that may be within distance of word:
+        the ones sharing a delete of its prefix and one of its suffix, among
+        the ones whose length is within distance of it
+        """
+        keys = []
+        sides = []
+        for affix, suffix in affixes(word):
+            hashes = [delete_hash(d, suffix) << 32 for d in deletes(affix, distance)]
+            keys += hashes
+            sides += [suffix] * len(hashes)
+        keys = np.array(keys, dtype=np.uint64)
+
+        # All the entries of all the keys at once: the positions of the
+        # entries of key k are starts[k] to ends[k]
+        starts = np.searchsorted(self.index, keys)
+        ends = np.searchsorted(self.index, keys | np.uint64(0xFFFFFFFF), "right")
+        counts = ends - starts
+        total = int(counts.sum())
+        if not total:
+            return []
+        firsts = np.cumsum(counts) - counts
+        positions = np.arange(total) + np.repeat(starts - firsts, counts)
+        entries = self.index[positions]
+        sides = np.repeat(np.array(sides), counts)
+
+        # Nouns too much shorter or longer can't be within distance, drop them
+        # before they are decoded and compared
+        lengths = (entries >> np.uint64(LENGTH_SHIFT)).astype(np.int64) & MAX_LENGTH
+        close = np.abs(lengths - min(len(word), MAX_LENGTH)) <= distance
+        nouns = entries & np.uint64(NOUN_MASK)
+        return np.intersect1d(nouns[close & ~sides], nouns[close & sides]).tolist()
+
+    def nearest(self, word: str, max_distance: int) -> List[FuzzyMatch]:
+        """
+        Returns the dictionary nouns other than word that are closest to it,
+        all at the same distance of at most max_distance, or none
+        """
+        # Look for the nouns one edit away first, which only needs the
+        # deletes of one character
+        nouns = self.dictionary.nouns
+        matches = []
+        for distance in range(1, min(max_distance, self.max_distance) + 1):
+            for i in self.candidates(word, distance):
+                noun = nouns[i]
+                d = edit_distance(word, noun, distance)
+                if 0 < d <= distance:
+                    matches.append((i, noun, d))
+            if matches:
+                break
+        else:
+            return []
+
+        distance = min(d for _, _, d in matches)
+        matches = [(i, noun) for i, noun, d in matches if d == distance]
+        masks = {self.dictionary.masks[i] for i, _ in matches}
+        confidence = (1 - distance / len(word)) / len(masks)
+
+        return [
+            FuzzyMatch(noun, self.dictionary.genera(i), distance, confidence)
+            for i, noun in sorted(matches, key=lambda match: match[1])
+        ]
+
+    def lookup(self, word: str, max_distance: Optional[int] = None) -> List[FuzzyMatch]:
+        """
+        Returns the dictionary nouns closest to word, all at the same
+        distance, or none if there is none within max_distance. Short words
+        are only looked up within a smaller distance, see max_distance_for.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        word = word.lower()
+        i = self.dictionary.index(word)
+        if i >= 0:
+            return [FuzzyMatch(word, self.dictionary.genera(i), 0, 1.0)]
+
+        max_distance = min(max_distance, max_distance_for(word))
+        if max_distance < 1:
+            return []
+        return self.nearest(word, max_distance)
+
+    def get(
+        self, word: str, min_confidence: float = DEFAULT_MIN_CONFIDENCE
+    ) -> Optional[FuzzyMatch]:
+        """
+        Returns the closest dictionary noun to word if the match is at least
+        min_confidence, preferring the one with the fewest genera among
+        equally close nouns
+        """
+        matches = self.lookup(word)
+        if not matches or matches[0].confidence < min_confidence:
+            return None
+        return min(matches, key=lambda match: len(set(match.genera)))
+
+
+def load(
+    binary_file: str = BINARY_FILE, index_file: str = INDEX_FILE
+) -> FuzzyDictionary:
+    """
+    Loads the fuzzy dictionary, building the deletion index first if it is
+    missing or older than the binary dictionary
+    """
+    dictionary = load_dictionary(binary_file=binary_file)
+    if not os.path.exists(index_file) or os.path.getmtime(
+        binary_file
+    ) > os.path.getmtime(index_file):
+        build(dictionary, index_file)
+
+    return FuzzyDictionary(dictionary, index_file)
+
+
+def __getattr__(name):
+    # Loaded on first access, like dictionary.CORRECT_GENDERS
+    if name == "FUZZY_GENDERS":
+        preload()
+        return globals()["FUZZY_GENDERS"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def preload():
+    """
+    Loads FUZZY_GENDERS ahead of time, building the deletion index if needed,
+    e.g. once before starting the workers that use it
+    """
+    if "FUZZY_GENDERS" not in globals():
+        globals()["FUZZY_GENDERS"] = load()
+
+
+def false_friends(
+    fuzzy: FuzzyDictionary, min_confidence: float = DEFAULT_MIN_CONFIDENCE
+) -> Dict[int, Tuple[int, int, int]]:
+    """
+    Looks up every dictionary noun as if it were missing from the dictionary,
+    like the correct words the dictionary lacks. Returns by length the number
+    of nouns, of the ones matched to another noun, and of the ones matched to
+    a noun with other genera.
+    """
+    ret = {}
+    dictionary = fuzzy.dictionary
+    for i, noun in enumerate(dictionary.nouns):
+        count, matched, other_genera = ret.get(len(noun), (0, 0, 0))
+        match = None
+        max_distance = min(fuzzy.max_distance, max_distance_for(noun))
+        if max_distance > 0:
+            matches = fuzzy.nearest(noun, max_distance)
+            if matches and matches[0].confidence >= min_confidence:
+                match = min(matches, key=lambda match: len(set(match.genera)))
+        if match is not None:
+            matched += 1
+            other_genera += set(match.genera) != set(dictionary.genera(i))
+        ret[len(noun)] = (count + 1, matched, other_genera)
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Look up the dictionary nouns closest to the given words"
+    )
+    parser.add_argument("words", type=str, nargs="*")
+    parser.add_argument("--max-distance", type=int, default=MAX_DISTANCE)
+    parser.add_argument(
+        "--evaluate",
+        action="store_true",
+        help="Print by length how often a noun missing from the dictionary would "
+        "be matched to another one",
+    )
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE)
+    args = parser.parse_args()
+
+    fuzzy = load()
+    if args.evaluate:
+        print("length  nouns  matched  other genera")
+        for length, (count, matched, other_genera) in sorted(
+            false_friends(fuzzy, args.min_confidence).items()
+        ):
+            print(
+                f"{length:6}  {count:5}  {matched / count:7.1%}  "
+                f"{other_genera / count:12.1%}"
+            )
+    for word in args.words:
+        matches = fuzzy.lookup(word, args.max_distance)
+        if not matches:
+            print(f"{word}: no match")
+        for match in matches:
+            print(
+                f"{word}: {match.noun} {match.genera}, distance {match.distance}, "
+                f"confidence {match.confidence:.2f}"
+            )
@@ -28,11 +28,51 @@ class AllowedMorph:
     numerus: Numerus
 
 
+GENUS_BITS = {
+    Genus.M: 1,
+    Genus.F: 2,
+    Genus.N: 4,
+}
+ALL_GENERA = GENUS_BITS[Genus.M] | GENUS_BITS[Genus.F] | GENUS_BITS[Genus.N]
+
+# None, for a case or number spaCy didn't assign, has the last code. With an
+# unknown case every genus is allowed, as no allowed morph matches it.
+KASUS_VALUES = [*Kasus, None]
+NUMERUS_VALUES = [*Numerus, None]
+KASUS_CODES = {kasus: code for code, kasus in enumerate(KASUS_VALUES)}
+NUMERUS_CODES = {numerus: code for code, numerus in enumerate(NUMERUS_VALUES)}
+
+
+def genera_mask(genus: Union[Genus, List[Genus]]) -> int:
+    """
+    Converts a genus or a list of genera to a bitmask of GENUS_BITS
+    """
+    if isinstance(genus, list):
+        mask = 0
+        for g in genus:
+            mask |= GENUS_BITS[g]
+        return mask
+    else:
+        return GENUS_BITS[genus]
+
+
 class GenusResolver:
     def __init__(self, *args):
         self.allowed_morphs: List[AllowedMorph] = args
 
-    def get_possible_genera(self, kasus: Kasus, numerus: Numerus) -> List[Genus]:
+        # Precompute the possible genera for every (Kasus, Numerus) pair once,
+        # so that lookups don't have to scan the allowed morphs again
+        self.genus_masks: List[int] = [0] * (len(KASUS_VALUES) * len(NUMERUS_VALUES))
+        for kasus in KASUS_VALUES:
+            for numerus in NUMERUS_VALUES:
+                mask = genera_mask(self._scan_possible_genera(kasus, numerus))
+                self.genus_masks[self._index(kasus, numerus)] = mask
+
+    @staticmethod
+    def _index(kasus: Kasus, numerus: Numerus) -> int:
+        return KASUS_CODES[kasus] * len(NUMERUS_VALUES) + NUMERUS_CODES[numerus]
+
+    def _scan_possible_genera(self, kasus: Kasus, numerus: Numerus) -> List[Genus]:
         ret = []
         for morph in self.allowed_morphs:
             if (
@@ -49,25 +89,29 @@ class GenusResolver:
         ret = list(set(ret))
         return ret
 
+    def get_possible_genera(self, kasus: Kasus, numerus: Numerus) -> List[Genus]:
+        mask = self.genus_masks[self._index(kasus, numerus)]
+        return [genus for genus, bit in GENUS_BITS.items() if mask & bit]
+
+    def allowed_mask(self, kasus: Kasus, numerus: Numerus) -> int:
+        """
+        Returns the bitmask of genera that are compatible with the given case
+        and number. If the resolver has no information, every genus is allowed.
+        """
+        mask = self.genus_masks[self._index(kasus, numerus)]
+        if mask == 0:
+            return ALL_GENERA
+        return mask
+
     def _check_possible_genera(
         self, kasus: Kasus, numerus: Numerus, genus: Genus
     ) -> bool:
-        genera = self.get_possible_genera(kasus, numerus)
-        if genera == []:
-            return True
-        else:
-            return genus in genera
+        return bool(self.allowed_mask(kasus, numerus) & GENUS_BITS[genus])
 
     def check_possible_genera(
         self, kasus: Kasus, numerus: Numerus, genus: Union[Genus, List[Genus]]
     ) -> bool:
-        if isinstance(genus, list):
-            for g in genus:
-                if self._check_possible_genera(kasus, numerus, g):
-                    return True
-            return False
-        else:
-            return self._check_possible_genera(kasus, numerus, genus)
+        return bool(self.allowed_mask(kasus, numerus) & genera_mask(genus))
 
 
 RESOLVERS = {
@@ -345,3 +389,39 @@ for term in TERM_N:
         AllowedMorph(Genus.M, Kasus.ACC, Numerus.SG),
         AllowedMorph(None, Kasus.DAT, Numerus.PL),
     )
+
+
+# Dense lookup table of the resolvers, compiled once at import. The entry for
+# determiner code d, Kasus code k and Numerus code n is stored at
+# GENUS_TABLE[(d * len(KASUS_VALUES) + k) * len(NUMERUS_VALUES) + n] and holds
+# the bitmask of allowed genera.
+DETERMINERS = sorted(RESOLVERS)
+DETERMINER_CODES = {det: code for code, det in enumerate(DETERMINERS)}
+
+GENUS_TABLE = bytes(
+    RESOLVERS[det].allowed_mask(kasus, numerus)
+    for det in DETERMINERS
+    for kasus in KASUS_VALUES
+    for numerus in NUMERUS_VALUES
+)
+
+
+def check_possible_genera_batch(determiners, kasus, numerus, genera):
+    """
+    Vectorized version of GenusResolver.check_possible_genera. Takes arrays of
+    DETERMINER_CODES, KASUS_CODES, NUMERUS_CODES and genera bitmasks (see
+    genera_mask) of the same length and returns a boolean array telling for
+    each entry whether one of the genera is allowed. The codes of None stand
+    for a case or number spaCy didn't assign, like in the scalar version.
+    """
+    import numpy as np
+
+    table = np.frombuffer(GENUS_TABLE, dtype=np.uint8).reshape(
+        len(DETERMINERS), len(KASUS_VALUES), len(NUMERUS_VALUES)
+    )
+    allowed = table[
+        np.asarray(determiners, dtype=np.intp),
+        np.asarray(kasus, dtype=np.intp),
+        np.asarray(numerus, dtype=np.intp),
+    ]
+    return (allowed & np.asarray(genera, dtype=np.uint8)) != 0
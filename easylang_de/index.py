@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import sqlite3
+from typing import Iterator, List, Optional, Tuple
+
+from easylang_de.corpus import NOUNS_DIR, list_noun_files
+from easylang_de.genus import DETERMINER_CODES
+
+INDEX_FILE = "nouns.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL UNIQUE,
+    key TEXT NOT NULL,
+    video_id TEXT,
+    video_title TEXT,
+    video_link TEXT
+);
+CREATE TABLE IF NOT EXISTS spans (
+    document INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    determiner TEXT,
+    lemma TEXT NOT NULL,
+    kasus TEXT,
+    numerus TEXT,
+    genus TEXT,
+    start REAL,
+    PRIMARY KEY (document, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS spans_lemma ON spans (lemma, determiner);
+CREATE INDEX IF NOT EXISTS spans_determiner ON spans (determiner, kasus, numerus);
+CREATE INDEX IF NOT EXISTS documents_video_id ON documents (video_id);
+"""
+
+# Query arguments by the column they filter on
+FILTERS = {
+    "lemma": "spans.lemma",
+    "determiner": "spans.determiner",
+    "kasus": "spans.kasus",
+    "numerus": "spans.numerus",
+    "genus": "spans.genus",
+    "video_id": "documents.video_id",
+}
+
+
+def connect(path: str = INDEX_FILE) -> sqlite3.Connection:
+    """
+    Opens the index, creating it if it doesn't exist
+    """
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def file_key(path: str) -> str:
+    stat = os.stat(path)
+    return json.dumps([stat.st_size, stat.st_mtime])
+
+
+def span_rows(data: dict) -> Iterator[Tuple]:
+    """
+    Yields (position, text, determiner, lemma, kasus, numerus, genus, start) of
+    every span of a noun document. determiner is the first word of the span
+    that has a resolver, lemma the lowercased lemma of the noun.
+    """
+    noun_segments = data.get("noun_segments")
+    for i, span in enumerate(data["nouns"]):
+        noun = span[-1]
+        determiner = None
+        for det in span[:-1]:
+            if det["text"].lower() in DETERMINER_CODES:
+                determiner = det["text"].lower()
+                break
+
+        yield (
+            i,
+            " ".join([token["text"] for token in span]),
+            determiner,
+            noun.get("lemma", noun["text"]).lower(),
+            noun["morph"].get("Case"),
+            noun["morph"].get("Number"),
+            noun["morph"].get("Gender"),
+            noun_segments[i]["start"] if noun_segments is not None else None,
+        )
+
+
+def add_document(connection: sqlite3.Connection, file: str, data: dict, key: str):
+    """
+    Indexes a noun document under its file name relative to the nouns
+    directory, replacing the previous version of the file. key identifies the
+    version of the file, so that unchanged files aren't indexed again.
+    """
+    with connection:
+        connection.execute("DELETE FROM documents WHERE file = ?", (file,))
+        document = connection.execute(
+            "INSERT INTO documents (file, key, video_id, video_title, video_link) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                file,
+                key,
+                data.get("video_id"),
+                data.get("video_title"),
+                data.get("video_link"),
+            ),
+        ).lastrowid
+        connection.executemany(
+            "INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((document, *row) for row in span_rows(data)),
+        )
+
+
+def update(
+    connection: sqlite3.Connection, nouns_dir: str = NOUNS_DIR
+) -> Tuple[int, int]:
+    """
+    Brings the index up to date with the JSON noun files under nouns_dir,
+    indexing only the files that changed since they were indexed and removing
+    the ones that were deleted. Returns the number of files indexed and removed.
+    """
+    indexed = dict(connection.execute("SELECT file, key FROM documents"))
+
+    added = 0
+    files = set()
+    for path in list_noun_files(nouns_dir):
+        file = os.path.relpath(path, nouns_dir)
+        files.add(file)
+        key = file_key(path)
+        if indexed.get(file) == key:
+            continue
+
+        with open(path) as f:
+            add_document(connection, file, json.load(f), key)
+        added += 1
+
+    removed = [file for file in indexed if file not in files]
+    with connection:
+        connection.executemany(
+            "DELETE FROM documents WHERE file = ?", [(file,) for file in removed]
+        )
+
+    return added, len(removed)
+
+
+def query(
+    connection: sqlite3.Connection,
+    limit: Optional[int] = None,
+    **filters: str,
+) -> List[dict]:
+    """
+    Returns the spans matching all filters (see FILTERS), e.g.
+    query(connection, lemma="aufgabe", determiner="der"), with the title of
+    their video and a link to it, at the time of the span if it is known
+    """
+    conditions = []
+    values = []
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter: {name}")
+        conditions.append(f"{FILTERS[name]} = ?")
+        # Lemmas and determiners are stored lowercased
+        values.append(value.lower() if name in ("lemma", "determiner") else value)
+
+    sql = (
+        "SELECT spans.text, spans.determiner, spans.lemma, spans.kasus, "
+        "spans.numerus, spans.genus, spans.start, documents.file, "
+        "documents.video_id, documents.video_title, documents.video_link "
+        "FROM spans JOIN documents ON spans.document = documents.id"
+    )
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY documents.file, spans.position"
+    if limit is not None:
+        sql += " LIMIT ?"
+        values.append(limit)
+
+    ret = []
+    for row in connection.execute(sql, values):
+        span = dict(row)
+        if span["start"] is not None and span["video_link"]:
+            span["video_link"] += f"&t={int(span['start'])}s"
+        ret.append(span)
+
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the noun spans of the corpus through a persistent index"
+    )
+    parser.add_argument("--index", type=str, default=INDEX_FILE)
+    parser.add_argument("--nouns-dir", type=str, default=NOUNS_DIR)
+    parser.add_argument(
+        "--no-update",
+        action="store_true",
+        help="Don't index the noun files that changed before querying",
+    )
+    parser.add_argument("--lemma", type=str, help="Lemma of the noun, e.g. Aufgabe")
+    parser.add_argument("--determiner", type=str, help="e.g. der")
+    parser.add_argument("--case", type=str, help="Case spaCy assigned, e.g. Dat")
+    parser.add_argument("--number", type=str, help="Number spaCy assigned, e.g. Sing")
+    parser.add_argument("--gender", type=str, help="Gender spaCy assigned, e.g. Fem")
+    parser.add_argument("--video-id", type=str)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument(
+        "--count", action="store_true", help="Only print the number of matches"
+    )
+    args = parser.parse_args()
+
+    connection = connect(args.index)
+    if not args.no_update:
+        added, removed = update(connection, args.nouns_dir)
+        if added or removed:
+            print(f"Indexed {added} files, removed {removed}")
+
+    spans = query(
+        connection,
+        limit=args.limit,
+        lemma=args.lemma,
+        determiner=args.determiner,
+        kasus=args.case,
+        numerus=args.number,
+        genus=args.gender,
+        video_id=args.video_id,
+    )
+
+    if args.count:
+        print(len(spans))
+    else:
+        for span in spans:
+            print(
+                f"{span['text']}, {span['kasus']} {span['numerus']}, "
+                f"{span['video_title']}, {span['video_link']}"
+            )
@@ -0,0 +1,99 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+
+class Metrics:
+    """
+    Collects the wall and CPU time spent in named stages and named counters
+    (tokens, spans, bytes, cache hits, ...) of a run. Stages may overlap, e.g.
+    when they run concurrently, so their times don't have to add up to the
+    total time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Adds the time spent in the with block to the stage
+        """
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            with self.lock:
+                stage = self.stages.setdefault(
+                    name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+                )
+                stage["calls"] += 1
+                stage["wall_seconds"] += wall
+                stage["cpu_seconds"] += cpu
+
+    def count(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> dict:
+        """
+        Returns the stages and counters, with the rate of every counter per
+        second of the whole run and per second of the stage it is named after
+        (e.g. "extract.spans" per second of "extract")
+        """
+        wall = time.perf_counter() - self.start_wall
+        with self.lock:
+            rates = {}
+            for name, value in self.counters.items():
+                stage_name = name.split(".")[0]
+                if "." in name and stage_name in self.stages:
+                    seconds = self.stages[stage_name]["wall_seconds"]
+                else:
+                    seconds = wall
+                if seconds > 0:
+                    rates[f"{name}_per_sec"] = value / seconds
+
+            return {
+                "wall_seconds": wall,
+                "cpu_seconds": time.process_time() - self.start_cpu,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "rates": rates,
+            }
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# Metrics of the current process, shared by all stages of the pipeline
+metrics = Metrics()
+
+
+def profile(function: Callable, *args, output: Optional[str] = None, **kwargs):
+    """
+    Runs function under cProfile and returns its result. The profile is saved
+    to output, to be read with pstats or snakeviz, or printed if there is none.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        if output:
+            profiler.dump_stats(output)
+        else:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
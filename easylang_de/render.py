@@ -0,0 +1,209 @@
+import argparse
+import html
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
+
+from easylang_de.batch_extract_nouns import DATA_DIR
+from easylang_de.corpus import NOUNS_DIR, list_noun_files, morph_to_str
+
+HTML_DIR = "html"
+
+# Label prefix and color of the spans the evaluation found incorrect
+INCORRECT_LABEL = "INCORRECT"
+INCORRECT_COLOR = "#ff4d4d"
+
+
+def locate_spans(text: str, spans: List[List[dict]]) -> List[Optional[Tuple[int, int]]]:
+    """
+    Returns the (start, end) character offsets of each span in the text, or
+    None for the spans that couldn't be found. The spans are in text order,
+    so each one is searched after the previous one. Tokens may be separated
+    by whitespace or nothing, e.g. before punctuation.
+    """
+    ret = []
+    position = 0
+    for span in spans:
+        pattern = r"\s*".join(re.escape(token["text"]) for token in span)
+        # Don't match within words, e.g. "der" in "oder"
+        if span[0]["text"][:1].isalnum():
+            pattern = r"(?<!\w)" + pattern
+        if span[-1]["text"][-1:].isalnum():
+            pattern += r"(?!\w)"
+        match = re.compile(pattern).search(text, position)
+        if match is None:
+            ret.append(None)
+            continue
+        ret.append(match.span())
+        position = match.end()
+
+    return ret
+
+
+def span_label(span: List[dict]) -> str:
+    """
+    The label extract_nouns gives a span: the morphology of its noun
+    """
+    return f"({morph_to_str(span[-1]['morph'])})"
+
+
+def span_correctness(spans: List[List[dict]]) -> List[Optional[bool]]:
+    """
+    Evaluates every span, None for the ones that can't be checked
+    """
+    # Loads the dictionary, so only imported when needed
+    from easylang_de.calculate_error_rate import MissingCase, evaluate_span
+
+    ret = []
+    for span in spans:
+        try:
+            result = evaluate_span(span)
+        except MissingCase:
+            result = None
+        ret.append(None if result is None else result.is_correct)
+
+    return ret
+
+
+def render_document(
+    text: str, spans: List[List[dict]], title: str = "", evaluate: bool = True
+) -> Tuple[str, int, int]:
+    """
+    Renders the noun spans of a transcription with displaCy, the same way
+    extract_nouns does but from the stored spans instead of a parsed document.
+    With evaluate, the incorrect spans are labeled and colored as such.
+    Returns the HTML and the number of incorrect and unlocated spans.
+    """
+    from colour import Color
+    from spacy import displacy
+
+    correctness = span_correctness(spans) if evaluate else [None] * len(spans)
+
+    ents = []
+    colors = {}
+    incorrect = unlocated = 0
+    for span, offsets, is_correct in zip(spans, locate_spans(text, spans), correctness):
+        if offsets is None:
+            unlocated += 1
+            continue
+
+        label = span_label(span)
+        if is_correct is False:
+            incorrect += 1
+            label = f"{INCORRECT_LABEL} {label}"
+            colors[label] = INCORRECT_COLOR
+        elif label not in colors:
+            colors[label] = Color(pick_for=label).hex
+
+        ents.append({"start": offsets[0], "end": offsets[1], "label": label})
+
+    page = displacy.render(
+        {"text": text, "ents": ents, "title": title},
+        style="ent",
+        manual=True,
+        page=True,
+        options={"ents": list(colors), "colors": colors},
+    )
+
+    return page, incorrect, unlocated
+
+
+def html_file(file: str) -> str:
+    return os.path.splitext(os.path.basename(file))[0] + ".html"
+
+
+def render_file(
+    file: str, data_dir: str, output_dir: str, evaluate: bool = True
+) -> Optional[dict]:
+    """
+    Renders one noun file with the text of its transcription to output_dir.
+    Returns the video fields of the file with the counts of its spans, or None
+    if the transcription is missing.
+    """
+    with open(file) as f:
+        data = json.load(f)
+
+    transcription = os.path.join(data_dir, os.path.basename(file))
+    if not os.path.exists(transcription):
+        return None
+    with open(transcription) as f:
+        text = json.load(f)["text"]
+
+    page, incorrect, unlocated = render_document(
+        text, data["nouns"], data.get("video_title", ""), evaluate
+    )
+    with open(os.path.join(output_dir, html_file(file)), "w") as f:
+        f.write(page)
+
+    return {
+        "file": html_file(file),
+        "video_title": data.get("video_title", ""),
+        "video_link": data.get("video_link", ""),
+        "spans": len(data["nouns"]),
+        "incorrect": incorrect,
+        "unlocated": unlocated,
+    }
+
+
+def write_index(pages: List[dict], output_dir: str):
+    """
+    Writes an index.html linking to every rendered video
+    """
+    rows = "\n".join(
+        f'<tr><td><a href="{html.escape(page["file"])}">'
+        f'{html.escape(page["video_title"])}</a></td>'
+        f'<td><a href="{html.escape(page["video_link"])}">video</a></td>'
+        f'<td>{page["spans"]}</td><td>{page["incorrect"]}</td></tr>'
+        for page in pages
+    )
+    with open(os.path.join(output_dir, "index.html"), "w") as f:
+        f.write(
+            "<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+            "<title>Nouns</title></head><body><table>\n"
+            "<tr><th>Video</th><th></th><th>Nouns</th><th>Incorrect</th></tr>\n"
+            f"{rows}\n</table></body></html>\n"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render the extracted nouns of every video to static HTML, "
+        "without running the Spacy model"
+    )
+    parser.add_argument("--nouns-dir", type=str, default=NOUNS_DIR)
+    parser.add_argument("--data-dir", type=str, default=DATA_DIR)
+    parser.add_argument("--output-dir", type=str, default=HTML_DIR)
+    parser.add_argument("--n-process", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--no-evaluate",
+        action="store_true",
+        help="Don't highlight the spans with an incorrect genus",
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    files = list_noun_files(args.nouns_dir)
+    render_one = partial(
+        render_file,
+        data_dir=args.data_dir,
+        output_dir=args.output_dir,
+        evaluate=not args.no_evaluate,
+    )
+    with ProcessPoolExecutor(args.n_process) as executor:
+        chunksize = max(1, len(files) // (args.n_process * 8))
+        pages = list(executor.map(render_one, files, chunksize=chunksize))
+
+    missing = sum(page is None for page in pages)
+    pages = [page for page in pages if page is not None]
+    write_index(pages, args.output_dir)
+
+    print(f"Rendered {len(pages)} videos to {args.output_dir}")
+    if missing:
+        print(f"Skipped {missing} videos without a transcription")
+    unlocated = sum(page["unlocated"] for page in pages)
+    if unlocated:
+        print(f"Couldn't find {unlocated} spans in their transcription")
@@ -0,0 +1,250 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+from easylang_de.extract_nouns import (
+    LEAN_TOKEN_FIELDS,
+    MODEL,
+    TOKEN_FIELDS,
+    extract_noun_spans,
+    headless_disable,
+    load_model,
+)
+from easylang_de.instrument import metrics
+
+if TYPE_CHECKING:
+    from spacy.language import Language
+
+HOST = "127.0.0.1"
+PORT = 8400
+
+# A batch is run as soon as it has MAX_BATCH_SIZE texts, or MAX_WAIT seconds
+# after its first text arrived
+MAX_BATCH_SIZE = 16
+MAX_WAIT = 0.01
+
+# Texts waiting for a batch. Requests beyond this are rejected with 503.
+MAX_QUEUE = 256
+
+# How long a request waits for its result before giving up with 504
+REQUEST_TIMEOUT = 300
+
+
+class Batcher:
+    """
+    Gathers the texts submitted from concurrent requests into micro-batches
+    for nlp_spacy.pipe, run one at a time by a worker thread
+    """
+
+    def __init__(
+        self,
+        nlp_spacy: "Language",
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_WAIT,
+        max_queue: int = MAX_QUEUE,
+    ):
+        self.nlp_spacy = nlp_spacy
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue: "queue.Queue[Tuple[str, Sequence[str], Future]]" = queue.Queue(
+            max_queue
+        )
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, text: str, fields: Sequence[str] = LEAN_TOKEN_FIELDS) -> Future:
+        """
+        Queues a text and returns the future of its serialized nouns. Raises
+        queue.Full if too many texts are already waiting.
+        """
+        future = Future()
+        self.queue.put_nowait((text, fields, future))
+        return future
+
+    def next_batch(self) -> List[Tuple[str, Sequence[str], Future]]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        disable = headless_disable(self.nlp_spacy)
+        while True:
+            batch = self.next_batch()
+            texts = [text for text, _, _ in batch]
+            try:
+                with metrics.stage("batch"):
+                    docs = self.nlp_spacy.pipe(
+                        texts, batch_size=len(texts), disable=disable
+                    )
+                    for doc_spacy, (_, fields, future) in zip(docs, batch):
+                        metrics.count("batch.tokens", len(doc_spacy))
+                        future.set_result(extract_noun_spans(doc_spacy, fields))
+            except Exception as e:
+                metrics.count("errors")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            metrics.count("batch.docs", len(batch))
+            metrics.count("batches")
+
+
+class ExtractionHandler(BaseHTTPRequestHandler):
+    """
+    POST /extract with {"text": ..., "fields": [...]} returns {"nouns": [...]},
+    the nouns as serialize_token serializes them. GET /health and /metrics
+    return the state of the server.
+    """
+
+    # Set on the subclass created by serve
+    batcher: Batcher
+    model: str
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "model": self.model})
+        elif self.path == "/metrics":
+            self.send_json(
+                200, {**metrics.summary(), "queued": self.batcher.queue.qsize()}
+            )
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/extract":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            text = request["text"]
+            fields = request.get("fields", LEAN_TOKEN_FIELDS)
+            if not isinstance(text, str) or not set(fields) <= set(TOKEN_FIELDS):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": "Expected {'text': str, 'fields': [...]}"})
+            return
+
+        metrics.count("requests")
+        try:
+            future = self.batcher.submit(text, fields)
+        except queue.Full:
+            metrics.count("rejected")
+            self.send_json(503, {"error": "Too many queued requests"})
+            return
+
+        try:
+            nouns = future.result(timeout=REQUEST_TIMEOUT)
+        except FutureTimeoutError:
+            self.send_json(504, {"error": "Timed out"})
+            return
+        except Exception as e:
+            self.send_json(500, {"error": str(e)})
+            return
+
+        self.send_json(200, {"nouns": nouns})
+
+    def log_message(self, format, *args):
+        # Don't log every request
+        pass
+
+
+def serve(
+    host: str = HOST,
+    port: int = PORT,
+    model: str = MODEL,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait: float = MAX_WAIT,
+    max_queue: int = MAX_QUEUE,
+) -> ThreadingHTTPServer:
+    """
+    Loads the model and returns the server, to be started with serve_forever
+    """
+    batcher = Batcher(load_model(model), max_batch_size, max_wait, max_queue)
+    handler = type(
+        "Handler", (ExtractionHandler,), {"batcher": batcher, "model": model}
+    )
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def extract_nouns_remote(
+    text: str,
+    url: str = f"http://{HOST}:{PORT}",
+    fields: Optional[Sequence[str]] = None,
+) -> List:
+    """
+    Client of the server: extracts the serialized nouns of a text
+    """
+    request = {"text": text}
+    if fields is not None:
+        request["fields"] = list(fields)
+
+    with urllib.request.urlopen(
+        urllib.request.Request(
+            f"{url}/extract",
+            data=json.dumps(request).encode(),
+            headers={"Content-Type": "application/json"},
+        ),
+        timeout=REQUEST_TIMEOUT,
+    ) as response:
+        return json.load(response)["nouns"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the noun extraction over HTTP, keeping the model loaded"
+    )
+    parser.add_argument("--host", type=str, default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--model", type=str, default=MODEL)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=MAX_WAIT * 1000,
+        help="How long a batch waits for more texts after its first one",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=MAX_QUEUE,
+        help="Texts that can wait for a batch before requests are rejected",
+    )
+    args = parser.parse_args()
+
+    server = serve(
+        args.host,
+        args.port,
+        args.model,
+        args.max_batch_size,
+        args.max_wait_ms / 1000,
+        args.max_queue,
+    )
+    print(f"Serving {args.model} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,215 @@
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from easylang_de.calculate_error_rate import MORPH_KASUS, MORPH_NUMERUS, NOUNS_DIR
+from easylang_de.corpus import CompactCorpus, is_compact, list_noun_files
+from easylang_de.dictionary import GenderDictionary, load
+from easylang_de.genus import (
+    DETERMINER_CODES,
+    DETERMINERS,
+    GENUS_TABLE,
+    KASUS_CODES,
+    KASUS_VALUES,
+    NUMERUS_CODES,
+    NUMERUS_VALUES,
+)
+
+# The columns of a span frame, one row per noun span
+SPAN_COLUMNS = [
+    "video_id",
+    "video_title",
+    "text",
+    "determiner",
+    "noun",
+    "case",
+    "number",
+]
+
+
+def _json_span_frame(nouns_dir: str) -> pd.DataFrame:
+    rows = []
+    for file in list_noun_files(nouns_dir):
+        with open(file) as f:
+            data = json.load(f)
+
+        for span in data["nouns"]:
+            noun = span[-1]
+            determiner = None
+            for det in span[:-1]:
+                if det["text"].lower() in DETERMINER_CODES:
+                    determiner = det["text"].lower()
+                    break
+
+            rows.append(
+                (
+                    data["video_id"],
+                    data["video_title"],
+                    " ".join([i["text"] for i in span]),
+                    determiner,
+                    noun.get("lemma", noun["text"]).lower(),
+                    noun["morph"].get("Case"),
+                    noun["morph"].get("Number"),
+                )
+            )
+
+    return pd.DataFrame.from_records(rows, columns=SPAN_COLUMNS)
+
+
+def _compact_span_frame(path: str) -> pd.DataFrame:
+    corpus = CompactCorpus(path)
+    lower = np.array([s.lower() for s in corpus.strings] + [None], dtype=object)
+    # Determiner code of every string in the string table, -1 for the others
+    det_codes = np.array(
+        [DETERMINER_CODES.get(s.lower(), -1) for s in corpus.strings] + [-1]
+    )
+
+    span_offsets = np.asarray(corpus.span_offsets)
+    starts = span_offsets[:-1]
+    nouns = span_offsets[1:] - 1
+    text = np.asarray(corpus.columns["text"])
+    lemma = np.asarray(corpus.columns["lemma"])
+
+    # The first token of every span, except the noun, that is a determiner.
+    # MISSING ids (-1) index the None/-1 entries at the end of the tables.
+    token_det = det_codes[text]
+    positions = np.where(token_det >= 0, np.arange(len(text)), len(text))
+    positions[nouns] = len(text)
+    first = np.minimum.reduceat(np.append(positions, len(text)), starts)
+    determiner = np.where(
+        first < len(text), token_det[np.minimum(first, len(text) - 1)], -1
+    )
+
+    document_offsets = np.asarray(corpus.document_offsets)
+    documents = np.repeat(np.arange(len(corpus)), np.diff(document_offsets))
+    video_ids = np.array([d["video_id"] for d in corpus.documents], dtype=object)
+    video_titles = np.array([d["video_title"] for d in corpus.documents], dtype=object)
+
+    words = corpus.values("text")
+    span_texts = [
+        " ".join(words[start:end]) for start, end in zip(starts, span_offsets[1:])
+    ]
+
+    return pd.DataFrame(
+        {
+            "video_id": video_ids[documents],
+            "video_title": video_titles[documents],
+            "text": span_texts,
+            "determiner": np.array(DETERMINERS + [None], dtype=object)[determiner],
+            "noun": lower[np.where(lemma[nouns] >= 0, lemma[nouns], text[nouns])],
+            "case": corpus.values("Case", nouns),
+            "number": corpus.values("Number", nouns),
+        }
+    )
+
+
+def load_span_frame(nouns_dir: str = NOUNS_DIR) -> pd.DataFrame:
+    """
+    Flattens the noun corpus, JSON or compact, into a frame of SPAN_COLUMNS.
+    determiner is the first word of the span that has a resolver.
+    """
+    if is_compact(nouns_dir):
+        return _compact_span_frame(nouns_dir)
+    return _json_span_frame(nouns_dir)
+
+
+def dictionary_frame(dictionary: GenderDictionary = None) -> pd.DataFrame:
+    """
+    Returns the noun dictionary as a frame of nouns and genus bitmasks
+    """
+    if dictionary is None:
+        dictionary = load()
+
+    return pd.DataFrame(
+        {
+            "noun": dictionary.nouns,
+            "genera": np.frombuffer(dictionary.masks, dtype=np.uint8),
+        }
+    )
+
+
+def resolver_frame() -> pd.DataFrame:
+    """
+    Returns GENUS_TABLE exploded to one row per determiner and spaCy case and
+    number, with the bitmask of the allowed genera
+    """
+    table = np.frombuffer(GENUS_TABLE, dtype=np.uint8).reshape(
+        len(DETERMINERS), len(KASUS_VALUES), len(NUMERUS_VALUES)
+    )
+    rows = []
+    for code, determiner in enumerate(DETERMINERS):
+        for case, kasus in MORPH_KASUS.items():
+            for number, numerus in MORPH_NUMERUS.items():
+                allowed = table[code, KASUS_CODES[kasus], NUMERUS_CODES[numerus]]
+                rows.append((determiner, case, number, allowed))
+
+    return pd.DataFrame.from_records(
+        rows, columns=["determiner", "case", "number", "allowed"]
+    )
+
+
+def evaluate_frame(spans: pd.DataFrame, dictionary: GenderDictionary = None):
+    """
+    Checks the genus of every span that has a determiner and a dictionary
+    entry. Returns the checked spans with an is_correct column, and the number
+    of spans that were skipped because spaCy didn't assign a case or number.
+    """
+    frame = spans.dropna(subset=["determiner"]).merge(
+        dictionary_frame(dictionary), on="noun", how="inner"
+    )
+
+    missing = frame["case"].isna() | frame["number"].isna()
+    frame = frame[~missing].merge(
+        resolver_frame(), on=["determiner", "case", "number"], how="left"
+    )
+    # Cases and numbers the resolvers don't know allow no genus
+    frame["allowed"] = frame["allowed"].fillna(0).astype(int)
+    frame["is_correct"] = (frame["allowed"] & frame["genera"]) != 0
+
+    return frame, int(missing.sum())
+
+
+def error_rates(frame: pd.DataFrame, by) -> pd.DataFrame:
+    """
+    Returns the number of spans, incorrect spans and the error rate per group
+    """
+    ret = (
+        frame.assign(incorrect=~frame["is_correct"])
+        .groupby(by)
+        .agg(total=("incorrect", "size"), incorrect=("incorrect", "sum"))
+    )
+    ret["error_rate"] = ret["incorrect"] / ret["total"]
+    return ret.sort_values("total", ascending=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calculate the genus error rate with pandas, with breakdowns"
+    )
+    parser.add_argument("--nouns-dir", type=str, default=NOUNS_DIR)
+    parser.add_argument(
+        "--top", type=int, default=20, help="Number of rows shown per breakdown"
+    )
+    parser.add_argument(
+        "--csv", type=str, help="Save the checked spans to this CSV file"
+    )
+    args = parser.parse_args()
+
+    frame, missing_cases = evaluate_frame(load_span_frame(args.nouns_dir))
+
+    correct = int(frame["is_correct"].sum())
+    error_rate = 1 - correct / len(frame)
+    print(f"Number of nouns: {len(frame)}")
+    print(f"Number of correct genus assignment: {correct}")
+    print(f"Number of definitely incorrect genus assignment: {len(frame) - correct}")
+    print(f"Error rate: {error_rate} ({error_rate*100}%))")
+    print(f"Missing cases: {missing_cases}")
+
+    for by in ["determiner", "case", ["case", "number"], "video_title"]:
+        print()
+        print(error_rates(frame, by).head(args.top).to_string())
+
+    if args.csv:
+        frame.to_csv(args.csv, index=False)
@@ -1,48 +1,161 @@
+import argparse
 import json
 import os
-from tqdm import tqdm
+import re
+from typing import Dict, Iterator, Tuple
+
+from easylang_de.cache import load_json, write_json_atomic
+from easylang_de.durations import CACHE_FILE, get_durations
+from easylang_de.instrument import metrics
 
 MP3_DIR = "data"
 TRANSCIPTION_DIR = "transcriptions"
 
-# Count the number of .mp3 files under MP3_DIR
-mp3_count = 0
-mp3_durations = []
-for root, dirs, files in os.walk(MP3_DIR):
-    for file in tqdm(files):
-        if file.endswith(".mp3"):
-            mp3_count += 1
-            # Get durations of .mp3 files under MP3_DIR
-            duration = os.popen(
-                f'ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 "{os.path.join(root, file)}"'
-            ).read()
-            duration = float(duration)
-            mp3_durations.append(duration)
-
-
-texts = []
-# Get texts from .json files under TRANSCIPTION_DIR
-for root, dirs, files in os.walk(TRANSCIPTION_DIR):
-    for file in files:
-        if file.endswith(".json"):
-            data = json.load(open(os.path.join(root, file)))
-            texts.append(data["text"])
-
-texts_merged = " ".join(texts)
-
-# Count the number of words in the texts
-word_count = len(texts_merged.split())
-
-# Count the number of characters in the texts
-char_count = len(texts_merged)
-# Count the number of sentences in the texts through punctuation marks
-sentence_count = (
-    texts_merged.count(".") + texts_merged.count("?") + texts_merged.count("!")
-)
-
-# Print the statistics
-print("Number of videos:     " + str(mp3_count))
-print("Total duration:       " + str(sum(mp3_durations) / 60 / 60) + " hours")
-print("Number of words:      " + str(word_count))
-print("Number of characters: " + str(char_count))
-print("Number of sentences:  " + str(sentence_count))
+# Statistics of each transcription, keyed by its size and modification time.
+# Not a .json file, so that it isn't taken for a transcription.
+STATS_CACHE_FILE = ".stats"
+
+# Series a video belongs to, matched against its title in this order
+SERIES = [
+    ("Shorts", re.compile(r"#shorts", re.IGNORECASE)),
+    ("Easy German Podcast", re.compile(r"Easy German Podcast", re.IGNORECASE)),
+    ("Easy German Live", re.compile(r"Easy German Live", re.IGNORECASE)),
+    ("Super Easy German", re.compile(r"Super Easy German|\bSEG\b", re.IGNORECASE)),
+    ("German Basic Phrases", re.compile(r"Basic Phrases", re.IGNORECASE)),
+    ("Cari antwortet", re.compile(r"Cari antwortet", re.IGNORECASE)),
+    ("Easy German", re.compile(r"Easy German \d+", re.IGNORECASE)),
+]
+
+COUNTS = ["videos", "duration", "words", "characters", "sentences"]
+
+
+def series(title: str) -> str:
+    """
+    Returns the series of a video from its title, e.g. "Easy German" for
+    "10 Austrian Words that Germans don't understand ｜ Easy German 222"
+    """
+    for name, pattern in SERIES:
+        if pattern.search(title):
+            return name
+    return "Other"
+
+
+def text_stats(text: str) -> Dict[str, int]:
+    return {
+        "words": len(text.split()),
+        "characters": len(text),
+        # Count the number of sentences in the texts through punctuation marks
+        "sentences": text.count(".") + text.count("?") + text.count("!"),
+    }
+
+
+def iter_files(directory: str, extension: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (name without extension, path) of the files under directory,
+    skipping hidden files like the caches
+    """
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.endswith(extension) and not file.startswith("."):
+                yield file[: -len(extension)], os.path.join(root, file)
+
+
+def transcription_stats(
+    transcription_dir: str = TRANSCIPTION_DIR,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Returns the text statistics of every transcription by video name. Only
+    the transcriptions that changed since the last run are read, one at a time.
+    """
+    cache_file = os.path.join(transcription_dir, STATS_CACHE_FILE)
+    cache = load_json(cache_file, {})
+
+    ret = {}
+    for name, path in iter_files(transcription_dir, ".json"):
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime]
+        entry = cache.get(name)
+        if entry is None or entry["key"] != key:
+            with open(path) as f:
+                entry = {"key": key, **text_stats(json.load(f)["text"])}
+            metrics.count("transcriptions.misses")
+            metrics.count("transcriptions.bytes", stat.st_size)
+        else:
+            metrics.count("transcriptions.hits")
+        ret[name] = entry
+
+    write_json_atomic(cache_file, ret)
+
+    return ret
+
+
+def corpus_stats(
+    mp3_dir: str = MP3_DIR, transcription_dir: str = TRANSCIPTION_DIR
+) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the counts of COUNTS per series, plus their sum under "Total"
+    """
+    mp3_files = dict(iter_files(mp3_dir, ".mp3"))
+    with metrics.stage("durations"):
+        durations = get_durations(
+            list(mp3_files.values()), os.path.join(mp3_dir, CACHE_FILE)
+        )
+    metrics.count("durations.files", len(durations))
+    with metrics.stage("transcriptions"):
+        texts = transcription_stats(transcription_dir)
+
+    ret = {"Total": dict.fromkeys(COUNTS, 0)}
+    for name in sorted(set(mp3_files) | set(texts)):
+        # The name is the title followed by the video id
+        title = " ".join(name.split(" ")[:-1])
+        counts = ret.setdefault(series(title), dict.fromkeys(COUNTS, 0))
+
+        file_counts = {}
+        if name in mp3_files:
+            file_counts["videos"] = 1
+            file_counts["duration"] = durations[mp3_files[name]] or 0
+            if durations[mp3_files[name]] is None:
+                print(f"Couldn't get the duration of {mp3_files[name]}")
+        if name in texts:
+            file_counts.update({c: texts[name][c] for c in COUNTS[2:]})
+
+        for c, value in file_counts.items():
+            counts[c] += value
+            ret["Total"][c] += value
+
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print statistics of the corpus")
+    parser.add_argument("--mp3-dir", type=str, default=MP3_DIR)
+    parser.add_argument("--transcription-dir", type=str, default=TRANSCIPTION_DIR)
+    parser.add_argument(
+        "--series", action="store_true", help="Also print the statistics per series"
+    )
+    parser.add_argument(
+        "--metrics", type=str, help="Save the timings and counters to this JSON file"
+    )
+    args = parser.parse_args()
+
+    stats = corpus_stats(args.mp3_dir, args.transcription_dir)
+    total = stats.pop("Total")
+
+    # Print the statistics
+    print("Number of videos:     " + str(total["videos"]))
+    print("Total duration:       " + str(total["duration"] / 60 / 60) + " hours")
+    print("Number of words:      " + str(total["words"]))
+    print("Number of characters: " + str(total["characters"]))
+    print("Number of sentences:  " + str(total["sentences"]))
+
+    if args.series:
+        print()
+        print(f"{'Series':<24}{'Videos':>8}{'Hours':>10}{'Words':>12}{'Sentences':>12}")
+        for name, counts in sorted(stats.items(), key=lambda i: -i[1]["videos"]):
+            print(
+                f"{name:<24}{counts['videos']:>8}{counts['duration'] / 3600:>10.1f}"
+                f"{counts['words']:>12}{counts['sentences']:>12}"
+            )
+
+    if args.metrics:
+        metrics.write(args.metrics)
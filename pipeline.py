@@ -0,0 +1,618 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import Callable, Iterable, List, Optional
+
+import openai
+
+from easylang_de import batch_extract_nouns
+from easylang_de.batch_extract_nouns import (
+    BATCH_SIZE,
+    MANIFEST_FLUSH_FILES,
+    SEGMENT_CHARS,
+    check_unrecorded,
+    cache_key,
+    iter_extract_nouns,
+    iter_extract_segment_nouns,
+    load_manifest,
+    save_manifest,
+    write_nouns,
+)
+from easylang_de.cache import load_json, write_json_atomic
+from easylang_de.extract_nouns import LEAN_TOKEN_FIELDS, MODEL
+from easylang_de.index import INDEX_FILE, add_document, connect, file_key
+from easylang_de.instrument import metrics
+from transcribe import (
+    CONCURRENCY,
+    DATA_DIR,
+    MAX_RETRIES,
+    OUTPUT_DIR,
+    output_file,
+    transcribe_file,
+)
+
+NOUNS_DIR = batch_extract_nouns.OUTPUT_DIR
+
+# Evaluation counts of every noun file, so that a run only evaluates the files
+# that changed and still reports the error rate of the whole corpus
+STATE_FILE = ".pipeline.json"
+
+# Files waiting between two stages. A stage blocks when the next one is this
+# far behind.
+QUEUE_SIZE = 16
+EVALUATE_WORKERS = 2
+
+# Marks the end of the files on a queue
+DONE = None
+
+
+def run_stage(
+    name: str,
+    work: Callable[[Optional[queue.Queue], Optional[queue.Queue]], None],
+    inbox: Optional[queue.Queue],
+    outbox: Optional[queue.Queue],
+    backlog: Iterable[str] = (),
+    failed: Optional[threading.Event] = None,
+) -> threading.Thread:
+    """
+    Starts a thread running work(inbox, outbox) until inbox is exhausted,
+    while the files of backlog, which are already done with this stage, are
+    passed on to outbox. DONE is put on outbox once both are through, even if
+    the stage failed, so that the next stages don't wait forever.
+    """
+
+    def forward():
+        for file in backlog:
+            outbox.put(file)
+
+    def run():
+        forwarder = threading.Thread(target=forward, daemon=True)
+        forwarder.start()
+        try:
+            work(inbox, outbox)
+        except BaseException:
+            if failed is not None:
+                failed.set()
+            raise
+        finally:
+            forwarder.join()
+            if outbox is not None:
+                outbox.put(DONE)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def iter_queue(inbox: queue.Queue) -> Iterable[str]:
+    return iter(inbox.get, DONE)
+
+
+def download(channel: Optional[str], data_dir: str = DATA_DIR):
+    """
+    Returns the work of the download stage: downloads the videos of the
+    channel that aren't in the download archive yet, passing on each mp3 file
+    as soon as it is complete
+    """
+
+    def work(inbox: Optional[queue.Queue], outbox: queue.Queue):
+        if channel is None:
+            return
+
+        process = subprocess.Popen(
+            [
+                "yt-dlp",
+                "-f",
+                "ba",
+                "-x",
+                "--audio-format",
+                "mp3",
+                "--download-archive",
+                ".archive",
+                "--print",
+                "after_move:filepath",
+                "--no-simulate",
+                channel,
+            ],
+            cwd=data_dir,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for line in process.stdout:
+            path = line.strip()
+            if path.endswith(".mp3"):
+                metrics.count("download.files")
+                outbox.put(os.path.basename(path))
+        process.wait()
+
+    return work
+
+
+def transcribe(
+    workers: int = CONCURRENCY,
+    data_dir: str = DATA_DIR,
+    transcription_dir: str = OUTPUT_DIR,
+    max_retries: int = MAX_RETRIES,
+    base_url: Optional[str] = None,
+):
+    """
+    Returns the work of the transcription stage: workers requests in flight,
+    each passing on the transcription file once it is written
+    """
+
+    def work(inbox: queue.Queue, outbox: queue.Queue):
+        asyncio.run(transcribe_queue(inbox, outbox))
+
+    async def transcribe_queue(inbox: queue.Queue, outbox: queue.Queue):
+        client = openai.AsyncOpenAI(base_url=base_url, max_retries=0)
+        semaphore = asyncio.Semaphore(workers)
+
+        async def worker():
+            while True:
+                file = await asyncio.to_thread(inbox.get)
+                if file is DONE:
+                    # Leave it for the other workers
+                    inbox.put(DONE)
+                    return
+
+                # The same file may come from the backlog and the download. Its
+                # transcription is only passed on when written by this run,
+                # backlogs already queued the older ones that aren't extracted.
+                if os.path.exists(output_file(file, transcription_dir)):
+                    continue
+
+                skipped = await transcribe_file(
+                    client,
+                    file,
+                    semaphore,
+                    data_dir,
+                    transcription_dir,
+                    max_retries,
+                )
+                if skipped is not None:
+                    print(f"Skipping {file} because {skipped}")
+                    continue
+
+                json_file = os.path.basename(output_file(file, transcription_dir))
+                await asyncio.to_thread(outbox.put, json_file)
+
+        await asyncio.gather(*[worker() for _ in range(workers)])
+
+    return work
+
+
+def extract_file(
+    file: str,
+    transcription_dir: str = OUTPUT_DIR,
+    model: str = MODEL,
+    segment_chars: Optional[int] = None,
+) -> tuple:
+    """
+    Extracts the nouns of one transcription in a worker process of the
+    extraction stage. Returns the nouns and, with segment_chars, their
+    segments.
+    """
+    if segment_chars is not None:
+        ((_, nouns, noun_segments),) = iter_extract_segment_nouns(
+            [file], transcription_dir, model=model, segment_chars=segment_chars
+        )
+        return nouns, noun_segments
+
+    ((_, nouns),) = iter_extract_nouns([file], transcription_dir, model=model)
+    return nouns, None
+
+
+def extract(
+    workers: int = 1,
+    transcription_dir: str = OUTPUT_DIR,
+    nouns_dir: str = NOUNS_DIR,
+    batch_size: int = BATCH_SIZE,
+    model: str = MODEL,
+    index_file: Optional[str] = INDEX_FILE,
+    segment_chars: Optional[int] = None,
+):
+    """
+    Returns the work of the extraction stage: runs the transcriptions through
+    nlp_spacy.pipe as they arrive, and passes on each noun file once it is
+    written, indexed and recorded in the manifest. With more than one worker,
+    the files are extracted in that many worker processes instead. With
+    segment_chars, chunks of transcription segments are run instead, as
+    batch_extract_nouns --segments does.
+    """
+
+    def results_in_thread(inbox: queue.Queue):
+        if segment_chars is not None:
+            yield from iter_extract_segment_nouns(
+                iter_queue(inbox),
+                data_dir=transcription_dir,
+                batch_size=batch_size,
+                model=model,
+                segment_chars=segment_chars,
+            )
+            return
+
+        for file, nouns in iter_extract_nouns(
+            iter_queue(inbox),
+            data_dir=transcription_dir,
+            batch_size=batch_size,
+            model=model,
+        ):
+            yield file, nouns, None
+
+    def results_in_processes(inbox: queue.Queue):
+        # nlp_spacy.pipe's own processes are forked, which would inherit the
+        # threads of the other stages in whatever state they are in, so
+        # spawned workers are used like in the evaluation stage
+        context = multiprocessing.get_context("spawn")
+        pending = {}
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            for file in iter_queue(inbox):
+                future = executor.submit(
+                    extract_file, file, transcription_dir, model, segment_chars
+                )
+                pending[future] = file
+                # Keep at most two files per worker in flight
+                done, _ = wait(
+                    pending,
+                    timeout=None if len(pending) >= 2 * workers else 0,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    yield (pending.pop(future), *future.result())
+            for future in as_completed(pending):
+                yield (pending[future], *future.result())
+
+    def work(inbox: queue.Queue, outbox: queue.Queue):
+        index = None if index_file is None else connect(index_file)
+        manifest = load_manifest(nouns_dir)
+        if workers > 1:
+            results = results_in_processes(inbox)
+        else:
+            results = results_in_thread(inbox)
+
+        try:
+            for i, (file, nouns, noun_segments) in enumerate(results, 1):
+                output = write_nouns(file, nouns, nouns_dir, noun_segments)
+                if index is not None:
+                    key = file_key(os.path.join(nouns_dir, file))
+                    add_document(index, file, output, key)
+
+                manifest[file] = cache_key(
+                    file, transcription_dir, LEAN_TOKEN_FIELDS, model, segment_chars
+                )
+                if i % MANIFEST_FLUSH_FILES == 0:
+                    save_manifest(manifest, nouns_dir)
+                outbox.put(file)
+        finally:
+            save_manifest(manifest, nouns_dir)
+
+    return work
+
+
+def evaluate_counts(path: str) -> dict:
+    """
+    Evaluates one noun file and returns its entry in the state, without the
+    spans, which would only be sent back from the worker to be counted
+    """
+    # Loads the dictionary, so only imported when needed
+    from easylang_de.calculate_error_rate import evaluate_file
+
+    result = evaluate_file(path)
+    incorrect = len(result.incorrect)
+    return {
+        "key": file_key(path),
+        "correct": len(result.spans) - incorrect,
+        "incorrect": incorrect,
+        "missing_cases": result.missing_cases,
+    }
+
+
+def evaluate(
+    state: dict,
+    workers: int = EVALUATE_WORKERS,
+    nouns_dir: str = NOUNS_DIR,
+    state_file: str = STATE_FILE,
+):
+    """
+    Returns the work of the evaluation stage: evaluates the noun files over
+    workers processes and records their counts in the state
+    """
+
+    def record(file: str, future: Future):
+        state[file] = future.result()
+        write_json_atomic(state_file, state)
+        metrics.count("evaluate.files")
+
+    def work(inbox: queue.Queue, outbox: Optional[queue.Queue]):
+        # The other stages run in threads of this process, which a forked
+        # worker would inherit in whatever state they are in
+        context = multiprocessing.get_context("spawn")
+        pending = {}
+        with ProcessPoolExecutor(workers, mp_context=context) as executor:
+            for file in iter_queue(inbox):
+                future = executor.submit(evaluate_counts, os.path.join(nouns_dir, file))
+                pending[future] = file
+                # Keep at most two files per worker in flight, the others
+                # wait on the queue
+                done, _ = wait(
+                    pending,
+                    timeout=None if len(pending) >= 2 * workers else 0,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    record(pending.pop(future), future)
+            for future in as_completed(pending):
+                record(pending[future], future)
+
+    return work
+
+
+def backlogs(
+    data_dir: str,
+    transcription_dir: str,
+    nouns_dir: str,
+    state: dict,
+    model: str = MODEL,
+    segment_chars: Optional[int] = None,
+    adopt_existing: bool = False,
+) -> List[List[str]]:
+    """
+    Returns the files that are waiting for transcription, extraction and
+    evaluation from a previous run, judged by the outputs of the stages. With
+    adopt_existing, noun files without a manifest entry are taken as
+    extracted, see batch_extract_nouns.pending_files.
+    """
+    mp3_files = sorted(
+        f for f in os.listdir(data_dir) if f.endswith(".mp3") and not f.startswith(".")
+    )
+    untranscribed = [
+        f for f in mp3_files if not os.path.exists(output_file(f, transcription_dir))
+    ]
+    unextracted, _, _ = batch_extract_nouns.pending_files(
+        transcription_dir,
+        nouns_dir,
+        LEAN_TOKEN_FIELDS,
+        adopt_existing,
+        model=model,
+        segment_chars=segment_chars,
+    )
+    unextracted_set = set(unextracted)
+    unevaluated = [
+        f
+        for f in sorted(os.listdir(nouns_dir))
+        if f.endswith(".json")
+        and not f.startswith(".")
+        and f not in unextracted_set
+        and state.get(f, {}).get("key") != file_key(os.path.join(nouns_dir, f))
+    ]
+
+    return [untranscribed, unextracted, unevaluated]
+
+
+def run_pipeline(
+    channel: Optional[str] = None,
+    data_dir: str = DATA_DIR,
+    transcription_dir: str = OUTPUT_DIR,
+    nouns_dir: str = NOUNS_DIR,
+    transcribe_workers: int = CONCURRENCY,
+    extract_workers: int = 1,
+    evaluate_workers: int = EVALUATE_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    batch_size: int = BATCH_SIZE,
+    model: str = MODEL,
+    base_url: Optional[str] = None,
+    index_file: Optional[str] = INDEX_FILE,
+    state_file: str = STATE_FILE,
+    segment_chars: Optional[int] = None,
+    adopt_existing: bool = False,
+) -> dict:
+    """
+    Runs download, transcription, extraction and evaluation at the same time,
+    connected by queues of at most queue_size files, so that every video moves
+    on to the next stage as soon as it is done with the previous one. Files
+    left over by a previous run start at the stage they got to, noun files
+    without a manifest entry only with adopt_existing. Returns the evaluation
+    counts of every noun file.
+    """
+    for directory in [data_dir, transcription_dir, nouns_dir]:
+        os.makedirs(directory, exist_ok=True)
+
+    state = load_json(state_file, {})
+    untranscribed, unextracted, unevaluated = backlogs(
+        data_dir,
+        transcription_dir,
+        nouns_dir,
+        state,
+        model,
+        segment_chars,
+        adopt_existing,
+    )
+    print(
+        f"Resuming {len(untranscribed)} files to transcribe, "
+        f"{len(unextracted)} to extract and {len(unevaluated)} to evaluate"
+    )
+
+    to_transcribe, to_extract, to_evaluate = [queue.Queue(queue_size) for _ in range(3)]
+    failed = threading.Event()
+    threads = [
+        run_stage(
+            "download",
+            download(channel, data_dir),
+            None,
+            to_transcribe,
+            untranscribed,
+            failed,
+        ),
+        run_stage(
+            "transcribe",
+            transcribe(
+                transcribe_workers, data_dir, transcription_dir, base_url=base_url
+            ),
+            to_transcribe,
+            to_extract,
+            unextracted,
+            failed,
+        ),
+        run_stage(
+            "extract",
+            extract(
+                extract_workers,
+                transcription_dir,
+                nouns_dir,
+                batch_size,
+                model,
+                index_file,
+                segment_chars,
+            ),
+            to_extract,
+            to_evaluate,
+            unevaluated,
+            failed,
+        ),
+        run_stage(
+            "evaluate",
+            evaluate(state, evaluate_workers, nouns_dir, state_file),
+            to_evaluate,
+            None,
+            failed=failed,
+        ),
+    ]
+
+    # A stage that failed can leave the stage before it blocked on a full
+    # queue, so stop waiting for the others
+    for thread in threads:
+        while thread.is_alive() and not failed.is_set():
+            thread.join(1)
+    if failed.is_set():
+        raise RuntimeError("A stage of the pipeline failed")
+
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download, transcribe, extract and evaluate the videos, "
+        "with all stages running at the same time"
+    )
+    parser.add_argument(
+        "--channel",
+        type=str,
+        help="Download the new videos of this channel, "
+        "e.g. https://www.youtube.com/@EasyGerman",
+    )
+    parser.add_argument("--data-dir", type=str, default=DATA_DIR)
+    parser.add_argument("--transcription-dir", type=str, default=OUTPUT_DIR)
+    parser.add_argument("--nouns-dir", type=str, default=NOUNS_DIR)
+    parser.add_argument(
+        "--transcribe-workers",
+        type=int,
+        default=CONCURRENCY,
+        help="Transcription requests in flight",
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=1,
+        help="Processes running the Spacy pipeline, each with its own copy "
+        "of the model",
+    )
+    parser.add_argument(
+        "--evaluate-workers",
+        type=int,
+        default=EVALUATE_WORKERS,
+        help="Processes evaluating the noun files",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=QUEUE_SIZE,
+        help="Files that can wait between two stages",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--model", type=str, default=MODEL)
+    parser.add_argument("--base-url", type=str, default=None)
+    parser.add_argument("--index", type=str, default=INDEX_FILE)
+    parser.add_argument("--no-index", action="store_true")
+    parser.add_argument("--state-file", type=str, default=STATE_FILE)
+    parser.add_argument(
+        "--segments",
+        action="store_true",
+        help="Process chunks of transcription segments and save their timestamps",
+    )
+    parser.add_argument(
+        "--segment-chars",
+        type=int,
+        default=SEGMENT_CHARS,
+        help="Maximum number of characters per chunk of segments",
+    )
+    parser.add_argument(
+        "--adopt-existing",
+        action="store_true",
+        help="Record existing noun files that aren't in the manifest as up to date",
+    )
+    parser.add_argument(
+        "--rebuild-existing",
+        action="store_true",
+        help="Extract existing noun files that aren't in the manifest again",
+    )
+    parser.add_argument(
+        "--metrics", type=str, help="Save the timings and counters to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # Noun files from before the manifest existed would be extracted again
+    if (
+        not args.adopt_existing
+        and not args.rebuild_existing
+        and os.path.isdir(args.nouns_dir)
+    ):
+        check_unrecorded(args.nouns_dir)
+
+    start = time.perf_counter()
+    state = run_pipeline(
+        args.channel,
+        args.data_dir,
+        args.transcription_dir,
+        args.nouns_dir,
+        args.transcribe_workers,
+        args.extract_workers,
+        args.evaluate_workers,
+        args.queue_size,
+        args.batch_size,
+        args.model,
+        args.base_url,
+        None if args.no_index else args.index,
+        args.state_file,
+        args.segment_chars if args.segments else None,
+        args.adopt_existing,
+    )
+
+    # Counts of the noun files that still exist
+    counts = [
+        entry
+        for file, entry in state.items()
+        if os.path.exists(os.path.join(args.nouns_dir, file))
+    ]
+    correct = sum(entry["correct"] for entry in counts)
+    incorrect = sum(entry["incorrect"] for entry in counts)
+    print(f"Finished in {time.perf_counter() - start:.1f} s")
+    print(f"Number of nouns: {correct + incorrect}")
+    print(f"Number of definitely incorrect genus assignment: {incorrect}")
+    if correct + incorrect:
+        print(f"Error rate: {incorrect / (correct + incorrect)}")
+    print(f"Missing cases: {sum(entry['missing_cases'] for entry in counts)}")
+
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from benchmarks import fixtures
+
+# Nouns that a plurale tantum is one edit away from, see test_calculate_error_rate
+NEAR_PLURALIA_TANTUM = [("laute", "f"), ("altern", "n")]
+
+
+@pytest.fixture(scope="session", autouse=True)
+def workdir(tmp_path_factory):
+    """
+    Runs the tests in a directory with a synthetic nomen_genus.csv, as the
+    dictionary is read from the working directory by the modules that load it
+    on first use
+    """
+    path = tmp_path_factory.mktemp("workdir")
+    cwd = os.getcwd()
+    os.chdir(path)
+    fixtures.write_dictionary("nomen_genus.csv", 2000)
+    with open("nomen_genus.csv", "a") as f:
+        for noun, genus in NEAR_PLURALIA_TANTUM:
+            f.write(f"{noun},{genus}\n")
+    yield path
+    os.chdir(cwd)
@@ -0,0 +1,43 @@
+import pytest
+
+from easylang_de.audio import CHUNK_FILL, plan_chunks
+
+
+def assert_covers(chunks, duration):
+    assert chunks[0][0] == 0.0
+    assert chunks[-1][1] == duration
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start
+
+
+def test_small_file():
+    assert plan_chunks(600.0, 10, 100, []) == [(0.0, 600.0)]
+
+
+def test_without_silences():
+    # 1000 s at 1000 bytes, so 90 s fit in a chunk of at most 100 bytes
+    chunks = plan_chunks(1000.0, 1000, 100, [])
+    assert_covers(chunks, 1000.0)
+    max_length = 1000.0 * 100 * CHUNK_FILL / 1000
+    assert all(end - start == pytest.approx(max_length) for start, end in chunks[:-1])
+    assert chunks[-1][1] - chunks[-1][0] <= max_length
+
+
+def test_cut_in_silences():
+    silences = [(10.0, 12.0), (40.0, 44.0), (80.0, 81.0), (95.0, 96.0)]
+    chunks = plan_chunks(150.0, 150, 50, silences)
+    # 45 s fit in a chunk: cut in the middle of the latest silence before that
+    assert chunks == [
+        (0.0, 42.0),
+        (42.0, 80.5),
+        (80.5, 95.5),
+        (95.5, 140.5),
+        (140.5, 150.0),
+    ]
+    assert_covers(chunks, 150.0)
+
+
+def test_silence_after_limit():
+    chunks = plan_chunks(100.0, 100, 50, [(60.0, 62.0)])
+    assert chunks[0] == (0.0, 45.0)
+    assert_covers(chunks, 100.0)
@@ -0,0 +1,55 @@
+import pytest
+
+from benchmarks.fixtures import token
+
+
+def noun_span(determiner: str, noun: str, number: str = "Sing", case: str = "Nom"):
+    morph = {"Case": case, "Number": number}
+    return [
+        token(determiner, "DET", {"PronType": "Art"}),
+        token(noun, "NOUN", morph),
+    ]
+
+
+def test_evaluate_span():
+    # Loads the dictionary from the working directory
+    from easylang_de.calculate_error_rate import evaluate_span
+
+    assert evaluate_span(noun_span("der", "Hund")).is_correct
+    assert not evaluate_span(noun_span("das", "Hund")).is_correct
+    assert not evaluate_span(noun_span("der", "Katze")).is_correct
+    assert evaluate_span(noun_span("den", "Hund", case="Acc")).is_correct
+    # No determiner, or not in the dictionary
+    assert evaluate_span([token("Hund", "NOUN", {"Case": "Nom"})]) is None
+    assert evaluate_span(noun_span("der", "Schreibhund")) is None
+    assert evaluate_span(noun_span("der", "Schreibhund"), compounds=True).is_correct
+
+
+def test_missing_case():
+    from easylang_de.calculate_error_rate import MissingCase, evaluate_document
+
+    span = noun_span("der", "Hund")
+    del span[-1]["morph"]["Case"]
+    result = evaluate_document({"nouns": [span, noun_span("der", "Hund")]})
+    assert result.missing_cases == 1
+    assert len(result.spans) == 1
+
+    from easylang_de.calculate_error_rate import evaluate_span
+
+    with pytest.raises(MissingCase):
+        evaluate_span(span)
+
+
+@pytest.mark.parametrize("noun, near", [("Leute", "laute"), ("Eltern", "altern")])
+def test_pluralia_tantum_stay_unmatched(noun, near):
+    from easylang_de.calculate_error_rate import evaluate_span
+    from easylang_de.fuzzy import DEFAULT_MIN_CONFIDENCE
+
+    # In the singular, the noun would be taken for its neighbour
+    singular = evaluate_span(noun_span("die", noun), fuzzy=DEFAULT_MIN_CONFIDENCE)
+    assert singular.match.noun == near
+
+    plural = noun_span("die", noun, number="Plur")
+    assert evaluate_span(plural) is None
+    assert evaluate_span(plural, fuzzy=DEFAULT_MIN_CONFIDENCE) is None
+    assert evaluate_span(plural, compounds=True, fuzzy=0.0) is None
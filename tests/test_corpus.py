@@ -0,0 +1,75 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+from benchmarks import fixtures
+from easylang_de.corpus import (
+    CompactCorpus,
+    convert,
+    is_compact,
+    iter_documents,
+    list_noun_files,
+    morph_to_str,
+    str_to_morph,
+)
+
+
+@pytest.fixture(scope="module")
+def corpus_dirs(tmp_path_factory):
+    path = tmp_path_factory.mktemp("corpus")
+    nouns_dir = path / "nouns"
+    fixtures.write_noun_corpus(nouns_dir, 12, 40)
+    # A file with segments, which are kept with the document fields
+    with open(nouns_dir / "segments.json", "w") as f:
+        document = fixtures.noun_document(99, 3, random.Random(1))
+        document["noun_segments"] = [{"start": i * 1.5} for i in range(3)]
+        json.dump(document, f)
+    convert(nouns_dir, path / "compact")
+    return nouns_dir, path / "compact"
+
+
+def test_morph_strings():
+    morph = {"Case": "Nom", "Gender": "Masc", "Number": "Sing"}
+    assert str_to_morph(morph_to_str(morph)) == morph
+    assert str_to_morph("") == {}
+
+
+def test_round_trip(corpus_dirs):
+    nouns_dir, compact_dir = corpus_dirs
+    assert is_compact(compact_dir) and not is_compact(nouns_dir)
+
+    corpus = CompactCorpus(compact_dir)
+    files = list_noun_files(nouns_dir)
+    assert len(corpus) == len(files) == 13
+    for i, file in enumerate(files):
+        with open(file) as f:
+            assert corpus.document(i) == json.load(f)
+
+    assert list(iter_documents(compact_dir)) == list(iter_documents(nouns_dir))
+
+
+def test_document_dicts_are_separate(corpus_dirs):
+    corpus = CompactCorpus(corpus_dirs[1])
+    first, second = corpus.document(0), corpus.document(0)
+    first["nouns"][0][-1]["morph"]["Case"] = "Changed"
+    assert second["nouns"][0][-1]["morph"]["Case"] != "Changed"
+
+
+def test_columns(corpus_dirs):
+    corpus = CompactCorpus(corpus_dirs[1], mmap=False)
+    for document in range(len(corpus)):
+        bounds = corpus.span_bounds(document)
+        spans = corpus.spans(document)
+        assert len(bounds) == len(spans) + 1
+        texts = corpus.values("text", slice(bounds[0], bounds[-1])).tolist()
+        assert texts == [token["text"] for span in spans for token in span]
+
+    nouns = np.asarray(corpus.span_offsets[1:]) - 1
+    cases = corpus.values("Case", nouns).tolist()
+    morphs = corpus.values("morph", nouns).tolist()
+    assert cases == [morph.get("Case") for morph in morphs]
+    assert None in cases
+    assert corpus.string_id("Nom") >= 0
+    assert corpus.string_id("not in the corpus") == -1
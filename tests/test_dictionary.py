@@ -0,0 +1,63 @@
+import random
+
+from benchmarks import fixtures
+from easylang_de.dictionary import GenderDictionary, build, read_csv
+from easylang_de.genus import Genus
+
+
+def reference_head(genera: dict, noun: str, min_length: int = 3):
+    """
+    The longest dictionary noun that noun ends with, by trying every suffix
+    """
+    encoded = noun.encode("utf-8")
+    for start in range(len(encoded) - min_length + 1):
+        suffix = encoded[start:].decode("utf-8", errors="ignore")
+        if suffix.encode("utf-8") == encoded[start:] and suffix in genera:
+            return suffix
+    return None
+
+
+def test_round_trip(tmp_path):
+    csv_file = tmp_path / "nomen_genus.csv"
+    binary_file = tmp_path / "nomen_genus.bin"
+    fixtures.write_dictionary(csv_file, 3000)
+    build(csv_file, binary_file)
+
+    genera = read_csv(csv_file)
+    dictionary = GenderDictionary(binary_file)
+    assert len(dictionary) == len(genera)
+    assert sorted(dictionary.nouns) == sorted(genera)
+    for noun, noun_genera in genera.items():
+        assert noun in dictionary
+        assert dictionary.get(noun) == noun_genera
+    assert dictionary.get("see") == [Genus.M, Genus.F]
+    assert dictionary.get("hundx") is None
+    assert "" not in dictionary
+
+
+def test_longest_head(tmp_path):
+    csv_file = tmp_path / "nomen_genus.csv"
+    binary_file = tmp_path / "nomen_genus.bin"
+    fixtures.write_dictionary(csv_file, 3000)
+    with open(csv_file, "a") as f:
+        f.write("tür,f\nhaustür,f\nküche,f\n")
+    build(csv_file, binary_file)
+    genera = read_csv(csv_file)
+    dictionary = GenderDictionary(binary_file)
+
+    assert dictionary.get_compound("haus") == ("haus", [Genus.N])
+    assert dictionary.get_compound("autohaustür") == ("haustür", [Genus.F])
+    assert dictionary.get_compound("wohnküche") == ("küche", [Genus.F])
+    assert dictionary.get_compound("ür") is None
+    assert dictionary.get_compound("xyz") is None
+
+    rng = random.Random(0)
+    nouns = sorted(genera)
+    for _ in range(2000):
+        noun = rng.choice(nouns)
+        word = rng.choice(fixtures.PREFIXES) + noun[rng.randrange(len(noun)) :]
+        head = reference_head(genera, word)
+        compound = dictionary.get_compound(word)
+        assert (compound and compound[0]) == head, word
+        if head is not None:
+            assert compound[1] == genera[head]
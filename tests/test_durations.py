@@ -0,0 +1,73 @@
+import struct
+
+import pytest
+
+from easylang_de.durations import FrameHeader, id3v2_size, mp3_duration
+
+# MPEG 1 layer III, 128 kbit/s, 44100 Hz, stereo, no padding
+HEADER = 0xFFFB9000
+FRAME_LENGTH = 417
+SAMPLES = 1152
+
+
+def frame(payload: bytes = b"", at: int = 0) -> bytes:
+    data = bytearray(FRAME_LENGTH)
+    struct.pack_into(">I", data, 0, HEADER)
+    data[at : at + len(payload)] = payload
+    return bytes(data)
+
+
+def id3v2_tag(size: int) -> bytes:
+    # The size is stored in 4 bytes of 7 bits each
+    encoded = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + encoded + bytes(size)
+
+
+def test_frame_header():
+    header = FrameHeader(HEADER)
+    assert (header.mpeg1, header.layer) == (True, 3)
+    assert (header.bitrate, header.sample_rate) == (128000, 44100)
+    assert (header.length, header.samples) == (FRAME_LENGTH, SAMPLES)
+    assert header.side_info_size == 32
+    with pytest.raises(ValueError):
+        FrameHeader(0x12345678)
+
+
+def test_id3v2_size():
+    assert id3v2_size(id3v2_tag(300)) == 310
+    assert id3v2_size(b"\xff\xfb\x90\x00" + bytes(6)) == 0
+
+
+def test_cbr(tmp_path):
+    path = tmp_path / "cbr.mp3"
+    path.write_bytes(id3v2_tag(1000) + frame() * 100 + b"TAG" + bytes(125))
+    assert mp3_duration(path) == pytest.approx(100 * FRAME_LENGTH * 8 / 128000)
+
+
+def test_xing(tmp_path):
+    # The Xing header follows the side information of the first frame
+    xing = b"Xing" + struct.pack(">II", 0x1, 5000)
+    path = tmp_path / "xing.mp3"
+    path.write_bytes(frame(xing, 4 + 32) + frame() * 10)
+    assert mp3_duration(path) == pytest.approx(5000 * SAMPLES / 44100)
+
+
+def test_info_without_frames_is_cbr(tmp_path):
+    # Without the frames flag the file is taken as constant bitrate
+    info = b"Info" + struct.pack(">I", 0x0)
+    path = tmp_path / "info.mp3"
+    path.write_bytes(frame(info, 4 + 32) + frame() * 9)
+    assert mp3_duration(path) == pytest.approx(10 * FRAME_LENGTH * 8 / 128000)
+
+
+def test_vbri(tmp_path):
+    vbri = b"VBRI" + bytes(10) + struct.pack(">I", 7000)
+    path = tmp_path / "vbri.mp3"
+    path.write_bytes(frame(vbri, 4 + 32) + frame() * 10)
+    assert mp3_duration(path) == pytest.approx(7000 * SAMPLES / 44100)
+
+
+def test_not_mp3(tmp_path):
+    path = tmp_path / "text.mp3"
+    path.write_bytes(b"not an mp3 file" * 100)
+    assert mp3_duration(path) is None
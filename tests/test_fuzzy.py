@@ -0,0 +1,93 @@
+import pytest
+
+from easylang_de.dictionary import GenderDictionary
+from easylang_de.dictionary import build as build_dictionary
+from easylang_de.fuzzy import FuzzyDictionary, build, edit_distance, max_distance_for
+from easylang_de.genus import Genus
+
+NOUNS = [
+    ("hund", "m"),
+    ("bahnhof", "m"),
+    ("stellung", "f"),
+    ("kinderzimmer", "n"),
+    ("bank", "f"),
+    ("band", "n"),
+    ("band", "m"),
+]
+
+
+@pytest.fixture(scope="module")
+def fuzzy(tmp_path_factory):
+    path = tmp_path_factory.mktemp("fuzzy")
+    with open(path / "nomen_genus.csv", "w") as f:
+        f.write("noun,genus\n")
+        for noun, genus in NOUNS:
+            f.write(f"{noun},{genus}\n")
+    build_dictionary(path / "nomen_genus.csv", path / "nomen_genus.bin")
+    dictionary = GenderDictionary(path / "nomen_genus.bin")
+    build(dictionary, path / "nomen_genus.fuzzy2.npy")
+    return FuzzyDictionary(dictionary, path / "nomen_genus.fuzzy2.npy")
+
+
+@pytest.mark.parametrize(
+    "a, b, distance",
+    [
+        ("bahnhof", "bahnhof", 0),
+        ("bahnhof", "banhof", 1),
+        ("bahnhof", "bahnhfo", 1),
+        ("bahnhof", "bahnhoff", 1),
+        ("stellung", "stelung", 1),
+        ("kinderzimmer", "kindrzimer", 2),
+        ("", "ab", 2),
+    ],
+)
+def test_edit_distance(a, b, distance):
+    assert edit_distance(a, b) == distance
+    assert edit_distance(b, a) == distance
+
+
+def test_edit_distance_stops_above_max_distance():
+    assert edit_distance("bahnhof", "stellung", 2) == 3
+
+
+def test_max_distance_for():
+    assert max_distance_for("hund") == 0
+    assert max_distance_for("hunde") == 1
+    assert max_distance_for("bahnhof") == 1
+    assert max_distance_for("kinderzimmer") == 2
+
+
+def test_exact(fuzzy):
+    (match,) = fuzzy.lookup("Bahnhof")
+    assert (match.noun, match.genera, match.distance) == ("bahnhof", [Genus.M], 0)
+    assert match.confidence == 1.0
+
+
+def test_distances(fuzzy):
+    (match,) = fuzzy.lookup("banhof")
+    assert (match.noun, match.distance) == ("bahnhof", 1)
+    assert match.confidence == pytest.approx(1 - 1 / 6)
+
+    (match,) = fuzzy.lookup("kindrzimer")
+    assert (match.noun, match.distance) == ("kinderzimmer", 2)
+    assert fuzzy.lookup("kindrzimer", max_distance=1) == []
+
+    # Within two edits, but too short to be looked up beyond one
+    assert fuzzy.lookup("stelng") == []
+    # Short words aren't looked up at all
+    assert fuzzy.lookup("hnud") == []
+
+
+def test_closest_only(fuzzy):
+    # bank is one edit away, band two
+    matches = fuzzy.lookup("bannk")
+    assert [(match.noun, match.distance) for match in matches] == [("bank", 1)]
+
+
+def test_ambiguous(fuzzy):
+    # bank and band are both one edit away, with different genera
+    matches = fuzzy.lookup("bankd")
+    assert [match.noun for match in matches] == ["band", "bank"]
+    assert matches[0].confidence == pytest.approx((1 - 1 / 5) / 2)
+    assert fuzzy.get("bankd") is None
+    assert fuzzy.get("bankd", min_confidence=0.4).noun == "bank"
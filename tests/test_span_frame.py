@@ -0,0 +1,48 @@
+import pytest
+
+from benchmarks import fixtures
+from easylang_de.corpus import convert
+
+
+@pytest.fixture(scope="module", params=["json", "compact"])
+def nouns_dir(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp("nouns")
+    fixtures.write_noun_corpus(path / "nouns", 20, 200)
+    if request.param == "json":
+        return str(path / "nouns")
+    convert(path / "nouns", path / "compact")
+    return str(path / "compact")
+
+
+def test_same_as_calculate_error_rate(nouns_dir):
+    # Both load the dictionary from the working directory
+    from easylang_de.calculate_error_rate import evaluate, iter_evaluate
+    from easylang_de.span_frame import evaluate_frame, load_span_frame
+
+    frame, missing_cases = evaluate_frame(load_span_frame(nouns_dir))
+    result = evaluate(nouns_dir)
+
+    assert len(frame) == result.total
+    assert int(frame["is_correct"].sum()) == result.correct
+    assert missing_cases == result.missing_cases > 0
+    assert 0 < result.correct < result.total
+
+    spans = [span for file in iter_evaluate(nouns_dir) for span in file.spans]
+    assert sorted(zip(frame["text"], frame["is_correct"])) == sorted(
+        (span.text, span.is_correct) for span in spans
+    )
+
+
+def test_compact_same_as_json(tmp_path):
+    from easylang_de.calculate_error_rate import iter_evaluate
+
+    fixtures.write_noun_corpus(tmp_path / "nouns", 10, 100, seed=1)
+    convert(tmp_path / "nouns", tmp_path / "compact")
+
+    json_results = list(iter_evaluate(str(tmp_path / "nouns"), compounds=True))
+    compact_results = list(iter_evaluate(str(tmp_path / "compact"), compounds=True))
+    assert [r.info for r in json_results] == [r.info for r in compact_results]
+    assert [r.missing_cases for r in json_results] == [
+        r.missing_cases for r in compact_results
+    ]
+    assert [r.spans for r in json_results] == [r.spans for r in compact_results]
@@ -0,0 +1,60 @@
+from transcribe import stitch
+
+
+def chunk(text, duration, segments, words=None):
+    ret = {"text": text, "language": "german", "duration": duration}
+    ret["segments"] = [
+        {"id": i, "seek": 0, "start": start, "end": end, "text": segment}
+        for i, (start, end, segment) in enumerate(segments)
+    ]
+    if words is not None:
+        ret["words"] = [
+            {"word": word, "start": start, "end": end} for word, start, end in words
+        ]
+    return ret
+
+
+def test_stitch():
+    first = chunk(
+        " Hallo zusammen. Wie geht's? ",
+        30.0,
+        [(0.0, 2.0, "Hallo zusammen."), (2.5, 4.0, "Wie geht's?")],
+        [("Hallo", 0.0, 0.5), ("zusammen", 0.6, 2.0)],
+    )
+    second = chunk(
+        "Gut, danke.", 20.0, [(1.0, 3.0, "Gut, danke.")], [("Gut", 1.0, 1.5)]
+    )
+    ret = stitch([(first, 0.0), (second, 30.0)])
+
+    assert ret["text"] == "Hallo zusammen. Wie geht's? Gut, danke."
+    assert ret["duration"] == 50.0
+    assert ret["language"] == "german"
+    assert [s["id"] for s in ret["segments"]] == [0, 1, 2]
+    assert [(s["start"], s["end"]) for s in ret["segments"]] == [
+        (0.0, 2.0),
+        (2.5, 4.0),
+        (31.0, 33.0),
+    ]
+    assert [s["seek"] for s in ret["segments"]] == [0, 0, 3000]
+    assert [(w["word"], w["start"]) for w in ret["words"]] == [
+        ("Hallo", 0.0),
+        ("zusammen", 0.6),
+        ("Gut", 31.0),
+    ]
+    # The chunks themselves are left as they are
+    assert second["segments"][0]["start"] == 1.0
+
+
+def test_stitch_chunk_without_speech():
+    first = chunk("Tschüss!", 10.0, [(0.0, 1.0, "Tschüss!")])
+    silent = {"text": "", "duration": 5.0, "segments": None}
+    ret = stitch([(first, 0.0), (silent, 10.0), (dict(first), 15.0)])
+
+    assert ret["duration"] == 25.0
+    assert [(s["id"], s["start"]) for s in ret["segments"]] == [(0, 0.0), (1, 15.0)]
+    assert "words" not in ret
+
+
+def test_stitch_single():
+    only = chunk("Hallo.", 3.0, [(0.0, 1.0, "Hallo.")])
+    assert stitch([(only, 0.0)]) == only
@@ -1,46 +1,423 @@
+import argparse
+import asyncio
+import difflib
 import json
 import os
+import random
+import subprocess
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
 
 import openai
 from tqdm import tqdm
 
+from easylang_de.audio import compress, speech_file, split_audio
+from easylang_de.cache import write_json_atomic
+from easylang_de.instrument import metrics
+
 DATA_DIR = "data"
 OUTPUT_DIR = "transcriptions"
 
-# Get all mp3 files in the current directory
-mp3_files = [
-    f for f in os.listdir(DATA_DIR) if os.path.isfile(f) and f.endswith(".mp3")
-]
+MODEL = "whisper-1"
+MAX_FILE_SIZE = 25 * 1024 * 1024
+
+# Number of requests that are in flight at the same time
+CONCURRENCY = 4
+MAX_RETRIES = 6
+# Backoff in seconds before retry n is BACKOFF_BASE * 2**n, capped at
+# BACKOFF_MAX, unless the API tells us how long to wait
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Word similarity of the transcripts of an original and its compressed file
+# below which --verify-sample reports the compression
+MIN_SIMILARITY = 0.9
 
-mp3_files = sorted(mp3_files)
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
 
-# Create the output directory if it doesn't exist
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
 
-for file in tqdm(mp3_files):
+def output_file(file: str, output_dir: str = OUTPUT_DIR) -> str:
     # Create json target file name in output directory
-    json_file = os.path.join(OUTPUT_DIR, file.replace(".mp3", ".json"))
+    return os.path.join(output_dir, file.replace(".mp3", ".json"))
+
+
+def pending_files(data_dir: str = DATA_DIR, output_dir: str = OUTPUT_DIR) -> List[str]:
+    """
+    Returns the mp3 files under data_dir that don't have a transcription yet.
+    Transcriptions are written atomically, so an existing one is complete.
+    """
+    # Get all mp3 files in the data directory
+    mp3_files = [
+        f
+        for f in os.listdir(data_dir)
+        if os.path.isfile(os.path.join(data_dir, f)) and f.endswith(".mp3")
+    ]
 
     # If the json file already exists, skip it
-    if os.path.exists(json_file):
-        print(f"Skipping {file} because {json_file} already exists")
-        continue
+    return sorted(
+        f for f in mp3_files if not os.path.exists(output_file(f, output_dir))
+    )
+
+
+def retry_delay(error: openai.APIError, attempt: int) -> float:
+    """
+    Returns how long to wait before retrying, honoring the Retry-After header of
+    rate limit responses
+    """
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+    # Add jitter so that the concurrent requests don't retry in lockstep
+    return delay * random.uniform(0.5, 1.0)
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def transcribe(
+    client: openai.AsyncOpenAI,
+    path: str,
+    semaphore: asyncio.Semaphore,
+    max_retries: int = MAX_RETRIES,
+) -> dict:
+    """
+    Transcribes an audio file to Whisper's verbose_json, retrying with
+    exponential backoff on rate limits and transient errors
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                # Read within the semaphore, so that only the files being
+                # uploaded are held in memory, not every pending one
+                data = await asyncio.to_thread(read_bytes, path)
+                metrics.count("upload.requests")
+                metrics.count("upload.bytes", len(data))
+                with metrics.stage("upload"):
+                    output = await client.audio.transcriptions.create(
+                        model=MODEL,
+                        file=(os.path.basename(path), data),
+                        response_format="verbose_json",
+                    )
+            return output.model_dump()
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            metrics.count("upload.retries")
+            await asyncio.sleep(retry_delay(e, attempt))
+
+
+def stitch(outputs: List[Tuple[dict, float]]) -> dict:
+    """
+    Joins the verbose_json transcriptions of consecutive chunks into one,
+    shifting the timestamps of each chunk by its offset in seconds
+    """
+    ret = dict(outputs[0][0])
+    ret["text"] = " ".join(output["text"].strip() for output, _ in outputs)
+    last_output, last_offset = outputs[-1]
+    ret["duration"] = last_offset + last_output["duration"]
+
+    for key in ["segments", "words"]:
+        if ret.get(key) is None:
+            continue
+
+        ret[key] = []
+        for output, offset in outputs:
+            # A chunk without speech, e.g. a silent tail, may have none
+            for item in output.get(key) or []:
+                item = dict(
+                    item, start=item["start"] + offset, end=item["end"] + offset
+                )
+                if key == "segments":
+                    item["id"] = len(ret[key])
+                    # Whisper's seek is in frames of 10 ms
+                    item["seek"] = item.get("seek", 0) + round(offset * 100)
+                ret[key].append(item)
+
+    return ret
+
+
+async def gather_or_cancel(*awaitables):
+    """
+    Like asyncio.gather, but cancels the other awaitables as soon as one
+    fails, so that their uploads don't go on for results that are dropped
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def transcribe_chunked(
+    client: openai.AsyncOpenAI,
+    path: str,
+    semaphore: asyncio.Semaphore,
+    max_retries: int = MAX_RETRIES,
+) -> dict:
+    """
+    Transcribes an audio file that is too large for one request by splitting it
+    at silences and transcribing the chunks concurrently
+    """
+    with tempfile.TemporaryDirectory() as chunk_dir:
+        with metrics.stage("split"):
+            chunks = await asyncio.to_thread(
+                split_audio, path, MAX_FILE_SIZE, chunk_dir
+            )
+        metrics.count("split.chunks", len(chunks))
+        outputs = await gather_or_cancel(
+            *[transcribe(client, chunk, semaphore, max_retries) for chunk, _ in chunks]
+        )
+
+    return stitch([(output, offset) for output, (_, offset) in zip(outputs, chunks)])
 
-    # Check if the file is greater than 25MB
-    if os.path.getsize(file) > 25 * 1024 * 1024:
-        print(f"Skipping {file} because it is greater than 25MB")
-        continue
 
-    print(f"Running {file}")
+async def transcribe_file(
+    client: openai.AsyncOpenAI,
+    file: str,
+    semaphore: asyncio.Semaphore,
+    data_dir: str = DATA_DIR,
+    output_dir: str = OUTPUT_DIR,
+    max_retries: int = MAX_RETRIES,
+    compress_executor: Optional[Executor] = None,
+    trim: bool = False,
+) -> Optional[str]:
+    """
+    Transcribes one mp3 file under data_dir to its JSON file in output_dir.
+    With compress_executor, the file is first compressed for speech in that
+    executor and the compressed file is uploaded. Returns the reason if the
+    file was skipped.
+    """
+    path = os.path.join(data_dir, file)
+
     try:
-        output = openai.Audio.transcribe(
-            model="whisper-1",
-            file=open(file, "rb"),
-            format="verbose_json",
+        if compress_executor is not None:
+            with metrics.stage("compress"):
+                path = await asyncio.get_running_loop().run_in_executor(
+                    compress_executor, partial(compress, path, trim=trim)
+                )
+
+        # Files greater than 25MB are split into chunks
+        if os.path.getsize(path) > MAX_FILE_SIZE:
+            output = await transcribe_chunked(client, path, semaphore, max_retries)
+        else:
+            output = await transcribe(client, path, semaphore, max_retries)
+    except openai.APIError as e:
+        metrics.count("errors")
+        return f"API error: {e}"
+    except subprocess.CalledProcessError as e:
+        metrics.count("errors")
+        return f"ffmpeg error: {e}"
+    except OSError as e:
+        # E.g. a file removed meanwhile, or ffmpeg not installed
+        metrics.count("errors")
+        return f"file error: {e}"
+
+    with metrics.stage("write"):
+        await asyncio.to_thread(
+            write_json_atomic, output_file(file, output_dir), output, 2
+        )
+    metrics.count("files")
+
+
+async def transcribe_all(
+    files: List[str],
+    data_dir: str = DATA_DIR,
+    output_dir: str = OUTPUT_DIR,
+    concurrency: int = CONCURRENCY,
+    max_retries: int = MAX_RETRIES,
+    base_url: Optional[str] = None,
+    compress_workers: int = 0,
+    trim: bool = False,
+    verify_sample: int = 0,
+    min_similarity: float = MIN_SIMILARITY,
+):
+    """
+    Transcribes the files with at most concurrency requests at the same time.
+    base_url points the client to another endpoint, e.g. a local stand-in
+    server. With compress_workers, the files are compressed for speech in a
+    pool of that many workers before uploading, and verify_sample of them are
+    also transcribed uncompressed to compare the transcripts, reporting the
+    ones less similar than min_similarity.
+    """
+    # Retries are done by transcribe, so that they respect the concurrency limit
+    client = openai.AsyncOpenAI(base_url=base_url, max_retries=0)
+    semaphore = asyncio.Semaphore(concurrency)
+    compress_executor = None
+    if compress_workers > 0:
+        compress_executor = ThreadPoolExecutor(compress_workers)
+
+    async def run(file):
+        skipped = await transcribe_file(
+            client,
+            file,
+            semaphore,
+            data_dir,
+            output_dir,
+            max_retries,
+            compress_executor,
+            trim,
+        )
+        return file, skipped
+
+    tasks = [asyncio.create_task(run(file)) for file in files]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+        file, skipped = await task
+        if skipped is not None:
+            tqdm.write(f"Skipping {file} because {skipped}")
+
+    if compress_executor is not None:
+        compress_executor.shutdown()
+        paths = [os.path.join(data_dir, f) for f in files]
+        paths = [path for path in paths if os.path.exists(speech_file(path, trim=trim))]
+        before = sum(os.path.getsize(path) for path in paths)
+        after = sum(os.path.getsize(speech_file(path, trim=trim)) for path in paths)
+        print(f"Compression saved {(before - after) / 2**20:.1f} MB of uploads")
+
+        if verify_sample > 0:
+            await verify_compression(
+                client,
+                files,
+                semaphore,
+                data_dir,
+                output_dir,
+                verify_sample,
+                min_similarity,
+            )
+
+    await client.close()
+
+
+async def verify_compression(
+    client: openai.AsyncOpenAI,
+    files: List[str],
+    semaphore: asyncio.Semaphore,
+    data_dir: str = DATA_DIR,
+    output_dir: str = OUTPUT_DIR,
+    sample: int = 5,
+    min_similarity: float = MIN_SIMILARITY,
+) -> List[str]:
+    """
+    Transcribes a random sample of the original files again and prints how
+    similar their transcripts are to the ones of the compressed files.
+    Returns the files less similar than min_similarity, which are reported.
+    """
+    files = [
+        f
+        for f in files
+        if os.path.exists(output_file(f, output_dir))
+        and os.path.getsize(os.path.join(data_dir, f)) <= MAX_FILE_SIZE
+    ]
+    files = random.sample(files, min(sample, len(files)))
+
+    outputs = await gather_or_cancel(
+        *[transcribe(client, os.path.join(data_dir, f), semaphore) for f in files]
+    )
+    dissimilar = []
+    for file, original in zip(files, outputs):
+        with open(output_file(file, output_dir)) as f:
+            compressed = json.load(f)
+
+        similarity = difflib.SequenceMatcher(
+            None, original["text"].split(), compressed["text"].split()
+        ).ratio()
+        print(f"Word similarity {similarity:.3f}: {file}")
+        if similarity < min_similarity:
+            dissimilar.append(file)
+
+    if dissimilar:
+        metrics.count("verify.dissimilar", len(dissimilar))
+        print(
+            f"Warning: {len(dissimilar)} of {len(files)} compressed files are "
+            f"below the similarity of {min_similarity}, the compression may "
+            "hurt the transcription"
+        )
+    return dissimilar
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Transcribe the downloaded audio files with Whisper"
+    )
+    parser.add_argument("--data-dir", type=str, default=DATA_DIR)
+    parser.add_argument("--output-dir", type=str, default=OUTPUT_DIR)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help="Maximum number of requests in flight",
+    )
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES)
+    parser.add_argument(
+        "--base-url",
+        type=str,
+        default=None,
+        help="Use another OpenAI-compatible endpoint, e.g. a local test server",
+    )
+    parser.add_argument(
+        "--compress-workers",
+        type=int,
+        default=0,
+        help="Compress the audio for speech with this many workers before uploading",
+    )
+    parser.add_argument(
+        "--trim", action="store_true", help="Trim the trailing silence when compressing"
+    )
+    parser.add_argument(
+        "--verify-sample",
+        type=int,
+        default=0,
+        help="Also transcribe this many original files and compare the transcripts",
+    )
+    parser.add_argument(
+        "--min-similarity",
+        type=float,
+        default=MIN_SIMILARITY,
+        help="Word similarity below which a verified file is reported",
+    )
+    parser.add_argument(
+        "--metrics", type=str, help="Save the timings and counters to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # Create the output directory if it doesn't exist
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    mp3_files = pending_files(args.data_dir, args.output_dir)
+    print(f"Transcribing {len(mp3_files)} files")
+
+    asyncio.run(
+        transcribe_all(
+            mp3_files,
+            args.data_dir,
+            args.output_dir,
+            args.concurrency,
+            args.max_retries,
+            args.base_url,
+            args.compress_workers,
+            args.trim,
+            args.verify_sample,
+            args.min_similarity,
         )
-        output = output.to_dict()
-        json.dump(output, open(json_file, "w"), indent=2)
-    except openai.error.APIError:
-        print(f"Skipping {file} because of API error")
-        continue
+    )
+
+    if args.metrics:
+        metrics.write(args.metrics)